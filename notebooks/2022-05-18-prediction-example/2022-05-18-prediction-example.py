@@ -65,7 +65,6 @@ import branca
 import folium
 import geopandas as gpd
 import pandas as pd
-from shapely import wkt
 
 sys.path.append("../../")
 
@@ -169,7 +168,7 @@ def aggregate_preds(
     df = geom_utils.generate_bboxes(
         df, bbox_size_km=BBOX_SIZE_KM, geometry_col="geometry"
     )
-    gdf = gpd.GeoDataFrame(df, geometry=df["geometry"].apply(lambda x: wkt.loads(x)))
+    gdf = gpd.GeoDataFrame(df, geometry="geometry")
 
     # Get the average predicted value per tile
     gdf = gdf.dissolve(by=[ID_COL], aggfunc="mean")
@@ -0,0 +1,100 @@
+import time
+
+import click
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from src.data_processing import feature_collection_pipeline
+
+
+def generate_hourly_df(n_locations, start_date, end_date, id_col, seed):
+    # Mimics the raw rows returned by GEE (e.g. hourly ERA5 readings) for every location
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(
+        start_date, pd.Timestamp(end_date) + pd.Timedelta(hours=23), freq="H"
+    )
+    return pd.DataFrame(
+        {
+            id_col: np.repeat(np.arange(n_locations), len(times)),
+            "time": np.tile(times.values, n_locations),
+            "temperature_2m": rng.normal(300, 5, n_locations * len(times)),
+        }
+    )
+
+
+def time_fn(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@click.command()
+@click.option("--n-locations", default=1000, help="Number of locations to simulate.")
+@click.option("--start-date", default="2021-01-01")
+@click.option("--end-date", default="2021-12-31")
+@click.option("--repeats", default=3, help="Number of runs per step (best is kept).")
+@click.option("--seed", default=42)
+def main(n_locations, start_date, end_date, repeats, seed):
+    """Benchmarks object-dtype (python date) vs datetime64 day keys on the pipeline's groupby and merge steps."""
+    id_col = "id"
+    locations_df = pd.DataFrame(
+        {
+            id_col: np.arange(n_locations),
+            "latitude": np.linspace(5, 20, n_locations),
+            "longitude": np.linspace(97, 105, n_locations),
+        }
+    )
+    hourly_df = generate_hourly_df(n_locations, start_date, end_date, id_col, seed)
+    logger.info(
+        f"Simulated {len(hourly_df):,} hourly rows for {n_locations:,} locations"
+    )
+
+    base_df = feature_collection_pipeline.generate_locations_with_dates_df(
+        locations_df, start_date, end_date, id_col=id_col, date_col="date"
+    )
+
+    key_fns = {
+        "object (dt.date)": lambda s: s.dt.date,
+        "datetime64 (dt.normalize)": lambda s: s.dt.normalize(),
+    }
+
+    results = []
+    for key_name, key_fn in key_fns.items():
+        raw_df = hourly_df.assign(date=key_fn(hourly_df["time"]))
+        left_df = base_df.assign(date=key_fn(base_df["date"]))
+
+        def groupby_step():
+            return raw_df.groupby(["date", id_col], as_index=False).agg(
+                temperature_2m_mean=("temperature_2m", "mean"),
+                temperature_2m_max=("temperature_2m", "max"),
+            )
+
+        daily_df = groupby_step()
+
+        def merge_step():
+            return left_df.merge(daily_df, on=[id_col, "date"], how="left")
+
+        def sort_step():
+            return left_df.sort_values(by=[id_col, "date"])
+
+        results.append(
+            {
+                "key": key_name,
+                "groupby_s": time_fn(groupby_step, repeats),
+                "merge_s": time_fn(merge_step, repeats),
+                "sort_s": time_fn(sort_step, repeats),
+            }
+        )
+
+    results_df = pd.DataFrame(results).set_index("key")
+    speedup = results_df.iloc[0] / results_df.iloc[1]
+    results_df.loc["speedup (x)"] = speedup
+    logger.info(f"\n{results_df.round(3).to_string()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import time
+
+import click
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from loguru import logger
+from shapely.geometry import box
+
+from src.data_processing import admin_bounds, geom_utils
+
+
+def generate_locations(n_rows, seed=42):
+    # Random points over Thailand
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "id": np.arange(n_rows),
+            "latitude": rng.uniform(5.6, 20.5, n_rows),
+            "longitude": rng.uniform(97.3, 105.6, n_rows),
+        }
+    )
+
+
+def generate_admin_bounds(n_cells=20):
+    # A grid of n_cells x n_cells rectangular "admin areas" covering the same extent as the locations
+    xs = np.linspace(97.3, 105.6, n_cells + 1)
+    ys = np.linspace(5.6, 20.5, n_cells + 1)
+    cells = [
+        (f"ADM{i * n_cells + j:04d}", box(xs[i], ys[j], xs[i + 1], ys[j + 1]))
+        for i in range(n_cells)
+        for j in range(n_cells)
+    ]
+    return gpd.GeoDataFrame(
+        {"ADM_PCODE": [pcode for pcode, _ in cells]},
+        geometry=[geometry for _, geometry in cells],
+        crs="EPSG:4326",
+    )
+
+
+def legacy_convert_latlon_to_geometry(df, lat_col="latitude", lon_col="longitude"):
+    # Previous implementation: a WKT string per row, parsed back into points
+    df = df.copy()
+    df["geometry"] = (
+        "POINT(" + df[lon_col].astype("str") + " " + df[lat_col].astype("str") + ")"
+    )
+    df.drop(columns=[lat_col, lon_col], inplace=True)
+    return gpd.GeoDataFrame(df, geometry=gpd.GeoSeries.from_wkt(df["geometry"]))
+
+
+def legacy_generate_bboxes(locations_df, bbox_size_km):
+    # Previous implementation: a row-wise apply building one WKT string per location
+    locations_df = locations_df.copy()
+    locations_df["geometry"] = locations_df.apply(
+        lambda row: geom_utils.generate_bbox_wkt(
+            row["latitude"], row["longitude"], distance_km=bbox_size_km
+        ),
+        axis=1,
+    )
+    return locations_df
+
+
+def legacy_join_admin_bounds(base_df, admin_bounds_gdf):
+    # Previous implementation: a point-in-polygon test for every row
+    base_gdf = gpd.GeoDataFrame(
+        base_df,
+        geometry=gpd.points_from_xy(base_df["longitude"], base_df["latitude"]),
+        crs="EPSG:4326",
+    )
+    cols_unique_to_adm_bounds = admin_bounds_gdf.columns.difference(
+        base_gdf.columns
+    ).tolist() + ["geometry"]
+    admin_bounds_gdf = admin_bounds_gdf[cols_unique_to_adm_bounds]
+    base_gdf = gpd.sjoin(base_gdf, admin_bounds_gdf, predicate="within", how="left")
+    base_gdf.drop(["index_right"], axis=1, inplace=True)
+    return base_gdf
+
+
+def time_fn(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option(
+    "--n-rows",
+    default="10000,100000,1000000",
+    help="Comma-separated table sizes to benchmark.",
+)
+@click.option(
+    "--max-legacy-rows",
+    default=100000,
+    help="The (slow) legacy implementations are skipped for tables larger than this.",
+)
+@click.option(
+    "--n-days",
+    default=30,
+    help="join_admin_bounds is run on a daily table (n_rows / n_days locations x n_days), like the generated base table.",
+)
+@click.option("--bbox-size-km", default=1.0)
+def main(n_rows, max_legacy_rows, n_days, bbox_size_km):
+    """Benchmarks convert_latlon_to_geometry, generate_bboxes, and join_admin_bounds on simulated locations."""
+    admin_bounds_gdf = generate_admin_bounds()
+
+    results = []
+    for n in [int(n) for n in n_rows.split(",")]:
+        locations_df = generate_locations(n)
+        daily_df = locations_df.iloc[
+            np.repeat(np.arange(max(n // n_days, 1)), n_days)
+        ].reset_index(drop=True)
+        run_legacy = n <= max_legacy_rows
+
+        steps = {
+            "convert_latlon_to_geometry": lambda: geom_utils.convert_latlon_to_geometry(
+                locations_df
+            ),
+            "generate_bboxes": lambda: geom_utils.generate_bboxes(
+                locations_df, bbox_size_km
+            ),
+            "join_admin_bounds": lambda: admin_bounds.join_admin_bounds(
+                daily_df, admin_bounds_gdf, id_col="id"
+            ),
+        }
+        legacy_steps = {
+            "convert_latlon_to_geometry": lambda: legacy_convert_latlon_to_geometry(
+                locations_df
+            ),
+            "generate_bboxes": lambda: legacy_generate_bboxes(
+                locations_df, bbox_size_km
+            ),
+            "join_admin_bounds": lambda: legacy_join_admin_bounds(
+                daily_df, admin_bounds_gdf
+            ),
+        }
+
+        for step, fn in steps.items():
+            result = {"n_rows": n, "step": step, "time_s": time_fn(fn)}
+            if run_legacy and step in legacy_steps:
+                result["legacy_time_s"] = time_fn(legacy_steps[step])
+            results.append(result)
+        logger.info(f"Done with {n:,} rows")
+
+    results_df = pd.DataFrame(results).set_index(["n_rows", "step"])
+    if "legacy_time_s" in results_df:
+        results_df["speedup (x)"] = results_df["legacy_time_s"] / results_df["time_s"]
+    logger.info(f"\n{results_df.round(3).to_string()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import click
+from loguru import logger
+
+REPO_DIR = Path(__file__).resolve().parents[2]
+ENTRY_POINTS = [
+    "scripts/collect_openaq.py",
+    "scripts/generate_features.py",
+    "scripts/train.py",
+    "scripts/predict.py",
+    "scripts/serve.py",
+]
+# Libraries that are slow to import, reported when an entry point imports them
+HEAVY_MODULES = [
+    "ee",
+    "geopandas",
+    "lightgbm",
+    "matplotlib",
+    "ray",
+    "scipy",
+    "shap",
+    "sklearn",
+    "tune_sklearn",
+    "xgboost",
+]
+# Runs an entry point's --help in a fresh interpreter, then prints the heavy modules it imported
+HELP_SNIPPET = """
+import contextlib, io, json, runpy, sys
+sys.argv = [{path!r}, "--help"]
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        runpy.run_path({path!r}, run_name="__main__")
+    except SystemExit:
+        pass
+print(json.dumps(sorted(m for m in {heavy_modules!r} if m in sys.modules)))
+"""
+
+
+def time_entry_point(path, n_repeats):
+    code = HELP_SNIPPET.format(path=path, heavy_modules=HEAVY_MODULES)
+    env = {**os.environ, "PYTHONPATH": str(REPO_DIR)}
+    timings = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=REPO_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        timings.append(time.perf_counter() - start)
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    return min(timings), json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@click.command()
+@click.option(
+    "--n-repeats", default=3, help="Timed runs per entry point (best is kept)."
+)
+def main(n_repeats):
+    """Benchmarks the startup time of each script entry point (running --help in a fresh interpreter).
+
+    Also lists the heavy libraries each one imports, so eager imports that sneak back in are easy to spot.
+    """
+    for path in ENTRY_POINTS:
+        best_s, heavy_modules = time_entry_point(path, n_repeats)
+        if best_s is None:
+            logger.warning(f"{path}: failed ({heavy_modules})")
+            continue
+        logger.info(
+            f"{path} --help: {best_s:.2f}s, imports {', '.join(heavy_modules) or 'no heavy libraries'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
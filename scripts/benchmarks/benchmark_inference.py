@@ -0,0 +1,80 @@
+import time
+
+import click
+import numpy as np
+import pandas as pd
+from lightgbm import LGBMRegressor
+from loguru import logger
+from sklearn.feature_selection import VarianceThreshold
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from xgboost import XGBRegressor
+
+from src.prediction import fast_inference
+
+
+def generate_features(n_rows, n_features, seed=42):
+    # Random features on different scales, with a constant column (dropped by the selector) and some missing values
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, n_features)) * rng.uniform(0.1, 100, n_features)
+    X[:, 0] = 1.0
+    X[rng.random(X.shape) < 0.05] = np.nan
+    return pd.DataFrame(X, columns=[f"feature_{i}" for i in range(n_features)])
+
+
+def time_predict(predict, X, n_repeats):
+    # Best of n_repeats, in rows per second
+    best_s = min(_time_once(predict, X) for _ in range(n_repeats))
+    return len(X) / best_s
+
+
+def _time_once(predict, X):
+    start = time.perf_counter()
+    predict(X)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option(
+    "--n-rows",
+    default="1000,100000,1000000",
+    help="Comma-separated batch sizes to predict on (small batches are dominated by per-call overhead).",
+)
+@click.option("--n-features", default=40, help="Number of feature columns.")
+@click.option("--n-estimators", default=300, help="Number of trees per model.")
+@click.option("--n-repeats", default=3, help="Timed runs per method (best is kept).")
+def main(n_rows, n_features, n_estimators, n_repeats):
+    """Benchmarks fast_inference.FusedPipeline against Pipeline.predict on [StandardScaler, VarianceThreshold, model] pipelines."""
+    X_train = generate_features(20000, n_features, seed=0)
+    y_train = np.nansum(X_train.values[:, 1:6], axis=1)
+    batch_sizes = [int(n) for n in n_rows.split(",")]
+
+    for model in [
+        XGBRegressor(n_estimators=n_estimators, n_jobs=-1),
+        LGBMRegressor(n_estimators=n_estimators, n_jobs=-1),
+    ]:
+        pipeline = Pipeline(
+            [
+                ("scaler", StandardScaler()),
+                ("selector", VarianceThreshold()),
+                ("model", model),
+            ]
+        ).fit(X_train, y_train)
+        fused = fast_inference.FusedPipeline.from_pipeline(pipeline)
+
+        for batch_size in batch_sizes:
+            X = generate_features(batch_size, n_features)
+            max_abs_diff = np.abs(pipeline.predict(X) - fused.predict(X)).max()
+            pipeline_rows_s = time_predict(pipeline.predict, X, n_repeats)
+            fused_rows_s = time_predict(fused.predict, X, n_repeats)
+
+            logger.info(
+                f"{type(model).__name__}: {batch_size:,} rows x {n_features} features, {n_estimators} trees\n"
+                f"  Pipeline.predict: {pipeline_rows_s:,.0f} rows/s\n"
+                f"  FusedPipeline.predict: {fused_rows_s:,.0f} rows/s ({fused_rows_s / pipeline_rows_s:.1f}x)\n"
+                f"  max abs diff: {max_abs_diff:.2e}"
+            )
+
+
+if __name__ == "__main__":
+    main()
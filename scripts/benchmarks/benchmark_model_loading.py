@@ -0,0 +1,120 @@
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import click
+import joblib
+import numpy as np
+import pandas as pd
+from lightgbm import LGBMRegressor
+from loguru import logger
+from sklearn.feature_selection import VarianceThreshold
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from xgboost import XGBRegressor
+
+from src.prediction import fast_inference
+
+# Loads a model in a fresh interpreter, so the time includes the imports a cold predict.py process pays for
+COLD_LOAD_SNIPPETS = {
+    "pickle": "import joblib; joblib.load('{path}')",
+    "artifact": "from src.prediction import fast_inference; fast_inference.load_artifact('{path}')",
+}
+
+
+def generate_features(n_rows, n_features, seed=42):
+    # Random features on different scales, with a constant column (dropped by the selector)
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, n_features)) * rng.uniform(0.1, 100, n_features)
+    X[:, 0] = 1.0
+    return pd.DataFrame(X, columns=[f"feature_{i}" for i in range(n_features)])
+
+
+def time_cold_load(kind, path, n_repeats):
+    code = COLD_LOAD_SNIPPETS[kind].format(path=path)
+    timings = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def time_warm_load(load_fn, path, n_repeats):
+    timings = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        load_fn(path)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def get_size_mb(path):
+    path = Path(path)
+    files = path.rglob("*") if path.is_dir() else [path]
+    return sum(f.stat().st_size for f in files if f.is_file()) / 1e6
+
+
+@click.command()
+@click.option("--n-features", default=40, help="Number of feature columns.")
+@click.option("--n-estimators", default=500, help="Number of trees per model.")
+@click.option("--n-repeats", default=3, help="Timed loads per method (best is kept).")
+def main(n_features, n_estimators, n_repeats):
+    """Benchmarks loading a model artifact (fast_inference.load_artifact) against loading the joblib pickle.
+
+    Cold loads run in a fresh interpreter (including imports), warm loads in this process.
+    """
+    X = generate_features(20000, n_features, seed=0)
+    y = np.nansum(X.values[:, 1:6], axis=1)
+
+    for model in [
+        XGBRegressor(n_estimators=n_estimators),
+        LGBMRegressor(n_estimators=n_estimators, verbose=-1),
+    ]:
+        pipeline = Pipeline(
+            [
+                ("scaler", StandardScaler()),
+                ("selector", VarianceThreshold()),
+                ("model", model),
+            ]
+        ).fit(X, y)
+        pipeline.feature_names = X.columns.tolist()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pickle_path = Path(tmp_dir) / "best_model.pkl"
+            artifact_path = Path(tmp_dir) / "best_model.artifact"
+            joblib.dump(pipeline, pickle_path)
+            fast_inference.save_artifact(
+                fast_inference.FusedPipeline.from_pipeline(pipeline), artifact_path
+            )
+
+            loaded = fast_inference.load_artifact(artifact_path)
+            max_abs_diff = np.abs(pipeline.predict(X) - loaded.predict(X)).max()
+
+            results = {
+                kind: {
+                    "size_mb": get_size_mb(path),
+                    "cold_s": time_cold_load(kind, path, n_repeats),
+                    "warm_s": time_warm_load(load_fn, path, n_repeats),
+                }
+                for kind, path, load_fn in [
+                    ("pickle", pickle_path, joblib.load),
+                    ("artifact", artifact_path, fast_inference.load_artifact),
+                ]
+            }
+
+        logger.info(
+            f"{type(model).__name__}: {n_features} features, {n_estimators} trees\n"
+            + "\n".join(
+                f"  {kind}: {result['size_mb']:.2f} MB, cold load (with imports) {result['cold_s']:.2f}s, "
+                f"warm load {result['warm_s'] * 1000:.1f}ms"
+                for kind, result in results.items()
+            )
+            + f"\n  max abs diff of the artifact's predictions: {max_abs_diff:.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import json
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+from loguru import logger
+from sklearn.feature_selection import VarianceThreshold
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from xgboost import XGBRegressor
+
+from src.prediction import fast_inference, predict_utils, service
+
+FEATURE_NAMES = ["total_population", "temperature_2m_mean", "AAI_mean", "NDVI_mean"]
+
+
+def generate_features_df(n_locations, n_days, seed=42):
+    # Daily features of random locations, as saved by generate_features.py
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2021-01-01", periods=n_days)
+    features_df = pd.DataFrame(
+        {
+            "id": np.repeat(np.arange(n_locations), n_days),
+            "latitude": np.repeat(rng.uniform(5, 20, n_locations), n_days),
+            "longitude": np.repeat(rng.uniform(97, 105, n_locations), n_days),
+            "date": np.tile(dates, n_locations),
+        }
+    )
+    for feature_name in FEATURE_NAMES:
+        features_df[feature_name] = rng.normal(size=len(features_df)) * rng.uniform(
+            1, 100
+        )
+    return features_df
+
+
+def train_model(features_df):
+    X = features_df[FEATURE_NAMES]
+    y = np.abs(X.values[:, :2].sum(axis=1))
+    pipeline = Pipeline(
+        [
+            ("scaler", StandardScaler()),
+            ("selector", VarianceThreshold()),
+            ("model", XGBRegressor(n_estimators=50)),
+        ]
+    ).fit(X, y)
+    pipeline.feature_names = FEATURE_NAMES
+    return fast_inference.fuse_pipeline(pipeline)
+
+
+def post(url, body):
+    # Returns the HTTP status and the JSON response
+    request = urllib.request.Request(url, data=body.encode())
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def post_rows(url, rows_df):
+    start = time.perf_counter()
+    status, payload = post(
+        url,
+        json.dumps({"rows": rows_df.to_dict(orient="records")}, default=str),
+    )
+    return status, payload, (time.perf_counter() - start) * 1000
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+    logger.info(f"OK: {message}")
+
+
+@click.command()
+@click.option("--n-locations", default=1000, help="Number of locations.")
+@click.option("--n-days", default=30, help="Number of days per location.")
+@click.option("--batch-size", default=1000, help="Rows per /predict request.")
+def main(n_locations, n_days, batch_size):
+    """Runs the prediction service (over HTTP) with a ReplayFeatureBackend on simulated features.
+
+    Checks the predictions against running the model directly, the feature cache hits, null predictions for
+    rows without features, and the 400 responses to invalid rows, and reports the cold and warm request latencies.
+    """
+    features_df = generate_features_df(n_locations, n_days)
+    model = train_model(features_df)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        features_path = Path(tmp_dir) / "features.parquet"
+        features_df.to_parquet(features_path, index=False)
+        feature_backend = service.ReplayFeatureBackend(features_path, "id")
+        prediction_service = service.PredictionService(model, feature_backend, "id")
+
+        server = service.make_server(prediction_service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/predict"
+
+        rows_df = features_df.sample(batch_size, random_state=0).reset_index(drop=True)
+        requests_df = rows_df[["id", "latitude", "longitude"]].assign(
+            date=rows_df["date"].dt.strftime("%Y-%m-%d")
+        )
+        expected = predict_utils.run_model(model, rows_df.copy())["predicted_pm2.5"]
+
+        status, cold_payload, cold_ms = post_rows(url, requests_df)
+        check(status == 200, "a valid request gets a 200 response")
+        preds_df = pd.DataFrame(cold_payload["predictions"])
+        check(
+            preds_df["id"].tolist() == requests_df["id"].tolist()
+            and preds_df["date"].tolist() == requests_df["date"].tolist(),
+            "the predictions are in the order of the requested rows",
+        )
+        check(
+            np.allclose(preds_df["predicted_pm2.5"].astype(float), expected),
+            "the predictions match running the model on the replayed features",
+        )
+
+        status, warm_payload, warm_ms = post_rows(url, requests_df)
+        check(
+            warm_payload == cold_payload,
+            "a repeated request gets the same predictions",
+        )
+        check(
+            feature_backend.n_calls == 1
+            and prediction_service.n_cache_hits == batch_size,
+            "a repeated request is served from the feature cache",
+        )
+
+        unknown_df = requests_df.head(2).assign(id=-1)
+        status, payload, _ = post_rows(
+            url, pd.concat([requests_df.head(2), unknown_df])
+        )
+        check(
+            status == 200
+            and [pred["predicted_pm2.5"] is None for pred in payload["predictions"]]
+            == [False, False, True, True],
+            "rows without features get a null prediction",
+        )
+
+        invalid_bodies = {
+            "a missing column": json.dumps(
+                {"rows": requests_df.head(1).drop(columns=["date"]).to_dict("records")}
+            ),
+            "an invalid date": json.dumps(
+                {
+                    "rows": requests_df.head(1)
+                    .assign(date="not a date")
+                    .to_dict("records")
+                }
+            ),
+            "an invalid latitude": json.dumps(
+                {"rows": requests_df.head(1).assign(latitude="x").to_dict("records")}
+            ),
+            "no rows": json.dumps({}),
+            "invalid JSON": "{",
+        }
+        for name, body in invalid_bodies.items():
+            status, payload = post(url, body)
+            check(
+                status == 400 and "error" in payload,
+                f"a request with {name} gets a 400 response",
+            )
+
+        server.shutdown()
+
+    logger.info(
+        f"{batch_size:,} rows per request, {len(features_df):,} replayed feature rows\n"
+        f"  cold request (features collected): {cold_ms:,.1f} ms\n"
+        f"  warm request (features cached): {warm_ms:,.1f} ms ({cold_ms / warm_ms:.1f}x)\n"
+        f"  stats: {prediction_service.get_stats()}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import click
+from loguru import logger
+
+from src.prediction import predict_utils, rollups
+
+
+@click.command()
+@click.option(
+    "--predictions-path",
+    required=True,
+    help="Predictions from scripts/predict.py: a CSV or Parquet file, or a folder of Parquet part files (--shard-size).",
+)
+@click.option(
+    "--out-dir",
+    required=True,
+    help="Folder to save the rollups to (replaced if it exists).",
+)
+@click.option("--id-col", default="id", help="Location ID column.")
+@click.option(
+    "--pred-cols",
+    default="predicted_pm2.5",
+    help="Comma-separated prediction columns to roll up.",
+)
+@click.option(
+    "--freq",
+    default=None,
+    help="If provided, means are computed per period of this pandas frequency (e.g. M for months) instead of over the whole range.",
+)
+@click.option(
+    "--zooms",
+    default=",".join(str(zoom) for zoom in rollups.DEFAULT_ZOOMS),
+    help="Comma-separated web mercator zoom levels to aggregate the tiles into.",
+)
+@click.option("--start-date", default=None, help="If provided, only from this date.")
+@click.option("--end-date", default=None, help="If provided, only up to this date.")
+@click.option(
+    "--bbox-size-km",
+    default=1,
+    type=float,
+    help="Size of the prediction tiles (for the tile geometries).",
+)
+def main(
+    predictions_path,
+    out_dir,
+    id_col,
+    pred_cols,
+    freq,
+    zooms,
+    start_date,
+    end_date,
+    bbox_size_km,
+):
+    """Precomputes the tile means and coarser map levels of the predictions (see src/prediction/rollups.py)."""
+    pred_cols = pred_cols.split(",")
+    results_df = predict_utils.read_feature_table(
+        predictions_path,
+        [id_col, "latitude", "longitude", "date"] + pred_cols,
+        id_col,
+        start_date=start_date,
+        end_date=end_date,
+    )
+    logger.info(f"Loaded {len(results_df):,} predictions from {predictions_path}")
+
+    rollups.write_rollups(
+        results_df,
+        out_dir,
+        id_col,
+        pred_cols,
+        freq=freq,
+        zooms=[int(zoom) for zoom in zooms.split(",")],
+        bbox_size_km=bbox_size_km,
+    )
+    logger.info(f"Saved rollups to {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,7 +20,12 @@ def preprocess_df(df):
 
     # Generate daily pm2.5 df (ground truth df)
     ground_truth_df = df.copy()
-    ground_truth_df["date"] = pd.to_datetime(ground_truth_df["date.utc"]).dt.date
+    # Keep the UTC date as a datetime64 day key (faster groupbys than python date objects)
+    ground_truth_df["date"] = (
+        pd.to_datetime(ground_truth_df["date.utc"], utc=True)
+        .dt.tz_convert(None)
+        .dt.normalize()
+    )
     ground_truth_df = ground_truth_df.groupby(
         ["date", "station_code"], as_index=False, group_keys=False
     ).agg(pm25_mean=("value", "mean"))
@@ -65,7 +70,7 @@ def main(country_code, start_date, end_date):
     print(f"Raw data saved to {raw_path}")
 
     ground_truth_df, station_list_df = preprocess_df(df)
-    ground_truth_df.to_csv(daily_pm25_path, index=False)
+    ground_truth_df.to_csv(daily_pm25_path, index=False, date_format="%Y-%m-%d")
     station_list_df.to_csv(station_list_path, index=False)
 
     print(f"Daily PM2.5 Ground Truth saved to {daily_pm25_path}")
@@ -1,12 +1,17 @@
 from datetime import datetime
 
 import click
-import geopandas as gpd
 import pandas as pd
 from loguru import logger
 
 from src.config import settings
-from src.data_processing import admin_bounds, feature_collection_pipeline
+from src.data_processing import (
+    admin_bounds,
+    feature_collection_pipeline,
+    hrsl,
+    job_manifest,
+    temporal,
+)
 
 
 @click.command()
@@ -44,6 +49,78 @@ from src.data_processing import admin_bounds, feature_collection_pipeline
     default="2021-12-31",
     help="Date to end collecting data",
 )
+@click.option(
+    "--native-cadence",
+    is_flag=True,
+    default=False,
+    help="If true, slow-moving features (HRSL population, NDVI composites) are saved at their native cadence in separate CSV files, "
+    "instead of being forward-filled into the daily base table. List these files under data_params.native_csv_paths when training.",
+)
+@click.option(
+    "--shard-size",
+    type=int,
+    default=None,
+    help="If provided, locations are processed in shards of this many locations, and each shard is saved to its own Parquet part file "
+    "under data/generated_data_<timestamp>/. Peak memory is then bounded by the shard size (use for national-scale grids).",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=None,
+    help="If provided, feature collection is split into (location shard, dataset, month) tasks recorded in a job manifest, "
+    "and run by this many worker processes. Use --shard-size to set the number of locations per task (default 100).",
+)
+@click.option(
+    "--out-dir",
+    default=None,
+    help="Folder for the Parquet part files when using --shard-size (default: data/generated_data_<timestamp>). "
+    "Pass the folder of an interrupted run to resume it: shards with a part file are skipped.",
+)
+@click.option(
+    "--job-dir",
+    default=None,
+    help="Folder for the job manifest and task outputs when using --workers. Pass the folder of a crashed run to resume it.",
+)
+@click.option(
+    "--hrsl-engine",
+    type=click.Choice(hrsl.HRSL_ENGINES),
+    default="zonal_stats",
+    help="How to compute the population sums. 'sat' precomputes a summed-area table of the HRSL tif once (cached next to it), "
+    "and is much faster than 'zonal_stats' for many locations.",
+)
+@click.option(
+    "--population-scales-km",
+    default=None,
+    help="Comma-separated bbox sizes (e.g. 1,3,5) for multi-scale population features (total_population_<k>km and population_density_<k>km), "
+    "computed from a single summed-area table of the HRSL tif.",
+)
+@click.option(
+    "--feature-store-dir",
+    default=None,
+    help="If provided, GEE features are kept in a feature store in this folder, so extending the date range or adding locations "
+    "only collects the missing (location, date) cells. Not used with --workers.",
+)
+@click.option(
+    "--neighbor-k",
+    type=int,
+    default=None,
+    help="If provided (with --ground-truth-csv), adds features from the ground truth of the k nearest other stations each day "
+    "(e.g. pm25_mean_knn5_mean), plus the distance to the nearest station. Not used with --workers.",
+)
+@click.option(
+    "--neighbor-radius-km",
+    type=float,
+    default=None,
+    help="If provided with --neighbor-k, also adds the number of other stations within this radius.",
+)
+@click.option(
+    "--temporal-features",
+    is_flag=True,
+    default=False,
+    help="If true, adds lag and rolling-window features (e.g. total_precipitation_daily_roll3d_mean, CAMS_AOD_055_mean_lag1d, "
+    "wind_run_km_roll3d_sum; see temporal.DEFAULT_TEMPORAL_CONFIG). Features are collected from a few days before --start-date "
+    "so the first windows are complete (except with --workers).",
+)
 @click.option(
     "--debug",
     is_flag=True,
@@ -58,9 +135,40 @@ def main(
     id_col,
     start_date,
     end_date,
+    native_cadence,
+    shard_size,
+    workers,
+    out_dir,
+    job_dir,
+    hrsl_engine,
+    population_scales_km,
+    feature_store_dir,
+    neighbor_k,
+    neighbor_radius_km,
+    temporal_features,
     debug,
 ):
     BBOX_SIZE_KM = 1
+    # Reject options the chosen mode would silently ignore
+    if workers:
+        check_unsupported_options(
+            "not with --workers",
+            ["out_dir", "feature_store_dir", "neighbor_k", "neighbor_radius_km"],
+        )
+    else:
+        check_unsupported_options("only with --workers", ["job_dir"])
+        if not shard_size:
+            check_unsupported_options("only with --shard-size", ["out_dir"])
+    if not ground_truth_csv:
+        check_unsupported_options(
+            "the neighbor features need --ground-truth-csv",
+            ["neighbor_k", "neighbor_radius_km"],
+        )
+    elif not neighbor_k:
+        check_unsupported_options("only with --neighbor-k", ["neighbor_radius_km"])
+
+    if population_scales_km:
+        population_scales_km = [float(k) for k in population_scales_km.split(",")]
 
     # Read in desired AOI locations
     # Assumed that the CSV has an id column, latitude, and longitude at the minimum.
@@ -70,39 +178,153 @@ def main(
         locations_df = locations_df[:2]
     assert {id_col, "latitude", "longitude"} <= set(locations_df.columns.tolist())
 
-    # Create base DF from the locations, date range, and features (HRSL + GEE data)
-    base_df = feature_collection_pipeline.collect_features_for_locations(
-        locations_df, start_date, end_date, id_col, hrsl_tif, bbox_size_km=BBOX_SIZE_KM
-    )
-
-    # Join ground truth if any
+    # Load ground truth and admin bounds (if any) once, so they can be joined to the full table or to each shard.
     if ground_truth_csv:
         logger.info(f"Generating dataset with ground truth from {ground_truth_csv}")
         ground_truth_df = pd.read_csv(ground_truth_csv)
-        ground_truth_df["date"] = pd.to_datetime(ground_truth_df["date"]).dt.date
-        base_df = base_df.merge(ground_truth_df, on=[id_col, "date"], how="left")
+        ground_truth_df["date"] = pd.to_datetime(ground_truth_df["date"])
     else:
         ground_truth_df = None
         logger.warning("Generating dataset without ground truth.")
 
-    # Join admin bounds if any
     if admin_bounds_shp:
         logger.info(f"Generating dataset with admin bounds from {admin_bounds_shp}")
-        admin_bounds_gdf = gpd.read_file(admin_bounds_shp)
-        base_df = admin_bounds.join_admin_bounds(base_df, admin_bounds_gdf)
+        # The lookup is built once and cached next to the shapefile, so later runs load it instantly
+        admin_lookup = admin_bounds.load_admin_lookup(admin_bounds_shp)
     else:
-        admin_bounds_gdf = None
+        admin_lookup = None
         logger.warning("No admin bounds provided.")
 
-    # Save outputs
+    temporal_config = temporal.DEFAULT_TEMPORAL_CONFIG if temporal_features else None
+
+    # Neighbor features from the ground truth of the nearest stations (never including the station itself)
+    if neighbor_k:
+        neighbor_config = {
+            "station_values_df": ground_truth_df.merge(
+                locations_df[[id_col, "latitude", "longitude"]], on=id_col
+            ),
+            "value_cols": ground_truth_df.columns.difference([id_col, "date"]).tolist(),
+            "k": neighbor_k,
+            "radius_km": neighbor_radius_km,
+        }
+    else:
+        neighbor_config = None
+
+    def join_ground_truth_and_admin_bounds(base_df):
+        # Join ground truth if any
+        if ground_truth_df is not None:
+            base_df = base_df.merge(ground_truth_df, on=[id_col, "date"], how="left")
+
+        # Join admin bounds if any
+        if admin_lookup is not None:
+            base_df = admin_bounds.join_admin_bounds(
+                base_df, id_col=id_col, admin_lookup=admin_lookup
+            )
+
+        return base_df
+
     run_timestamp = datetime.today().strftime("%Y-%m-%d_%H-%M-%S")
 
+    # Multi-process mode: workers run the tasks in the job manifest, then the outputs are merged into the base table.
+    if workers:
+        job_dir = job_dir or settings.DATA_DIR / f"generated_data_{run_timestamp}_job"
+        job_manifest.create_manifest(
+            job_dir,
+            locations_df,
+            start_date,
+            end_date,
+            id_col,
+            hrsl_tif,
+            bbox_size_km=BBOX_SIZE_KM,
+            hrsl_engine=hrsl_engine,
+            population_scales_km=population_scales_km,
+            shard_size=shard_size or 100,
+        )
+        job_manifest.run_workers(job_dir, n_workers=workers)
+        base_df = job_manifest.merge_outputs(
+            job_dir, expand_native=not native_cadence, temporal_config=temporal_config
+        )
+
+    # Sharded mode: each shard of locations is processed and saved to its own Parquet part file.
+    elif shard_size:
+        out_dir = out_dir or settings.DATA_DIR / f"generated_data_{run_timestamp}"
+        part_paths = feature_collection_pipeline.collect_features_for_locations_sharded(
+            locations_df,
+            start_date,
+            end_date,
+            id_col,
+            hrsl_tif,
+            out_dir=out_dir,
+            shard_size=shard_size,
+            shard_postprocessor=join_ground_truth_and_admin_bounds,
+            bbox_size_km=BBOX_SIZE_KM,
+            hrsl_engine=hrsl_engine,
+            population_scales_km=population_scales_km,
+            feature_store_dir=feature_store_dir,
+            neighbor_config=neighbor_config,
+            temporal_config=temporal_config,
+            expand_native=not native_cadence,
+        )
+        logger.info(
+            f"Generated base table for ML modelling in {len(part_paths)} part files. Saved to {out_dir}"
+        )
+        return
+
+    # Create base DF from the locations, date range, and features (HRSL + GEE data)
+    else:
+        base_df = feature_collection_pipeline.collect_features_for_locations(
+            locations_df,
+            start_date,
+            end_date,
+            id_col,
+            hrsl_tif,
+            bbox_size_km=BBOX_SIZE_KM,
+            hrsl_engine=hrsl_engine,
+            population_scales_km=population_scales_km,
+            feature_store_dir=feature_store_dir,
+            neighbor_config=neighbor_config,
+            temporal_config=temporal_config,
+            expand_native=not native_cadence,
+        )
+
+    if native_cadence:
+        base_df, native_dfs = base_df
+    else:
+        native_dfs = {}
+
+    base_df = join_ground_truth_and_admin_bounds(base_df)
+
+    # Save outputs
     out_filepath = f"generated_data_{run_timestamp}.csv"
-    base_df.to_csv(settings.DATA_DIR / out_filepath, index=False)
+    base_df.to_csv(
+        settings.DATA_DIR / out_filepath, index=False, date_format="%Y-%m-%d"
+    )
     logger.info(
         f"Generated base table for ML modelling with {len(base_df)} rows. Saved to {out_filepath}"
     )
 
+    for name, native_df in native_dfs.items():
+        name_sanitized = name.replace("/", "_")
+        native_filepath = f"generated_data_{run_timestamp}_{name_sanitized}.csv"
+        native_df.to_csv(
+            settings.DATA_DIR / native_filepath, index=False, date_format="%Y-%m-%d"
+        )
+        logger.info(
+            f"Saved native-cadence table {name} with {len(native_df)} rows to {native_filepath}"
+        )
+
+
+def check_unsupported_options(reason, option_names):
+    # Raises a usage error if any of the options were given (instead of silently ignoring them)
+    ctx = click.get_current_context()
+    given = [
+        "--" + name.replace("_", "-")
+        for name in option_names
+        if ctx.get_parameter_source(name) != click.core.ParameterSource.DEFAULT
+    ]
+    if given:
+        raise click.UsageError(f"Unsupported options: {', '.join(given)} ({reason})")
+
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,17 @@
 from datetime import datetime
+from functools import partial
+from pathlib import Path
 
 import click
+import geopandas as gpd
 import pandas as pd
 from loguru import logger
 
 from src.config import settings
-from src.data_processing import geom_utils
-from src.prediction import predict_utils
+from src.data_processing import geom_utils, hrsl
+from src.prediction import analytics, predict_utils, raster_output
+
+PRED_COL = "predicted_pm2.5"
 
 
 @click.command()
@@ -21,8 +26,10 @@ from src.prediction import predict_utils
 )
 @click.option(
     "--model-path",
-    default=settings.DATA_DIR / "latest_model.pkl",
-    help="Path to the PM2.5 regression model.",
+    multiple=True,
+    default=[settings.DATA_DIR / "latest_model.pkl"],
+    help="Path to the PM2.5 regression model (a pickle or a model artifact folder). "
+    "With --features-path, this can be repeated to compare several models on the same features.",
 )
 @click.option(
     "--hrsl-tif",
@@ -41,7 +48,9 @@ from src.prediction import predict_utils
 )
 @click.option(
     "--out-path",
-    help="Where to save the output.",
+    help="Where to save the output (a folder if --shard-size is provided). "
+    "For locations on a regular grid, a .tif or .nc path saves the predictions as a compressed GeoTIFF or NetCDF "
+    "time stack (one band per day) instead of a CSV.",
 )
 @click.option(
     "--generate-bbox",
@@ -49,6 +58,85 @@ from src.prediction import predict_utils
     default=False,
     help="If true, script will augment the predictions file with the bounding box geometry for downstream purposes (e.g. viz).",
 )
+@click.option(
+    "--shard-size",
+    type=int,
+    default=None,
+    help="If provided, locations are processed in shards of this many locations to bound memory use. "
+    "Predictions are then saved as Parquet part files in the --out-path folder, as soon as each shard is done.",
+)
+@click.option(
+    "--window-freq",
+    default=None,
+    help="If provided with --shard-size (e.g. MS for months), each shard is also split into time windows of this pandas frequency, "
+    "and each (shard, window) chunk is saved to its own part file.",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes running the chunks of --shard-size in parallel. Re-run with the same --out-path to resume a failed run.",
+)
+@click.option(
+    "--hrsl-engine",
+    type=click.Choice(hrsl.HRSL_ENGINES),
+    default="zonal_stats",
+    help="How to compute the population sums. 'sat' precomputes a summed-area table of the HRSL tif once (cached next to it), "
+    "and is much faster than 'zonal_stats' for many locations.",
+)
+@click.option(
+    "--tile-registry-dir",
+    default=None,
+    help="If provided, static per-location features (e.g. population sums) are cached in a tile registry in this folder, "
+    "so later runs on the same grid only compute them for new locations.",
+)
+@click.option(
+    "--feature-store-dir",
+    default=None,
+    help="If provided, GEE features are kept in a feature store in this folder, "
+    "so later runs only collect the (location, date) cells that are missing from it.",
+)
+@click.option(
+    "--stations-csv",
+    default=None,
+    help="For models trained with neighbor features (generate_features.py --neighbor-k): the ground truth stations, "
+    "with the id column, latitude, and longitude.",
+)
+@click.option(
+    "--ground-truth-csv",
+    default=None,
+    help="For models trained with neighbor features: the daily ground truth of the --stations-csv stations.",
+)
+@click.option(
+    "--features-path",
+    default=None,
+    help="If provided, the models score this precomputed feature table instead of collecting features from GEE: "
+    "a CSV or Parquet file, or a folder of Parquet part files (e.g. from generate_features.py). "
+    "Only the columns the models use are read. --locations-csv is then optional, and filters the locations.",
+)
+@click.option(
+    "--native-features-paths",
+    default=None,
+    help="Comma-separated paths of native-cadence feature tables (e.g. from generate_features.py --native-cadence) "
+    "to expand onto the rows of --features-path.",
+)
+@click.option(
+    "--prediction-cache-dir",
+    default=None,
+    help="If provided, predictions are cached in this folder, keyed by the model, feature version, location, and date, "
+    "so later runs over overlapping periods only predict the missing (location, date) cells. A new model starts a new cache.",
+)
+@click.option(
+    "--summary-dir",
+    default=None,
+    help="If provided, per-tile and per-period summaries of the predictions (mean, percentiles, and days above each "
+    "AQI breakpoint) are saved as CSVs in this folder. With --shard-size, they're computed part file by part file.",
+)
+@click.option(
+    "--summary-freq",
+    default="M",
+    help="Pandas period frequency of the --summary-dir summaries (e.g. M for months, W for weeks).",
+)
 @click.option(
     "--debug",
     is_flag=True,
@@ -64,17 +152,152 @@ def main(
     end_date,
     out_path,
     generate_bbox,
+    shard_size,
+    window_freq,
+    workers,
+    hrsl_engine,
+    tile_registry_dir,
+    feature_store_dir,
+    stations_csv,
+    ground_truth_csv,
+    features_path,
+    native_features_paths,
+    prediction_cache_dir,
+    summary_dir,
+    summary_freq,
     debug,
 ):
     # This depends on the model. Our model is trained on agggregated features 1km x 1km around the station.
     BBOX_SIZE_KM = 1
 
-    locations_df = pd.read_csv(locations_csv)
+    if len(model_path) > 1 and not features_path:
+        raise click.UsageError(
+            "Several --model-path are only supported with --features-path"
+        )
+    if features_path:
+        check_unsupported_options(
+            "not with --features-path",
+            [
+                "hrsl_tif",
+                "hrsl_engine",
+                "tile_registry_dir",
+                "feature_store_dir",
+                "stations_csv",
+                "ground_truth_csv",
+                "prediction_cache_dir",
+                "shard_size",
+                "window_freq",
+                "workers",
+            ],
+        )
+    else:
+        if not locations_csv:
+            raise click.UsageError(
+                "--locations-csv is required (unless --features-path is given)"
+            )
+        check_unsupported_options(
+            "only with --features-path", ["native_features_paths"]
+        )
+    if shard_size:
+        check_unsupported_options("not with --shard-size", ["prediction_cache_dir"])
+        if raster_output.is_raster_path(out_path):
+            raise click.UsageError(
+                "--shard-size saves Parquet part files to an --out-path folder, not rasters"
+            )
+    else:
+        check_unsupported_options("only with --shard-size", ["window_freq", "workers"])
+
+    locations_df = pd.read_csv(locations_csv) if locations_csv else None
 
-    if debug:
+    if debug and locations_df is not None:
         logger.warning("Running in debug mode. Trying out on 2 locations only.")
         locations_df = locations_df[:2]
 
+    # Check that the locations are on a grid before predicting, so a raster output can't fail after the whole run
+    if raster_output.is_raster_path(out_path) and locations_df is not None:
+        try:
+            raster_output.detect_grid(
+                locations_df["latitude"], locations_df["longitude"]
+            )
+        except ValueError as e:
+            raise click.UsageError(str(e))
+
+    # Station values for the neighbor features (if the model uses them)
+    if stations_csv and ground_truth_csv:
+        stations_df = pd.read_csv(stations_csv)
+        ground_truth_df = pd.read_csv(ground_truth_csv)
+        neighbor_config = {
+            "station_values_df": ground_truth_df.merge(
+                stations_df[[id_col, "latitude", "longitude"]], on=id_col
+            )
+        }
+    elif stations_csv or ground_truth_csv:
+        raise click.UsageError(
+            "--stations-csv and --ground-truth-csv have to be given together"
+        )
+    else:
+        neighbor_config = None
+
+    # Module-level function (instead of a closure), so it can be sent to the worker processes
+    add_bboxes = partial(add_bbox_geometry, id_col=id_col, bbox_size_km=BBOX_SIZE_KM)
+
+    run_timestamp = datetime.today().strftime("%Y-%m-%d_%H-%M-%S")
+
+    # Precomputed features mode: the models score the feature table directly, without GEE.
+    if features_path:
+        results_df = predict_utils.predict_from_features(
+            features_path,
+            model_path,
+            id_col,
+            start_date=start_date,
+            end_date=end_date,
+            locations_df=locations_df,
+            native_paths=native_features_paths.split(",")
+            if native_features_paths
+            else None,
+            pred_col=PRED_COL,
+        )
+        save_results(
+            results_df, out_path, run_timestamp, add_bboxes if generate_bbox else None
+        )
+        if summary_dir:
+            save_summaries(results_df, summary_dir, id_col, summary_freq)
+        return
+
+    model_path = model_path[0]
+
+    # Sharded mode: predictions are written shard by shard as Parquet part files in the out_path folder.
+    if shard_size:
+        if not out_path:
+            out_path = settings.DATA_DIR / f"predictions_{run_timestamp}"
+        part_paths = predict_utils.predict_sharded(
+            locations_df,
+            start_date,
+            end_date,
+            id_col,
+            hrsl_tif,
+            model_path,
+            out_dir=out_path,
+            shard_size=shard_size,
+            window_freq=window_freq,
+            n_workers=workers,
+            bbox_size_km=BBOX_SIZE_KM,
+            hrsl_engine=hrsl_engine,
+            tile_registry_dir=tile_registry_dir,
+            feature_store_dir=feature_store_dir,
+            neighbor_config=neighbor_config,
+            pred_col=PRED_COL,
+            shard_postprocessor=add_bboxes if generate_bbox else None,
+        )
+        logger.info(f"Saved results to {len(part_paths)} part files in {out_path}")
+        if summary_dir:
+            # Streamed over the part files, so the predictions are never all loaded at once
+            chunks = analytics.iter_prediction_chunks(
+                out_path, [id_col, "date", PRED_COL]
+            )
+            save_summaries(chunks, summary_dir, id_col, summary_freq)
+        return
+
     results_df = predict_utils.predict(
         locations_df,
         start_date,
@@ -82,21 +305,105 @@ def main(
         id_col,
         hrsl_tif,
         model_path,
-        bbox_size_km=1,
-        pred_col="predicted_pm2.5",
+        bbox_size_km=BBOX_SIZE_KM,
+        pred_col=PRED_COL,
+        hrsl_engine=hrsl_engine,
+        tile_registry_dir=tile_registry_dir,
+        feature_store_dir=feature_store_dir,
+        neighbor_config=neighbor_config,
+        prediction_cache_dir=prediction_cache_dir,
     )
 
-    if generate_bbox:
-        logger.info(
-            f"Augmenting results with the bounding boxes ({BBOX_SIZE_KM}km x {BBOX_SIZE_KM}km)"
-        )
-        geom_utils.generate_bboxes(results_df, BBOX_SIZE_KM)
+    save_results(
+        results_df, out_path, run_timestamp, add_bboxes if generate_bbox else None
+    )
+    if summary_dir:
+        save_summaries(results_df, summary_dir, id_col, summary_freq)
+
+
+def check_unsupported_options(reason, option_names):
+    # Raises a usage error if any of the options were given (instead of silently ignoring them)
+    ctx = click.get_current_context()
+    given = [
+        "--" + name.replace("_", "-")
+        for name in option_names
+        if ctx.get_parameter_source(name) != click.core.ParameterSource.DEFAULT
+    ]
+    if given:
+        raise click.UsageError(f"Unsupported options: {', '.join(given)} ({reason})")
+
+
+def save_results(results_df, out_path, run_timestamp, postprocessor=None):
+    if raster_output.is_raster_path(out_path):
+        if postprocessor:
+            logger.warning("--generate-bbox is ignored for raster outputs")
+        try:
+            # (With --features-path, the locations are only known from the predictions)
+            locations = results_df[["latitude", "longitude"]].drop_duplicates()
+            raster_output.detect_grid(locations["latitude"], locations["longitude"])
+        except ValueError as e:
+            # Keep the predictions instead of losing the run
+            out_path = Path(out_path).with_suffix(".csv")
+            logger.warning(f"{e} Saving the predictions as CSV to {out_path}")
+        else:
+            save_rasters(results_df, out_path)
+            return
+
+    if postprocessor:
+        results_df = postprocessor(results_df)
 
     if not out_path:
-        run_timestamp = datetime.today().strftime("%Y-%m-%d_%H-%M-%S")
         out_path = settings.DATA_DIR / f"predictions_{run_timestamp}.csv"
-        logger.info(f"Saved results to {out_path}")
-        results_df.to_csv(out_path, index=False)
+    results_df.to_csv(out_path, index=False, date_format="%Y-%m-%d")
+    logger.info(f"Saved results to {out_path}")
+
+
+def save_rasters(results_df, out_path):
+    # One raster per prediction column (e.g. per model), named after it if there are several
+    pred_cols = [col for col in results_df.columns if col.startswith(PRED_COL)]
+    for pred_col in pred_cols:
+        raster_path = Path(out_path)
+        if len(pred_cols) > 1:
+            raster_path = raster_path.with_name(
+                f"{raster_path.stem}{pred_col[len(PRED_COL):]}{raster_path.suffix}"
+            )
+        raster_output.write_raster(results_df, raster_path, pred_col)
+        logger.info(f"Saved {pred_col} to {raster_path}")
+
+
+def save_summaries(results, summary_dir, id_col, freq):
+    """Saves the tile and period summaries of each prediction column (see analytics.summarize_predictions).
+
+    results is a DF of predictions, or an iterable of chunks of it (with the PRED_COL column only).
+    """
+    if isinstance(results, pd.DataFrame):
+        pred_cols = [col for col in results.columns if col.startswith(PRED_COL)]
+    else:
+        pred_cols = [PRED_COL]
+
+    summary_dir = Path(summary_dir)
+    summary_dir.mkdir(parents=True, exist_ok=True)
+    for pred_col in pred_cols:
+        summaries = analytics.summarize_predictions(
+            results, id_col, pred_col, freq=freq
+        )
+        for kind, summary_df in summaries.items():
+            summary_path = summary_dir / f"{kind}_summary{pred_col[len(PRED_COL):]}.csv"
+            summary_df.to_csv(summary_path, index=False, date_format="%Y-%m-%d")
+            logger.info(f"Saved the {kind} summary of {pred_col} to {summary_path}")
+
+
+def add_bbox_geometry(results_df, id_col, bbox_size_km):
+    logger.info(
+        f"Augmenting results with the bounding boxes ({bbox_size_km}km x {bbox_size_km}km)"
+    )
+    # The bboxes only depend on the location, so they're computed once per location and saved as WKT
+    bboxes_df = geom_utils.generate_bboxes(
+        results_df[[id_col, "latitude", "longitude"]].drop_duplicates(id_col),
+        bbox_size_km,
+    )
+    bboxes_df["geometry"] = gpd.GeoSeries(bboxes_df["geometry"]).to_wkt()
+    return results_df.merge(bboxes_df[[id_col, "geometry"]], on=id_col, how="left")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+from functools import partial
+
+import click
+import pandas as pd
+from loguru import logger
+
+from src.config import settings
+from src.data_processing import hrsl
+from src.prediction import service
+
+
+@click.command()
+@click.option(
+    "--model-path",
+    default=settings.DATA_DIR / "latest_model.pkl",
+    help="Path to the PM2.5 regression model.",
+)
+@click.option(
+    "--id-col",
+    default="id",
+    help="Key of the location IDs in the request rows.",
+)
+@click.option(
+    "--hrsl-tif",
+    default=settings.DATA_DIR / "tha_general_2020.tif",
+    help="Path to the HRSL tif file containing the population counts for the country.",
+)
+@click.option(
+    "--hrsl-engine",
+    type=click.Choice(hrsl.HRSL_ENGINES),
+    default="sat",
+    help="How to compute the population sums of new locations (see scripts/predict.py).",
+)
+@click.option(
+    "--tile-registry-dir",
+    default=None,
+    help="If provided, static per-location features are also cached in a tile registry in this folder (shared with other runs).",
+)
+@click.option(
+    "--feature-store-dir",
+    default=None,
+    help="If provided, GEE features are kept in a feature store in this folder (shared with other runs).",
+)
+@click.option(
+    "--stations-csv",
+    default=None,
+    help="For models trained with neighbor features (generate_features.py --neighbor-k): the ground truth stations, "
+    "with the id column, latitude, and longitude.",
+)
+@click.option(
+    "--ground-truth-csv",
+    default=None,
+    help="For models trained with neighbor features: the daily ground truth of the --stations-csv stations.",
+)
+@click.option(
+    "--replay-features-path",
+    default=None,
+    help="If provided, features are read from this saved features table (CSV or Parquet, e.g. from generate_features.py) "
+    "instead of being collected from GEE. Use for tests and offline runs.",
+)
+@click.option(
+    "--cache-size",
+    type=int,
+    default=1000000,
+    help="Max number of (location, date) feature rows kept in memory.",
+)
+@click.option("--host", default="127.0.0.1", help="Host to listen on.")
+@click.option("--port", type=int, default=8000, help="Port to listen on.")
+def main(
+    model_path,
+    id_col,
+    hrsl_tif,
+    hrsl_engine,
+    tile_registry_dir,
+    feature_store_dir,
+    stations_csv,
+    ground_truth_csv,
+    replay_features_path,
+    cache_size,
+    host,
+    port,
+):
+    # Station values for the neighbor features (if the model uses them)
+    if bool(stations_csv) != bool(ground_truth_csv):
+        raise click.UsageError(
+            "--stations-csv and --ground-truth-csv have to be given together"
+        )
+    if stations_csv and replay_features_path:
+        raise click.UsageError(
+            "--stations-csv and --ground-truth-csv are not used with --replay-features-path "
+            "(the replayed features already have the neighbor features)"
+        )
+    if stations_csv:
+        stations_df = pd.read_csv(stations_csv)
+        ground_truth_df = pd.read_csv(ground_truth_csv)
+        neighbor_config = {
+            "station_values_df": ground_truth_df.merge(
+                stations_df[[id_col, "latitude", "longitude"]], on=id_col
+            )
+        }
+    else:
+        neighbor_config = None
+
+    if replay_features_path:
+        logger.info(f"Serving features replayed from {replay_features_path}")
+        feature_backend_fn = lambda model: service.ReplayFeatureBackend(  # noqa: E731
+            replay_features_path, id_col
+        )
+    else:
+        feature_backend_fn = partial(
+            service.GEEFeatureBackend,
+            hrsl_tif=hrsl_tif,
+            id_col=id_col,
+            hrsl_engine=hrsl_engine,
+            tile_registry_dir=tile_registry_dir,
+            feature_store_dir=feature_store_dir,
+            neighbor_config=neighbor_config,
+        )
+
+    prediction_service = service.load_service(
+        model_path, feature_backend_fn, id_col, cache_size=cache_size
+    )
+    server = service.make_server(prediction_service, host=host, port=port)
+    logger.info(
+        f"Serving predictions on http://{host}:{port} (POST /predict, GET /stats)"
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,14 +7,13 @@ from datetime import datetime
 import click
 import joblib
 import pandas as pd
-import shap
 import yaml
 from loguru import logger
-from matplotlib import pyplot as plt
 
 from src.config import settings
 from src.config.models import ExperimentConfig
 from src.modelling import data_utils, eval_utils, model_utils
+from src.prediction import fast_inference
 
 
 @click.command()
@@ -36,6 +35,22 @@ def train(config_path):
     data_df = pd.read_csv(config.data_params.csv_path)
     logger.info(f"Loaded {len(data_df):,} rows from {config.data_params.csv_path}")
 
+    # Expand native-cadence features (if any) onto the daily rows
+    if config.data_params.native_csv_paths:
+        # (Imported here, since it pulls in ee, geopandas, and rasterio)
+        from src.data_processing import feature_collection_pipeline
+
+        native_dfs = {
+            path: pd.read_csv(path) for path in config.data_params.native_csv_paths
+        }
+        data_df = feature_collection_pipeline.expand_native_features(
+            data_df,
+            native_dfs,
+            id_col=config.data_params.id_col,
+            date_col=config.data_params.date_col,
+        )
+        logger.info(f"Expanded {len(native_dfs)} native-cadence tables onto the data")
+
     # Prepare features, target, spatial grps
     target_col = config.data_params.target_col
     feature_cols = config.data_params.infer_selected_features(data_df.columns)
@@ -96,6 +111,10 @@ def train(config_path):
 
     try:
         logger.info("Generating SHAP charts")
+        # shap and matplotlib are only imported here, so that e.g. --help starts quickly
+        import shap
+        from matplotlib import pyplot as plt
+
         # Generate feature importance
         # The cv.best_estimator_ is an sklearn pipeline object, generated by model_utils._get_pipeline
         # The pipeline steps are: [scaler, selector, model]
@@ -152,6 +171,20 @@ def train(config_path):
     with open(out_dir / "best_model_params.txt", "w") as f:
         print(str(cv.best_estimator_), file=f)
 
+    # Also export a compact artifact (native booster + arrays, no pickle) that loads quickly at prediction time
+    fused_model = fast_inference.fuse_pipeline(cv.best_estimator_)
+    if getattr(fused_model, "booster_type", None) in fast_inference.BOOSTER_FILENAMES:
+        model_hash = fast_inference.save_artifact(
+            fused_model,
+            out_dir / "best_model.artifact",
+            metadata={"target_col": target_col, "n_train_rows": len(X)},
+        )
+        logger.info(f"Exported model artifact {model_hash} to best_model.artifact")
+    else:
+        logger.warning(
+            "Only XGBoost and LightGBM models can be exported as artifacts. Use best_model.pkl."
+        )
+
     # Copy over config file so we keep track of the configuration
     with open(out_dir / "config.yaml", "w") as f:
         yaml.dump(raw_config_yaml, f, default_flow_style=False)
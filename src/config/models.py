@@ -14,6 +14,11 @@ class DataParams(BaseModel):
     impute_cols: Optional[list] = None
     impute_strategy: Optional[str] = None
     balance_target_label: Optional[str] = None
+    # Native-cadence feature tables (e.g. HRSL, NDVI composites) generated separately from the daily CSV.
+    # These are expanded onto the daily rows when the data is loaded.
+    native_csv_paths: List[str] = []
+    id_col: str = "station_code"
+    date_col: str = "date"
 
     def infer_selected_features(self, full_feature_list):
         if self.include_cols:
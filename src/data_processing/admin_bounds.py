@@ -1,22 +1,330 @@
+import json
+import os
+from pathlib import Path
+
 import geopandas as gpd
+import numpy as np
+import pandas as pd
+from loguru import logger
+from rasterio import features
+from rasterio.enums import MergeAlg
+from rasterio.transform import Affine
+
+# Integer key of each unique location, used to broadcast the admin bounds to all rows
+LOCATION_KEY_COL = "_location_key"
+
+# Row of each admin area in the lookup's attribute table
+ADMIN_INDEX_COL = "_admin_index"
+
+# Admin lookup grid codes (non-negative codes are admin indices)
+# Ambiguous cells touch a boundary (or overlapping areas), so their points need an exact test
+NO_ADMIN = -1
+AMBIGUOUS = -2
+
+# Padding (in degrees) of the areas changed by simplifying the admin bounds
+CHANGED_AREA_PADDING = 1e-9
+
+
+def join_admin_bounds(base_df, admin_bounds_gdf=None, id_col=None, admin_lookup=None):
+    """Joins the attributes of the admin bounds that each row's latitude/longitude falls within.
 
+    The point-in-polygon tests only run once per unique location (latitude/longitude, plus id_col if given),
+    and the results are broadcast to all the rows (e.g. one per location per day) through an integer key.
 
-def join_admin_bounds(base_df, admin_bounds_gdf):
+    Either the admin bounds GDF or an admin lookup (see load_admin_lookup) has to be given.
+    The lookup is much faster to load and query for detailed boundaries.
+    """
+    assert (admin_bounds_gdf is None) != (admin_lookup is None)
+
+    location_cols = ([id_col] if id_col else []) + ["latitude", "longitude"]
+    location_key = (
+        base_df.groupby(location_cols, sort=False, dropna=False).ngroup().values
+    )
+    # Groups are numbered in order of first appearance, so the first rows of each group line up with the keys
+    _, first_rows = np.unique(location_key, return_index=True)
+    locations_df = base_df.iloc[first_rows]
+    points = gpd.points_from_xy(locations_df["longitude"], locations_df["latitude"])
+
+    if admin_lookup is not None:
+        matches_df = query_admin_lookup(
+            admin_lookup, locations_df["longitude"], locations_df["latitude"]
+        )
+        attributes_df = admin_lookup["attributes"]
+        # First, we want to retain only the unique columns in the lookup to avoid duplicate columns (and consequent column renames).
+        attributes_df = attributes_df[attributes_df.columns.difference(base_df.columns)]
+        admin_df = attributes_df.reindex(matches_df[ADMIN_INDEX_COL].values)
+        admin_df.index = pd.Index(
+            matches_df[LOCATION_KEY_COL].values, name=LOCATION_KEY_COL
+        )
+    else:
+        locations_gdf = gpd.GeoDataFrame(
+            {LOCATION_KEY_COL: np.arange(len(locations_df))},
+            geometry=points,
+            crs="EPSG:4326",
+        )
+        # First, we want to retain only the unique columns in the right GDF to avoid duplicate columns (and consequent column renames).
+        cols_unique_to_adm_bounds = admin_bounds_gdf.columns.difference(
+            base_df.columns.tolist() + ["geometry"]
+        ).tolist() + ["geometry"]
+        admin_bounds_gdf = admin_bounds_gdf[cols_unique_to_adm_bounds]
+
+        # Perform the actual spatial join (sjoin uses the spatial index of the admin bounds)
+        locations_gdf = gpd.sjoin(
+            locations_gdf, admin_bounds_gdf, predicate="within", how="left"
+        )
+        admin_df = locations_gdf.drop(columns=["index_right", "geometry"]).set_index(
+            LOCATION_KEY_COL
+        )
+
+    # Broadcast the points and admin bounds to all rows
     base_gdf = gpd.GeoDataFrame(
-        base_df,
-        geometry=gpd.points_from_xy(base_df["longitude"], base_df["latitude"]),
+        base_df.assign(**{LOCATION_KEY_COL: location_key}),
+        geometry=points.take(location_key),
+        crs="EPSG:4326",
+    )
+    base_gdf = base_gdf.join(admin_df, on=LOCATION_KEY_COL, how="left")
+
+    return base_gdf.drop(columns=[LOCATION_KEY_COL])
+
+
+def build_admin_lookup(
+    admin_bounds_path,
+    lookup_path=None,
+    simplify_tolerance=0.0001,
+    grid_resolution=0.01,
+):
+    """Precomputes a lookup of the admin bounds that's fast to load and to query in bulk.
+
+    The following files are written:
+    - <lookup_path>.attributes.parquet: the attribute table of the admin bounds (without the geometries)
+    - <lookup_path>.polygons.parquet: the simplified polygons (GeoParquet)
+    - <lookup_path>.changed.parquet: the areas where the simplified and original polygons differ (GeoParquet)
+    - <lookup_path>.original.parquet: the original polygons (GeoParquet), for the points in the changed areas
+    - <lookup_path>.grid.npy: the admin index of each cell of a regular lat/lon grid over the admin bounds,
+      or NO_ADMIN / AMBIGUOUS for cells outside all the bounds / touching a boundary
+    - <lookup_path>.json: the grid transform, source file info, and the simplification tolerance used
+
+    The polygons are simplified to speed up the tests of points in ambiguous cells. Points can only be assigned
+    differently by a simplified polygon within the (symmetric) difference of the original and simplified polygons,
+    so query_admin_lookup tests the points in these changed areas against the original polygons instead.
+    The grid is rasterized from the original polygons. So the results always match the admin bounds file.
+
+    Returns the lookup_path prefix (defaults to <admin_bounds_path>.lookup).
+    """
+    lookup_path = Path(lookup_path or f"{admin_bounds_path}.lookup")
+    os.makedirs(lookup_path.parent, exist_ok=True)
+
+    logger.info(f"Building admin lookup for {admin_bounds_path}...")
+    admin_bounds_gdf = gpd.read_file(admin_bounds_path)
+    if admin_bounds_gdf.crs is not None:
+        admin_bounds_gdf = admin_bounds_gdf.to_crs("EPSG:4326")
+    admin_bounds_gdf = admin_bounds_gdf.reset_index(drop=True)
+
+    polygons_gdf = gpd.GeoDataFrame(
+        {ADMIN_INDEX_COL: np.arange(len(admin_bounds_gdf))},
+        geometry=admin_bounds_gdf.geometry.values,
         crs="EPSG:4326",
     )
-    # First, we want to retain only the unique columns in the right GDF to avoid duplicate columns (and consequent column renames).
-    cols_unique_to_adm_bounds = admin_bounds_gdf.columns.difference(
-        base_gdf.columns
-    ).tolist() + ["geometry"]
-    admin_bounds_gdf = admin_bounds_gdf[cols_unique_to_adm_bounds]
+    polygons_gdf = polygons_gdf[
+        polygons_gdf.geometry.notna() & ~polygons_gdf.geometry.is_empty
+    ]
+
+    original_gdf = polygons_gdf
+    polygons_gdf = original_gdf.assign(
+        geometry=original_gdf.geometry.simplify(
+            simplify_tolerance, preserve_topology=True
+        )
+    )
+    changed = original_gdf.geometry.symmetric_difference(polygons_gdf.geometry)
+    # (Padded a little, so points on the boundaries of the changed areas are tested against the originals too)
+    changed_gdf = gpd.GeoDataFrame(
+        geometry=gpd.GeoSeries(list(changed[~changed.is_empty]))
+        .buffer(CHANGED_AREA_PADDING)
+        .values,
+        crs="EPSG:4326",
+    )
+    minx, miny, maxx, maxy = original_gdf.total_bounds
+
+    # Rasterize the admin indices onto the grid (padded by one cell), marking the cells touching a boundary as ambiguous
+    transform = Affine(
+        grid_resolution,
+        0.0,
+        minx - grid_resolution,
+        0.0,
+        -grid_resolution,
+        maxy + grid_resolution,
+    )
+    out_shape = (
+        int(np.ceil((maxy - miny) / grid_resolution)) + 2,
+        int(np.ceil((maxx - minx) / grid_resolution)) + 2,
+    )
+    grid = features.rasterize(
+        zip(original_gdf.geometry, original_gdf[ADMIN_INDEX_COL]),
+        out_shape=out_shape,
+        transform=transform,
+        fill=NO_ADMIN,
+        dtype="int32",
+    )
+    n_covering = features.rasterize(
+        ((geometry, 1) for geometry in original_gdf.geometry),
+        out_shape=out_shape,
+        transform=transform,
+        fill=0,
+        all_touched=True,
+        merge_alg=MergeAlg.add,
+        dtype="int32",
+    )
+    touches_boundary = features.rasterize(
+        ((geometry, 1) for geometry in original_gdf.geometry.boundary),
+        out_shape=out_shape,
+        transform=transform,
+        fill=0,
+        all_touched=True,
+        dtype="uint8",
+    )
+    # Also mark the neighbours of boundary cells, in case a boundary runs exactly along a cell edge
+    grid[_dilate(touches_boundary == 1) | (n_covering > 1)] = AMBIGUOUS
+    np.save(f"{lookup_path}.grid.npy", grid)
+
+    pd.DataFrame(admin_bounds_gdf.drop(columns="geometry")).to_parquet(
+        f"{lookup_path}.attributes.parquet"
+    )
+    polygons_gdf.to_parquet(f"{lookup_path}.polygons.parquet")
+    changed_gdf.to_parquet(f"{lookup_path}.changed.parquet")
+    original_gdf.to_parquet(f"{lookup_path}.original.parquet")
+
+    metadata = {
+        "admin_bounds_path": str(admin_bounds_path),
+        "source_size": os.path.getsize(admin_bounds_path),
+        "source_mtime": os.path.getmtime(admin_bounds_path),
+        "simplify_tolerance": simplify_tolerance,
+        "transform": list(transform)[:6],
+        "ambiguous_cells": float((grid == AMBIGUOUS).mean()),
+    }
+    with open(f"{lookup_path}.json", "w") as f:
+        json.dump(metadata, f, indent=4)
+
+    return lookup_path
+
+
+def load_admin_lookup(admin_bounds_path, lookup_path=None):
+    """Loads the admin lookup of an admin bounds file, building it first if it doesn't exist or is out of date."""
+    lookup_path = Path(lookup_path or f"{admin_bounds_path}.lookup")
+
+    metadata = None
+    if Path(f"{lookup_path}.json").exists():
+        with open(f"{lookup_path}.json") as f:
+            metadata = json.load(f)
+
+    is_stale = (
+        metadata is None
+        or metadata["source_size"] != os.path.getsize(admin_bounds_path)
+        or metadata["source_mtime"] != os.path.getmtime(admin_bounds_path)
+        or not Path(f"{lookup_path}.changed.parquet").exists()
+    )
+    if is_stale:
+        build_admin_lookup(admin_bounds_path, lookup_path=lookup_path)
+        with open(f"{lookup_path}.json") as f:
+            metadata = json.load(f)
+
+    return {
+        "attributes": pd.read_parquet(f"{lookup_path}.attributes.parquet"),
+        "polygons": gpd.read_parquet(f"{lookup_path}.polygons.parquet"),
+        "grid": np.load(f"{lookup_path}.grid.npy", mmap_mode="r"),
+        "transform": Affine(*metadata["transform"]),
+        # Only loaded if there are points in ambiguous cells (see query_admin_lookup)
+        "changed_path": f"{lookup_path}.changed.parquet",
+        "original_path": f"{lookup_path}.original.parquet",
+    }
+
+
+def query_admin_lookup(admin_lookup, lons, lats):
+    """Finds the admin area that each point falls within.
+
+    Points in cells fully inside (or outside) the admin bounds are answered by the grid.
+    Only the points in ambiguous cells are tested against the simplified polygons, or against the original polygons
+    for the points where the simplification changed the polygons.
+
+    Returns:
+        dataframe: LOCATION_KEY_COL (the position of the point) and ADMIN_INDEX_COL (-1 if the point isn't within any admin area).
+            Points within several (overlapping) admin areas get one row per area.
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    grid, transform = admin_lookup["grid"], admin_lookup["transform"]
+
+    with np.errstate(invalid="ignore"):
+        cols = np.floor((lons - transform.c) / transform.a)
+        rows = np.floor((lats - transform.f) / transform.e)
+    in_grid = (
+        (cols >= 0) & (cols < grid.shape[1]) & (rows >= 0) & (rows < grid.shape[0])
+    )
+
+    codes = np.full(len(lons), NO_ADMIN, dtype=np.int64)
+    codes[in_grid] = grid[
+        rows[in_grid].astype(np.int64), cols[in_grid].astype(np.int64)
+    ]
+
+    matches_df = pd.DataFrame(
+        {LOCATION_KEY_COL: np.arange(len(lons)), ADMIN_INDEX_COL: codes}
+    )
+    ambiguous = codes == AMBIGUOUS
+    if ambiguous.any():
+        points_gdf = gpd.GeoDataFrame(
+            {LOCATION_KEY_COL: np.flatnonzero(ambiguous)},
+            geometry=gpd.points_from_xy(lons[ambiguous], lats[ambiguous]),
+            crs="EPSG:4326",
+        )
+        is_changed = _is_in_changed_area(points_gdf, admin_lookup)
+        ambiguous_df = pd.concat(
+            [
+                gpd.sjoin(
+                    points_gdf[~is_changed],
+                    admin_lookup["polygons"],
+                    predicate="within",
+                    how="left",
+                ),
+                gpd.sjoin(
+                    points_gdf[is_changed],
+                    _get_lookup_polygons(admin_lookup, "original"),
+                    predicate="within",
+                    how="left",
+                ),
+            ]
+        )[[LOCATION_KEY_COL, ADMIN_INDEX_COL]]
+        ambiguous_df[ADMIN_INDEX_COL] = (
+            ambiguous_df[ADMIN_INDEX_COL].fillna(NO_ADMIN).astype(np.int64)
+        )
+        matches_df = pd.concat([matches_df[~ambiguous], ambiguous_df])
+
+    return matches_df.sort_values(LOCATION_KEY_COL, kind="stable").reset_index(
+        drop=True
+    )
+
+
+def _dilate(mask):
+    # Grows a boolean mask by one cell in every direction (including diagonals)
+    padded = np.pad(mask, 1)
+    height, width = mask.shape
+    dilated = np.zeros_like(mask)
+    for row_offset in range(3):
+        for col_offset in range(3):
+            dilated |= padded[
+                row_offset : row_offset + height, col_offset : col_offset + width
+            ]
+    return dilated
+
 
-    # Perform the actual spatial join
-    base_gdf = gpd.sjoin(base_gdf, admin_bounds_gdf, predicate="within", how="left")
+def _is_in_changed_area(points_gdf, admin_lookup):
+    # Whether each point is in an area where the simplified polygons differ from the original ones
+    changed_gdf = _get_lookup_polygons(admin_lookup, "changed")
+    points_gdf = points_gdf.reset_index(drop=True)
+    matches = gpd.sjoin(points_gdf, changed_gdf, predicate="intersects").index
+    return np.isin(np.arange(len(points_gdf)), matches)
 
-    # Drop unnecessary columns generated by the sjoin
-    base_gdf.drop(["index_right"], axis=1, inplace=True)
 
-    return base_gdf
+def _get_lookup_polygons(admin_lookup, name):
+    # Loads the changed areas or original polygons of a lookup on first use
+    if name not in admin_lookup:
+        admin_lookup[name] = gpd.read_parquet(admin_lookup[f"{name}_path"])
+    return admin_lookup[name]
@@ -1,12 +1,21 @@
 import os
 from datetime import datetime
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from loguru import logger
 from tqdm.auto import tqdm
 
 from src.config import settings
-from src.data_processing import hrsl
+from src.data_processing import (
+    feature_store,
+    geom_utils,
+    hrsl,
+    neighbors,
+    temporal,
+    tile_registry,
+)
 from src.data_processing.gee import aod, era5, gee_utils, ndvi
 
 S5P_AAI_CONFIG = {
@@ -15,6 +24,7 @@ S5P_AAI_CONFIG = {
         "absorbing_aerosol_index",
     ],
     "preprocessors": [aod.aggregate_daily_s5p_aerosol],
+    "aggregations": aod.S5P_AAI_AGGREGATIONS,
 }
 
 
@@ -28,6 +38,7 @@ CAMS_AOD_CONFIG = {
         aod.rescale_cams_aod,
         aod.aggregate_daily_cams_aod,
     ],
+    "aggregations": aod.CAMS_AOD_AGGREGATIONS,
 }
 
 
@@ -35,15 +46,22 @@ MAIAC_AOD_CONFIG = {
     "collection_id": "MODIS/006/MCD19A2_GRANULES",  # Aerosol Optical Depth (AOD)
     "bands": ["Optical_Depth_047", "Optical_Depth_055"],
     "preprocessors": [aod.aggregate_daily_aod],
+    "aggregations": aod.MAIAC_AOD_AGGREGATIONS,
 }
 
 
 NDVI_CONFIG = {
     "collection_id": "MODIS/006/MOD13A2",  # Vegetation
     "bands": ["NDVI", "EVI"],
-    "preprocessors": [ndvi.aggregate_daily_ndvi],
+    "preprocessors": [ndvi.aggregate_ndvi_composites],
+    "aggregations": ndvi.NDVI_AGGREGATIONS,
+    # 16-day composites are stored as-is, and only expanded to daily values when merged into the base table.
+    "cadence": "native",
+    # Also collect the composite before the start date, so the first days have a value to carry forward
+    "lookback_days": 16,
 }
 
+
 ERA5_CONFIG = {
     "collection_id": "ECMWF/ERA5_LAND/HOURLY",  # Meteorological Variables
     "bands": [
@@ -55,8 +73,63 @@ ERA5_CONFIG = {
         "surface_pressure",
     ],
     "preprocessors": [era5.aggregate_daily_era5],
+    "aggregations": era5.ERA5_AGGREGATIONS,
+}
+
+# GEE dataset configs, by collection ID (e.g. for referring to datasets by name in job manifests)
+GEE_DATASET_CONFIGS = {
+    gee_dataset["collection_id"]: gee_dataset
+    for gee_dataset in [
+        S5P_AAI_CONFIG,
+        CAMS_AOD_CONFIG,
+        MAIAC_AOD_CONFIG,
+        NDVI_CONFIG,
+        ERA5_CONFIG,
+    ]
 }
 
+# Key under which the (static) HRSL population table is stored among the native-cadence tables.
+HRSL_KEY = "hrsl"
+HRSL_FEATURES = ["total_population"]
+
+
+def prune_gee_datasets(gee_datasets, feature_names):
+    """Narrows down the GEE dataset configs to what is needed to produce the given feature columns.
+
+    Unused aggregations and bands are dropped from each config, and datasets that don't produce any of the features are skipped entirely.
+    This cuts down on GEE calls, payload, and aggregation time (e.g. when predicting with a model that only uses a few features).
+
+    Returns the list of pruned dataset configs (copies; the originals are left untouched).
+    """
+    feature_names = set(feature_names)
+    pruned_datasets = []
+    for gee_dataset in gee_datasets:
+        aggregations = {
+            col: aggregation
+            for col, aggregation in gee_dataset["aggregations"].items()
+            if col in feature_names
+        }
+        if not aggregations:
+            logger.info(f"Skipping unused GEE dataset {gee_dataset['collection_id']}")
+            continue
+
+        used_bands = {band for band, _ in aggregations.values()}
+        pruned_datasets.append(
+            {
+                **gee_dataset,
+                "bands": [band for band in gee_dataset["bands"] if band in used_bands],
+                "aggregations": aggregations,
+            }
+        )
+
+    return pruned_datasets
+
+
+def uses_hrsl(feature_names):
+    return any(feature in HRSL_FEATURES for feature in feature_names) or bool(
+        hrsl.parse_population_scales(feature_names)
+    )
+
 
 def collect_features_for_locations(
     locations_df,
@@ -75,27 +148,92 @@ def collect_features_for_locations(
         NDVI_CONFIG,
         ERA5_CONFIG,
     ],
+    expand_native=True,
+    authenticate=True,
+    hrsl_engine="zonal_stats",
+    population_scales_km=None,
+    tile_registry_dir=None,
+    feature_store_dir=None,
+    neighbor_config=None,
+    temporal_config=None,
 ):
+    """Collects HRSL and GEE features for every location and date in the given range.
+
+    Slow-moving features (HRSL population, NDVI composites) are kept at their native cadence.
+    If expand_native is True (default), these are expanded onto the daily rows before returning the base table.
+    Otherwise, a tuple of (daily base table, dict of native-cadence tables) is returned, and the caller
+    can expand them later on with expand_native_features.
+
+    If hrsl_tif is None, the HRSL population features are skipped. See hrsl.collect_hrsl for the hrsl_engine options.
+    If population_scales_km is given (e.g. [1, 3, 5]), multi-scale population features are added as well (see hrsl.collect_hrsl_multiscale).
+    If tile_registry_dir is given, the population features are read from the tile registry there, and only computed for new locations
+    (see tile_registry.lookup_tiles).
+    If feature_store_dir is given, the GEE features are read from the feature store there, and only the missing (location, date)
+    cells are collected (see collect_gee_datasets_incremental).
+    If neighbor_config is given, features from the nearest stations are added as well. It's a dict of the kwargs of
+    neighbors.collect_neighbor_features, e.g. {"station_values_df": ground_truth_df, "value_cols": ["pm25_mean"], "k": 5}.
+    If temporal_config is given, lag and rolling-window features are added as well (see temporal.add_temporal_features).
+    Features are then collected from a few days before start_date, so the windows of the first days are complete.
+    """
+    # Collect the days before start_date that the temporal features look back on as well (trimmed at the end)
+    requested_start_date = start_date
+    if temporal_config:
+        lookback_days = temporal.get_lookback_days(temporal_config)
+        start_date = (
+            pd.Timestamp(start_date) - pd.Timedelta(days=lookback_days)
+        ).strftime("%Y-%m-%d")
+
     # Create DF with locations + start_date, end_date
     base_df = generate_locations_with_dates_df(
         locations_df, start_date, end_date, id_col=id_col, date_col=date_col
     )
 
     # Auth with GEE
-    logger.info("Authenticating with GEE...")
-    gee_utils.gee_auth()
+    if authenticate:
+        logger.info("Authenticating with GEE...")
+        gee_utils.gee_auth()
 
     # Compute HRSL stats
-    logger.info("Computing population sums...")
-    hrsl_df = hrsl.collect_hrsl(
-        locations_df, hrsl_tif, id_col=id_col, bbox_size_km=bbox_size_km
-    )
+    if hrsl_tif:
+        hrsl_df = collect_static_features(
+            locations_df,
+            hrsl_tif,
+            id_col,
+            bbox_size_km,
+            hrsl_engine=hrsl_engine,
+            population_scales_km=population_scales_km,
+            tile_registry_dir=tile_registry_dir,
+        )
+    else:
+        logger.info("No HRSL tif given, skipping population sums...")
+        hrsl_df = None
 
     # Collect GEE Datasets
     logger.info("Collecting GEE datasets...")
-    gee_dfs = collect_gee_datasets(
-        gee_datasets, start_date, end_date, locations_df, id_col=id_col
-    )
+    if feature_store_dir:
+        gee_dfs = collect_gee_datasets_incremental(
+            feature_store_dir,
+            gee_datasets,
+            start_date,
+            end_date,
+            locations_df,
+            id_col=id_col,
+        )
+    else:
+        gee_dfs = collect_gee_datasets(
+            gee_datasets, start_date, end_date, locations_df, id_col=id_col
+        )
+
+    if neighbor_config:
+        neighbor_df = neighbors.collect_neighbor_features(
+            locations_df,
+            id_col=id_col,
+            start_date=start_date,
+            end_date=end_date,
+            date_col=date_col,
+            **neighbor_config,
+        )
+        base_df = base_df.merge(neighbor_df, on=[id_col, date_col], how="left")
 
     if log_gee_dfs:
         log_key = log_key if log_key else datetime.today().strftime("%Y-%m-%d_%H-%M-%S")
@@ -108,42 +246,304 @@ def collect_features_for_locations(
             df.to_csv(
                 log_dir / f"{collection_name_sanitized}_{log_key}.csv",
                 index=False,
+                date_format="%Y-%m-%d",
             )
 
-    # Merge HRSL
-    # HRSL is a slow-moving feature, and so does not change depending on the date.
-    base_df = base_df.merge(hrsl_df, on=[id_col], how="left")
+    base_df = merge_features(
+        base_df,
+        hrsl_df,
+        gee_dfs,
+        gee_datasets,
+        id_col,
+        date_col=date_col,
+        expand_native=expand_native,
+        temporal_config=temporal_config,
+    )
+
+    if not temporal_config:
+        return base_df
+
+    # Drop the lookback days
+    def trim(base_df):
+        is_requested = base_df[date_col] >= pd.Timestamp(requested_start_date)
+        return base_df[is_requested].reset_index(drop=True)
 
-    # Merge GEE dfs
-    for _, gee_df in gee_dfs.items():
-        base_df = base_df.merge(gee_df, on=[id_col, date_col], how="left")
+    if not expand_native:
+        base_df, native_dfs = base_df
+        return trim(base_df), native_dfs
+    return trim(base_df)
+
+
+def collect_static_features(
+    locations_df,
+    hrsl_tif,
+    id_col,
+    bbox_size_km,
+    hrsl_engine="zonal_stats",
+    population_scales_km=None,
+    tile_registry_dir=None,
+):
+    """Returns the static (per-location) population features, read from the tile registry if tile_registry_dir is given."""
+    if not tile_registry_dir:
+        return collect_population_features(
+            locations_df,
+            hrsl_tif,
+            id_col,
+            bbox_size_km,
+            hrsl_engine=hrsl_engine,
+            population_scales_km=population_scales_km,
+        )
+
+    logger.info("Looking up population sums in the tile registry...")
+    return tile_registry.lookup_tiles(
+        locations_df,
+        id_col,
+        tile_registry_dir,
+        params={
+            "hrsl_tif": str(hrsl_tif),
+            "hrsl_tif_size": os.path.getsize(hrsl_tif),
+            "hrsl_tif_mtime": os.path.getmtime(hrsl_tif),
+            "bbox_size_km": bbox_size_km,
+            "hrsl_engine": hrsl_engine,
+            "population_scales_km": population_scales_km,
+        },
+        compute_fn=lambda new_locations_df: collect_population_features(
+            new_locations_df,
+            hrsl_tif,
+            id_col,
+            bbox_size_km,
+            hrsl_engine=hrsl_engine,
+            population_scales_km=population_scales_km,
+        ),
+    )
+
+
+def collect_population_features(
+    locations_df,
+    hrsl_tif,
+    id_col,
+    bbox_size_km,
+    hrsl_engine="zonal_stats",
+    population_scales_km=None,
+):
+    logger.info("Computing population sums...")
+    hrsl_df = hrsl.collect_hrsl(
+        locations_df,
+        hrsl_tif,
+        id_col=id_col,
+        bbox_size_km=bbox_size_km,
+        engine=hrsl_engine,
+    )
+    if population_scales_km:
+        logger.info(f"Computing population sums at {population_scales_km} km...")
+        multiscale_df = hrsl.collect_hrsl_multiscale(
+            locations_df,
+            hrsl_tif,
+            id_col=id_col,
+            bbox_sizes_km=population_scales_km,
+        )
+        hrsl_df = hrsl_df.merge(multiscale_df, on=[id_col], how="left")
+
+    return hrsl_df
+
+
+def merge_features(
+    base_df,
+    hrsl_df,
+    gee_dfs,
+    gee_datasets,
+    id_col,
+    date_col="date",
+    expand_native=True,
+    temporal_config=None,
+):
+    """Merges the HRSL and GEE feature tables onto the daily base table (see collect_features_for_locations).
+
+    If temporal_config is given, the lag and rolling-window features of the daily columns are added (see temporal.add_temporal_features).
+    """
+    # HRSL is a slow-moving feature, and so does not change depending on the date.
+    # Together with the native-cadence GEE datasets, it is kept out of the daily table.
+    native_collections = {
+        gee_dataset["collection_id"]
+        for gee_dataset in gee_datasets
+        if gee_dataset.get("cadence") == "native"
+    }
+    native_dfs = {HRSL_KEY: hrsl_df} if hrsl_df is not None else {}
+
+    # Merge daily GEE dfs
+    for collection, gee_df in gee_dfs.items():
+        if collection in native_collections:
+            native_dfs[collection] = gee_df
+        else:
+            base_df = base_df.merge(gee_df, on=[id_col, date_col], how="left")
 
     # Sort for easier eyebell checking
     base_df = base_df.sort_values(by=[id_col, date_col])
 
-    return base_df
+    if temporal_config:
+        base_df = temporal.add_temporal_features(
+            base_df, id_col, temporal_config, date_col=date_col
+        )
 
+    if not expand_native:
+        return base_df, native_dfs
 
-def generate_locations_with_dates_df(df, start_date, end_date, id_col, date_col):
-    # We create a dummy date column just so we can use the ffill technique to construct one row for each date per station.
-    df = df.copy()
-    df[date_col] = pd.to_datetime(start_date, format="%Y-%m-%d")
-    df = (
-        df.groupby([id_col])
-        .apply(
-            lambda x: x.set_index(date_col)
-            .reindex(pd.date_range(start=start_date, end=end_date))
-            .ffill()
-            .rename_axis(date_col)
-            .reset_index()
-        )
-        .droplevel(id_col)
+    return expand_native_features(base_df, native_dfs, id_col, date_col=date_col)
+
+
+def collect_features_for_locations_sharded(
+    locations_df,
+    start_date,
+    end_date,
+    id_col,
+    hrsl_tif,
+    out_dir,
+    shard_size=1000,
+    shard_postprocessor=None,
+    expand_native=True,
+    **kwargs,
+):
+    """Sharded (out-of-core) version of collect_features_for_locations.
+
+    Locations are split into shards of shard_size locations. Each shard runs through HRSL, GEE and the merge,
+    and its base table is written to its own Parquet part file (out_dir/part-00000.parquet, ...).
+    Only one shard is held in memory at a time, so peak memory is bounded by the shard size instead of the total number of locations.
+
+    If given, shard_postprocessor(shard_df) is applied to each shard's base table before it is written
+    (e.g. to join ground truth or run a model). If expand_native is False, the native-cadence tables
+    are written to their own sub-folders (out_dir/<table name>/part-00000.parquet, ...).
+
+    Part files that already exist are skipped, so an interrupted run can be resumed by re-running with the same out_dir and shard_size.
+
+    Returns the list of base table part paths.
+    """
+    out_dir = Path(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+
+    logger.info("Authenticating with GEE...")
+    gee_utils.gee_auth()
+
+    shards = split_into_shards(locations_df, shard_size)
+    part_paths = []
+    for shard_index, shard_df in enumerate(shards):
+        part_name = f"part-{shard_index:05d}.parquet"
+        part_path = out_dir / part_name
+        part_paths.append(part_path)
+
+        if part_path.exists():
+            logger.info(f"Shard {shard_index+1} / {len(shards)} already done, skipping")
+            continue
+
+        logger.info(
+            f"Collecting features for shard {shard_index+1} / {len(shards)} ({len(shard_df):,} locations)"
+        )
+        shard_base_df = collect_features_for_locations(
+            shard_df,
+            start_date,
+            end_date,
+            id_col,
+            hrsl_tif,
+            expand_native=expand_native,
+            authenticate=False,
+            **kwargs,
+        )
+
+        if not expand_native:
+            shard_base_df, native_dfs = shard_base_df
+            for name, native_df in native_dfs.items():
+                native_dir = out_dir / name.replace("/", "_")
+                os.makedirs(native_dir, exist_ok=True)
+                native_df.to_parquet(native_dir / part_name, index=False)
+
+        if shard_postprocessor:
+            shard_base_df = shard_postprocessor(shard_base_df)
+
+        # The base table part is written last, since its existence marks the shard as done.
+        shard_base_df.to_parquet(part_path, index=False)
+
+    return part_paths
+
+
+def split_into_shards(locations_df, shard_size):
+    # Keep shards in a deterministic order, so part files line up across (resumed) runs
+    return [
+        locations_df.iloc[start : start + shard_size]
+        for start in range(0, len(locations_df), shard_size)
+    ]
+
+
+def expand_native_features(base_df, native_dfs, id_col, date_col="date"):
+    """Expands native-cadence feature tables onto the daily rows of base_df.
+
+    Tables without a date column (e.g. HRSL population) are static per location, and are merged on id_col.
+    Tables with a date column (e.g. NDVI composites) are as-of joined per location,
+    so that each day takes the latest observation on or before it.
+    """
+    for _, native_df in native_dfs.items():
+        if date_col in native_df.columns:
+            base_df = asof_join_native_df(base_df, native_df, id_col, date_col)
+        else:
+            base_df = base_df.merge(native_df, on=[id_col], how="left")
+
+    return base_df.sort_values(by=[id_col, date_col]).reset_index(drop=True)
+
+
+def asof_join_native_df(base_df, native_df, id_col, date_col):
+    # merge_asof needs datetime-like keys sorted by the "on" column, so we join on a temporary key.
+    # (Dates may still be strings here, e.g. when the tables were read back from CSV.)
+    asof_key = "_asof_date"
+    left = base_df.assign(**{asof_key: pd.to_datetime(base_df[date_col])})
+    right = native_df.assign(**{asof_key: pd.to_datetime(native_df[date_col])})
+    right = right.drop(columns=[date_col])
+    right[id_col] = right[id_col].astype(left[id_col].dtype)
+
+    merged = pd.merge_asof(
+        left.sort_values(asof_key),
+        right.sort_values(asof_key),
+        on=asof_key,
+        by=id_col,
+        direction="backward",
     )
-    df[date_col] = df[date_col].dt.date
+
+    return merged.drop(columns=[asof_key])
+
+
+def generate_locations_with_dates_df(df, start_date, end_date, id_col, date_col):
+    # Construct one row for each date per location (sorted by location, then date).
+    # Dates are kept as datetime64 day keys so that downstream merges, groupbys and sorts stay vectorized.
+    dates = pd.date_range(start=start_date, end=end_date, freq="D")
+    if len(dates) == 0:
+        raise ValueError(
+            f"No dates between start_date {start_date} and end_date {end_date}"
+        )
+    df = df.sort_values(by=[id_col], kind="stable")
+    df = df.iloc[np.repeat(np.arange(len(df)), len(dates))].reset_index(drop=True)
+    df[date_col] = np.tile(dates.values, len(df) // len(dates))
     return df
 
 
-def collect_gee_datasets(gee_datasets, start_date, end_date, locations_df, id_col):
+def get_collection_start_date(gee_dataset, start_date):
+    # Native-cadence datasets are collected from lookback_days before start_date (see NDVI_CONFIG)
+    lookback_days = gee_dataset.get("lookback_days", 0)
+    return (pd.Timestamp(start_date) - pd.Timedelta(days=lookback_days)).strftime(
+        "%Y-%m-%d"
+    )
+
+
+def collect_gee_datasets(
+    gee_datasets,
+    start_date,
+    end_date,
+    locations_df,
+    id_col,
+    bbox_size_km=1,
+    apply_lookback=True,
+):
+    # Compute the bboxes of all locations at once, instead of per location and dataset
+    bbox_bounds = geom_utils.generate_bbox_bounds(
+        locations_df["latitude"], locations_df["longitude"], bbox_size_km
+    )
+
     gee_dfs = {}
     for gee_index, gee_dataset in enumerate(gee_datasets):
 
@@ -156,33 +556,44 @@ def collect_gee_datasets(gee_datasets, start_date, end_date, locations_df, id_co
         collection_id = gee_dataset["collection_id"]
         bands = gee_dataset["bands"]
         preprocessors = gee_dataset["preprocessors"]
+        dataset_start_date = (
+            get_collection_start_date(gee_dataset, start_date)
+            if apply_lookback
+            else start_date
+        )
 
         # For recording all dfs before concatenating later on
         all_dfs = []
 
         # Iterate through stations
-        for index, location in tqdm(locations_df.iterrows(), total=len(locations_df)):
+        for location_index, (index, location) in enumerate(
+            tqdm(locations_df.iterrows(), total=len(locations_df))
+        ):
             # Generate station data
             station_gee_values_df = gee_utils.generate_aoi_tile_data(
                 collection_id,
-                start_date,
+                dataset_start_date,
                 end_date,
                 location.latitude,
                 location.longitude,
+                size_km=bbox_size_km,
                 bands=bands,
                 cloud_filter=False,
+                bbox_bounds=bbox_bounds[location_index],
             )
 
             if len(station_gee_values_df) > 0:
 
                 # Set the ID so we can join back the data later on
-                station_gee_values_df[id_col] = location[id_col]
+                # (read from locations_df, since iterrows upcasts int IDs to float when mixed with lat/lon)
+                station_gee_values_df[id_col] = locations_df.at[index, id_col]
 
                 # Pre-process
                 params = {
-                    "start_date": start_date,
+                    "start_date": dataset_start_date,
                     "end_date": end_date,
                     "id_col": id_col,
+                    "aggregations": gee_dataset.get("aggregations"),
                 }
                 for preprocessor in preprocessors:
                     station_gee_values_df = preprocessor(station_gee_values_df, params)
@@ -194,6 +605,69 @@ def collect_gee_datasets(gee_datasets, start_date, end_date, locations_df, id_co
                     f"No GEE data ({collection_id}) collected for location with {id_col}={location[id_col]}."
                 )
 
+        if not all_dfs:
+            logger.warning(
+                f"No GEE data ({collection_id}) collected for any of the {len(locations_df)} locations."
+            )
+            continue
+
         gee_dfs[collection_id] = pd.concat(all_dfs, axis=0, ignore_index=True)
 
     return gee_dfs
+
+
+def collect_gee_datasets_incremental(
+    store_dir, gee_datasets, start_date, end_date, locations_df, id_col
+):
+    """Same as collect_gee_datasets, but backed by the feature store in store_dir.
+
+    Only the (location, date) cells not collected on previous runs are collected from GEE and added to the store.
+    Locations missing the same span of dates (e.g. all locations when extending the date range, or new locations)
+    are collected together. The requested features are then read back from the store.
+    """
+    ids = locations_df[id_col].unique()
+
+    gee_dfs = {}
+    for gee_dataset in gee_datasets:
+        collection_id = gee_dataset["collection_id"]
+        dataset_start_date = get_collection_start_date(gee_dataset, start_date)
+        coverage_df = feature_store.read_coverage(store_dir, gee_dataset, id_col)
+        missing_df = feature_store.find_missing_ranges(
+            coverage_df, locations_df, dataset_start_date, end_date, id_col
+        )
+        logger.info(
+            f"{collection_id}: {len(missing_df):,} / {len(ids):,} locations have dates to collect"
+        )
+
+        for (missing_start, missing_end), range_df in missing_df.groupby(
+            ["start_date", "end_date"]
+        ):
+            range_locations_df = locations_df[
+                locations_df[id_col].isin(range_df[id_col])
+            ].drop_duplicates(id_col)
+            new_gee_dfs = collect_gee_datasets(
+                [gee_dataset],
+                missing_start.strftime("%Y-%m-%d"),
+                missing_end.strftime("%Y-%m-%d"),
+                range_locations_df,
+                id_col=id_col,
+                apply_lookback=False,
+            )
+            if collection_id in new_gee_dfs:
+                feature_store.write_features(
+                    store_dir, gee_dataset, new_gee_dfs[collection_id]
+                )
+            feature_store.write_coverage(store_dir, gee_dataset, range_df)
+
+        gee_df = feature_store.read_features(
+            store_dir,
+            gee_dataset,
+            id_col,
+            start_date=dataset_start_date,
+            end_date=end_date,
+            ids=ids,
+        )
+        if gee_df is not None and len(gee_df) > 0:
+            gee_dfs[collection_id] = gee_df
+
+    return gee_dfs
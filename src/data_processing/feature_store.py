@@ -0,0 +1,229 @@
+"""Incremental store of the collected GEE features, keyed by (location, date, dataset, feature version).
+
+Layout (Parquet, partitioned by month so that date filters only touch the matching folders):
+
+    <store_dir>/<dataset key>/<feature version>/month=<YYYY-MM>/part-<timestamp>-<uuid>.parquet
+    <store_dir>/<dataset key>/<feature version>/_coverage/part-<timestamp>-<uuid>.parquet
+
+The feature version is a hash of the dataset config (bands, aggregations, preprocessors), so changing how a dataset
+is processed starts a new version instead of mixing features.
+
+The coverage parts record which (location, date range) cells were collected, including the ones GEE had no data for,
+so that only the missing cells are collected on later runs (see feature_collection_pipeline.collect_gee_datasets_incremental).
+"""
+import hashlib
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+COVERAGE_DIRNAME = "_coverage"
+WRITTEN_AT_COL = "_written_at"
+
+
+def get_dataset_key(gee_dataset):
+    return gee_dataset["collection_id"].replace("/", "_")
+
+
+def get_feature_version(gee_dataset):
+    config = {
+        "collection_id": gee_dataset["collection_id"],
+        "bands": gee_dataset["bands"],
+        "aggregations": gee_dataset.get("aggregations"),
+        "preprocessors": [
+            preprocessor.__name__ for preprocessor in gee_dataset["preprocessors"]
+        ],
+        "cadence": gee_dataset.get("cadence"),
+    }
+    config_json = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.md5(config_json.encode()).hexdigest()[:8]
+
+
+def get_dataset_dir(store_dir, gee_dataset):
+    return (
+        Path(store_dir)
+        / get_dataset_key(gee_dataset)
+        / get_feature_version(gee_dataset)
+    )
+
+
+def write_features(store_dir, gee_dataset, features_df, date_col="date"):
+    """Appends collected features to the store, one part file per month."""
+    write_month_parts(
+        get_dataset_dir(store_dir, gee_dataset), features_df, date_col=date_col
+    )
+
+
+def write_month_parts(dataset_dir, df, date_col="date"):
+    """Appends the rows of df to the month partitions of dataset_dir, one part file per month."""
+    part_name = _get_part_name()
+    df = df.assign(**{WRITTEN_AT_COL: time.time_ns()})
+
+    months = df[date_col].dt.strftime("%Y-%m")
+    for month, month_df in df.groupby(months):
+        out_path = Path(dataset_dir) / f"month={month}" / part_name
+        _write_parquet(month_df, out_path)
+
+
+def write_coverage(store_dir, gee_dataset, coverage_df):
+    """Records the (location, start_date, end_date) ranges that were collected. Write this after the features."""
+    out_path = (
+        get_dataset_dir(store_dir, gee_dataset) / COVERAGE_DIRNAME / _get_part_name()
+    )
+    _write_parquet(coverage_df, out_path)
+
+
+def read_coverage(store_dir, gee_dataset, id_col):
+    """Returns the collected (location, start_date, end_date) ranges, with overlapping and adjacent ranges merged."""
+    coverage_dir = get_dataset_dir(store_dir, gee_dataset) / COVERAGE_DIRNAME
+    if not coverage_dir.exists():
+        return pd.DataFrame(columns=[id_col, "start_date", "end_date"])
+
+    coverage_df = pd.read_parquet(coverage_dir).sort_values(
+        by=[id_col, "start_date"], kind="stable"
+    )
+
+    # Start a new range whenever there is a gap after all the previous ranges of the location
+    prev_end = (
+        coverage_df.groupby(id_col)["end_date"]
+        .cummax()
+        .groupby(coverage_df[id_col])
+        .shift()
+        .values
+    )
+    is_new_location = ~coverage_df[id_col].duplicated().values
+    is_gap = coverage_df["start_date"].values > prev_end + np.timedelta64(1, "D")
+    range_id = np.cumsum(is_new_location | is_gap)
+
+    return (
+        coverage_df.groupby(range_id)
+        .agg({id_col: "first", "start_date": "min", "end_date": "max"})
+        .reset_index(drop=True)
+    )
+
+
+def find_missing_ranges(coverage_df, locations_df, start_date, end_date, id_col):
+    """Finds the locations with dates in [start_date, end_date] that aren't covered yet.
+
+    Returns:
+        dataframe: id_col, start_date, end_date columns: the span of missing dates of each such location
+    """
+    dates = pd.date_range(start=start_date, end=end_date, freq="D")
+    ids = locations_df[id_col].unique()
+    cells_df = pd.DataFrame(
+        {id_col: np.repeat(ids, len(dates)), "date": np.tile(dates.values, len(ids))}
+    )
+
+    if len(coverage_df) > 0:
+        covered_df = cells_df.reset_index().merge(coverage_df, on=id_col)
+        is_covered = (covered_df["date"] >= covered_df["start_date"]) & (
+            covered_df["date"] <= covered_df["end_date"]
+        )
+        cells_df = cells_df.drop(index=covered_df.loc[is_covered, "index"].values)
+
+    return (
+        cells_df.groupby(id_col, sort=False)["date"]
+        .agg(start_date="min", end_date="max")
+        .reset_index()
+    )
+
+
+def read_features(
+    store_dir,
+    gee_dataset,
+    id_col,
+    start_date=None,
+    end_date=None,
+    ids=None,
+    date_col="date",
+):
+    """Reads the stored features of a dataset, optionally filtered by date range and location IDs.
+
+    The filters are pushed down to the Parquet reads: only the month folders in the date range are opened,
+    and row groups are skipped based on their date and ID statistics.
+
+    Returns None if nothing has been stored for the dataset (and feature version) yet.
+    """
+    return read_month_parts(
+        get_dataset_dir(store_dir, gee_dataset),
+        id_col,
+        start_date=start_date,
+        end_date=end_date,
+        ids=ids,
+        date_col=date_col,
+    )
+
+
+def read_month_parts(
+    dataset_dir,
+    id_col,
+    start_date=None,
+    end_date=None,
+    ids=None,
+    date_col="date",
+    key_cols=None,
+):
+    """Reads the rows written by write_month_parts (see read_features), keeping the latest row of each (id, date).
+
+    key_cols are the columns identifying a location (id_col by default, e.g. id_col, latitude, and longitude).
+
+    Returns None if dataset_dir doesn't exist yet.
+    """
+    dataset_dir = Path(dataset_dir)
+    if not dataset_dir.exists():
+        return None
+
+    dataset = ds.dataset(dataset_dir, format="parquet", partitioning="hive")
+    date_type = dataset.schema.field(date_col).type
+
+    filters = []
+    if start_date is not None:
+        start_date = pd.Timestamp(start_date)
+        filters += [
+            ds.field("month") >= start_date.strftime("%Y-%m"),
+            ds.field(date_col) >= pa.scalar(start_date, type=date_type),
+        ]
+    if end_date is not None:
+        end_date = pd.Timestamp(end_date)
+        filters += [
+            ds.field("month") <= end_date.strftime("%Y-%m"),
+            ds.field(date_col) <= pa.scalar(end_date, type=date_type),
+        ]
+    if ids is not None:
+        filters.append(ds.field(id_col).isin(list(ids)))
+
+    table_filter = None
+    for dataset_filter in filters:
+        table_filter = (
+            dataset_filter if table_filter is None else table_filter & dataset_filter
+        )
+
+    features_df = dataset.to_table(filter=table_filter).to_pandas()
+
+    # Cells collected more than once (e.g. overlapping runs) keep their latest values
+    return (
+        features_df.sort_values(by=WRITTEN_AT_COL, kind="stable")
+        .drop_duplicates(subset=(key_cols or [id_col]) + [date_col], keep="last")
+        .drop(columns=[WRITTEN_AT_COL, "month"])
+        .sort_values(by=[id_col, date_col])
+        .reset_index(drop=True)
+    )
+
+
+def _get_part_name():
+    # Time-ordered and unique across processes
+    return f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet"
+
+
+def _write_parquet(df, out_path):
+    os.makedirs(out_path.parent, exist_ok=True)
+    # Write to a temp file first, so a crash never leaves a partial part behind (.tmp files are ignored when reading)
+    tmp_path = out_path.parent / f".{out_path.name}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, out_path)
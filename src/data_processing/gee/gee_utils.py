@@ -4,7 +4,8 @@ import ee
 import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
-from haversine import Direction, inverse_haversine
+
+from src.data_processing import geom_utils
 
 
 def gee_auth():
@@ -37,6 +38,7 @@ def generate_aoi_tile_data(
     size_km=1,
     bands=None,
     cloud_filter=None,
+    bbox_bounds=None,
 ):
 
     """
@@ -49,13 +51,18 @@ def generate_aoi_tile_data(
     - latitude: Station latitude
     - longitude: Station longitude
     - bands: List of bands to get from GEE dataset
+    - bbox_bounds: Precomputed (minx, miny, maxx, maxy) of the bounding box (e.g. from geom_utils.generate_bbox_bounds for all stations at once).
+      If not provided, it's computed from the latitude, longitude, and size_km.
 
     Returns:
     - df: DataFrame of station data
     """
 
     # Generate bounding box
-    bbox = generate_bbox(latitude, longitude, size_km)
+    if bbox_bounds is not None:
+        bbox = ee.Geometry.Rectangle(list(bbox_bounds))
+    else:
+        bbox = generate_bbox(latitude, longitude, size_km)
 
     # Need to process by month to work within GEE limits
     # E.g. If start_date = 2021-12-01 and end_date = 2022-01-15
@@ -98,22 +105,14 @@ def generate_aoi_tile_data(
 
 
 def generate_bbox(centroid_lat, centroid_lon, distance_km, lon_lat=True):
-    centroid = (centroid_lat, centroid_lon)
-    top_left = inverse_haversine(
-        inverse_haversine(centroid, distance_km / 2, Direction.WEST),
-        distance_km / 2,
-        Direction.NORTH,
-    )
-    bottom_right = inverse_haversine(
-        inverse_haversine(centroid, distance_km / 2, Direction.EAST),
-        distance_km / 2,
-        Direction.SOUTH,
-    )
+    minx, miny, maxx, maxy = geom_utils.generate_bbox_bounds(
+        [centroid_lat], [centroid_lon], distance_km
+    )[0]
 
     if lon_lat:
-        bbox_coord_list = [top_left[1], top_left[0], bottom_right[1], bottom_right[0]]
+        bbox_coord_list = [minx, maxy, maxx, miny]
     else:
-        bbox_coord_list = [top_left[0], top_left[1], bottom_right[0], bottom_right[1]]
+        bbox_coord_list = [maxy, minx, miny, maxx]
 
     return ee.Geometry.Rectangle(bbox_coord_list)
 
@@ -1,47 +1,28 @@
-import pandas as pd
-
-
-def aggregate_daily_ndvi(ndvi_df, params):
-
-    start_date = params["start_date"]
-    end_date = params["end_date"]
+from src.data_processing.gee.preprocessors import (
+    aggregate_gee_data_daily,
+    get_aggregations,
+)
+
+NDVI_AGGREGATIONS = {
+    "NDVI_mean": ("NDVI", "mean"),
+    "NDVI_min": ("NDVI", "min"),
+    "NDVI_max": ("NDVI", "max"),
+    "NDVI_median": ("NDVI", "median"),
+    "EVI_mean": ("EVI", "mean"),
+    "EVI_min": ("EVI", "min"),
+    "EVI_max": ("EVI", "max"),
+    "EVI_median": ("EVI", "median"),
+}
+
+
+def aggregate_ndvi_composites(ndvi_df, params):
+    # NDVI/EVI are 16-day composites, so we keep them at their native cadence (one row per composite date).
+    # Expanding these to daily values is done on the fly through an as-of join (see feature_collection_pipeline.expand_native_features).
     id_col = params["id_col"]
 
-    # Add date column
-    ndvi_df["date"] = ndvi_df["time"].dt.date
-
-    # Generate date list
-    date_list = pd.DataFrame(
-        pd.date_range(start_date, end_date, freq="D").date, columns=["date"]
-    )
-
-    # Get list of stations
-    station_list = ndvi_df[[id_col]].drop_duplicates()
-
-    # Create NDVI table template
-    ndvi_canvas = pd.DataFrame()
-    for idx, station in station_list.iterrows():
-        temp_df = date_list
-        temp_df[id_col] = station[id_col]
-        ndvi_canvas = pd.concat([ndvi_canvas, temp_df])
-
     # NDVI DF from GEE could yield multiple values per date, so aggregate
-    ndvi_df = ndvi_df.groupby(["date", id_col], as_index=False, group_keys=False).agg(
-        NDVI_mean=("NDVI", "mean"),
-        NDVI_min=("NDVI", "min"),
-        NDVI_max=("NDVI", "max"),
-        NDVI_median=("NDVI", "median"),
-        EVI_mean=("EVI", "mean"),
-        EVI_min=("EVI", "min"),
-        EVI_max=("EVI", "max"),
-        EVI_median=("EVI", "median"),
+    ndvi_df = aggregate_gee_data_daily(
+        ndvi_df, id_col, get_aggregations(params, NDVI_AGGREGATIONS)
     )
 
-    # Merge and forward fill to get values for dates that don't have NDVI readings
-    ndvi_filled = ndvi_df.merge(
-        ndvi_canvas, on=["date", id_col], how="right"
-    ).sort_values([id_col, "date"])
-    ndvi_filled = ndvi_filled.fillna(method="ffill")
-
-    # Select only relevant columns
-    return ndvi_filled
+    return ndvi_df.sort_values([id_col, "date"])
@@ -1,17 +1,22 @@
-def aggregate_gee_data_daily(df, id_col, ops=["mean", "min", "max", "median"]):
-    # Add date column
-    df["date"] = df["time"].dt.date
+def aggregate_gee_data_daily(df, id_col, aggregations):
+    """Aggregates GEE readings by date and location.
 
-    # Aggregate by date and station. For each band, get mean, min, max, and median
-    df = df.groupby(["date", id_col], as_index=False, group_keys=False).agg(
-        AOD_047_mean=("Optical_Depth_047", "mean"),
-        AOD_047_min=("Optical_Depth_047", "min"),
-        AOD_047_max=("Optical_Depth_047", "max"),
-        AOD_047_median=("Optical_Depth_047", "median"),
-        AOD_055_mean=("Optical_Depth_055", "mean"),
-        AOD_055_min=("Optical_Depth_055", "min"),
-        AOD_055_max=("Optical_Depth_055", "max"),
-        AOD_055_median=("Optical_Depth_055", "median"),
+    Args:
+        df (dataframe): GEE readings, with a time column
+        id_col (str): Location ID column
+        aggregations (dict): Output column -> (band, aggregation function), e.g. {"AOD_047_mean": ("Optical_Depth_047", "mean")}
+    Returns:
+        dataframe: One row per date and location, with the aggregated columns
+    """
+    # Add date column (as a datetime64 day key)
+    df["date"] = df["time"].dt.normalize()
+
+    return df.groupby(["date", id_col], as_index=False, group_keys=False).agg(
+        **aggregations
     )
 
-    return df
+
+def get_aggregations(params, default_aggregations):
+    # The aggregations to compute can be narrowed down through the dataset config (e.g. to only the features a model uses)
+    aggregations = params.get("aggregations")
+    return default_aggregations if aggregations is None else aggregations
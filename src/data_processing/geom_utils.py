@@ -1,41 +1,97 @@
 import geopandas as gpd
-from haversine import Direction, inverse_haversine
+import numpy as np
+from haversine import Direction
+from shapely.geometry import box
 
+try:
+    # Vectorized box constructor (shapely >= 2.0)
+    from shapely import box as shapely_box
+except ImportError:
+    shapely_box = None
+
+# Same as the haversine package
+AVG_EARTH_RADIUS_KM = 6371.0088
 
-def convert_latlon_to_geometry(df, lat_col="latitude", lon_col="longitude"):
-    df = df.copy()
 
-    df["geometry"] = (
-        "POINT(" + df[lon_col].astype("str") + " " + df[lat_col].astype("str") + ")"
+def convert_latlon_to_geometry(df, lat_col="latitude", lon_col="longitude"):
+    # Build the points straight from the float coordinates (no WKT strings, so no precision is lost)
+    geometry = gpd.points_from_xy(
+        df[lon_col].to_numpy(dtype=np.float64), df[lat_col].to_numpy(dtype=np.float64)
     )
-    df.drop(columns=[lat_col, lon_col], inplace=True)
+    df = df.drop(columns=[lat_col, lon_col])
 
-    df = gpd.GeoDataFrame(df, geometry=gpd.GeoSeries.from_wkt(df["geometry"]))
+    df = gpd.GeoDataFrame(df, geometry=geometry)
 
     return df
 
 
-def generate_bbox_wkt(centroid_lat, centroid_lon, distance_km):
-    """Generates WKT string representing the bounding box for a given lat/lon coordinate"""
-    centroid = (centroid_lat, centroid_lon)
-    top_left = inverse_haversine(
-        inverse_haversine(centroid, distance_km / 2, Direction.WEST),
-        distance_km / 2,
-        Direction.NORTH,
+def inverse_haversine_vector(lats, lons, distance_km, bearing):
+    """Vectorized version of haversine.inverse_haversine: the points distance_km away from each lat/lon
+    along the given bearing (in radians, clockwise from north). Returns (lats, lons) arrays in degrees.
+    """
+    lats, lons = np.radians(lats), np.radians(lons)
+    d = distance_km / AVG_EARTH_RADIUS_KM
+
+    out_lats = np.arcsin(
+        np.sin(lats) * np.cos(d) + np.cos(lats) * np.sin(d) * np.cos(bearing)
     )
-    bottom_right = inverse_haversine(
-        inverse_haversine(centroid, distance_km / 2, Direction.EAST),
-        distance_km / 2,
-        Direction.SOUTH,
+    out_lons = lons + np.arctan2(
+        np.sin(bearing) * np.sin(d) * np.cos(lats),
+        np.cos(d) - np.sin(lats) * np.sin(out_lats),
     )
 
-    tl_lat, tl_lon = top_left
-    br_lat, br_lon = bottom_right
+    return np.degrees(out_lats), np.degrees(out_lons)
+
+
+def generate_bbox_bounds(lats, lons, distance_km):
+    """Computes the bounding boxes of size distance_km around all lat/lon coordinates at once.
+
+    The corners are the same as haversine's: half the distance west (or east) of the centroid, then half the distance north (or south).
+
+    Returns:
+        array: (n, 4) array of minx, miny, maxx, maxy (i.e. min lon, min lat, max lon, max lat)
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    west_lats, west_lons = inverse_haversine_vector(
+        lats, lons, distance_km / 2, Direction.WEST.value
+    )
+    top_lats, left_lons = inverse_haversine_vector(
+        west_lats, west_lons, distance_km / 2, Direction.NORTH.value
+    )
+    east_lats, east_lons = inverse_haversine_vector(
+        lats, lons, distance_km / 2, Direction.EAST.value
+    )
+    bottom_lats, right_lons = inverse_haversine_vector(
+        east_lats, east_lons, distance_km / 2, Direction.SOUTH.value
+    )
+
+    return np.column_stack([left_lons, bottom_lats, right_lons, top_lats])
+
+
+def generate_bbox_geometries(bounds):
+    """Creates an array of shapely box polygons from an (n, 4) array of minx, miny, maxx, maxy."""
+    bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+    if shapely_box is not None:
+        return shapely_box(*bounds.T)
+
+    # Shapely < 2.0 has no vectorized box constructor
+    geometries = np.empty(len(bounds), dtype=object)
+    geometries[:] = [box(*bbox_bounds) for bbox_bounds in bounds]
+    return geometries
+
+
+def generate_bbox_wkt(centroid_lat, centroid_lon, distance_km):
+    """Generates WKT string representing the bounding box for a given lat/lon coordinate"""
+    minx, miny, maxx, maxy = generate_bbox_bounds(
+        [centroid_lat], [centroid_lon], distance_km
+    )[0]
 
-    tl_str = f"{tl_lon} {tl_lat}"
-    tr_str = f"{br_lon} {tl_lat}"
-    br_str = f"{br_lon} {br_lat}"
-    bl_str = f"{tl_lon} {br_lat}"
+    tl_str = f"{minx} {maxy}"
+    tr_str = f"{maxx} {maxy}"
+    br_str = f"{maxx} {miny}"
+    bl_str = f"{minx} {miny}"
 
     wkt_string = f"POLYGON(({tl_str}, {tr_str}, {br_str}, {bl_str}, {tl_str}))"
 
@@ -49,12 +105,10 @@ def generate_bboxes(
     lon_col="longitude",
     geometry_col="geometry",
 ):
-    """Creates a bounding box geometry for a DF of lat/lon coordinates."""
+    """Creates a bounding box geometry (shapely polygon) for a DF of lat/lon coordinates."""
     locations_df = locations_df.copy()
-    locations_df[geometry_col] = locations_df.apply(
-        lambda row: generate_bbox_wkt(
-            row[lat_col], row[lon_col], distance_km=bbox_size_km
-        ),
-        axis=1,
+    bounds = generate_bbox_bounds(
+        locations_df[lat_col], locations_df[lon_col], bbox_size_km
     )
+    locations_df[geometry_col] = generate_bbox_geometries(bounds)
     return locations_df
@@ -1,26 +1,252 @@
-import geopandas as gpd
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
+import rasterio
+from loguru import logger
+from rasterio.transform import Affine
+from rasterio.windows import Window
 from rasterstats import zonal_stats
-from shapely import wkt
 
 from src.data_processing import geom_utils
 
+HRSL_ENGINES = ["zonal_stats", "sat"]
+
+# E.g. total_population_3km, population_density_1.5km
+MULTISCALE_FEATURE_PATTERN = re.compile(
+    r"(?:total_population|population_density)_(\d+(?:\.\d+)?)km"
+)
 
-def collect_hrsl(locations_df, hrsl_tif, id_col, bbox_size_km, geometry_col="bbox"):
-    locations_df = geom_utils.generate_bboxes(
-        locations_df, bbox_size_km=bbox_size_km, geometry_col=geometry_col
-    )
 
-    locations_gdf = gpd.GeoDataFrame(
-        locations_df, geometry=locations_df[geometry_col].apply(wkt.loads)
+def collect_hrsl(
+    locations_df,
+    hrsl_tif,
+    id_col,
+    bbox_size_km,
+    engine="zonal_stats",
+    sat_path=None,
+):
+    """Computes the total population within the bbox around each location.
+
+    Args:
+        locations_df (dataframe): Locations with id_col, latitude, and longitude columns
+        hrsl_tif (str): Path to the HRSL population raster
+        id_col (str): Location ID column
+        bbox_size_km (float): Size of the bbox around each location
+        engine (str): "zonal_stats" rasterizes each bbox with rasterstats.
+            "sat" answers each bbox with four lookups into a summed-area table of the raster
+            (built once and cached next to the tif, or at sat_path), which is much faster for many locations.
+    Returns:
+        dataframe: id_col and total_population columns
+    """
+    assert engine in HRSL_ENGINES
+
+    bounds = geom_utils.generate_bbox_bounds(
+        locations_df["latitude"], locations_df["longitude"], bbox_size_km
     )
-    locations_gdf["total_population"] = pd.DataFrame(
-        zonal_stats(vectors=locations_gdf[geometry_col], raster=hrsl_tif, stats="sum")
-    )["sum"]
+
+    if engine == "sat":
+        sat = load_summed_area_table(hrsl_tif, sat_path=sat_path)
+        total_population = query_bbox_sums(sat, bounds)
+    else:
+        total_population = pd.DataFrame(
+            zonal_stats(
+                vectors=geom_utils.generate_bbox_geometries(bounds),
+                raster=hrsl_tif,
+                stats="sum",
+            )
+        )["sum"].values
 
     # Retain only id_col and total_population to save on space.
-    hrsl_df = pd.DataFrame(locations_gdf.drop(columns=geometry_col))[
-        [id_col, "total_population"]
-    ]
+    # Assign by position, since locations_df may not have a 0..n index (e.g. a shard of locations)
+    hrsl_df = locations_df[[id_col]].copy()
+    hrsl_df["total_population"] = total_population
 
     return hrsl_df
+
+
+def collect_hrsl_multiscale(
+    locations_df, hrsl_tif, id_col, bbox_sizes_km=[1, 3, 5], sat_path=None
+):
+    """Computes the population around each location at several scales, from one shared summed-area table of the raster.
+
+    For each bbox size k (in km), this adds total_population_{k}km and population_density_{k}km (people per sq. km) columns.
+
+    Returns:
+        dataframe: id_col and the population columns for every scale
+    """
+    sat = load_summed_area_table(hrsl_tif, sat_path=sat_path)
+
+    hrsl_df = locations_df[[id_col]].reset_index(drop=True)
+    for bbox_size_km in bbox_sizes_km:
+        bounds = geom_utils.generate_bbox_bounds(
+            locations_df["latitude"], locations_df["longitude"], bbox_size_km
+        )
+        total_population = query_bbox_sums(sat, bounds)
+        hrsl_df[f"total_population_{bbox_size_km:g}km"] = total_population
+        hrsl_df[f"population_density_{bbox_size_km:g}km"] = total_population / (
+            bbox_size_km**2
+        )
+
+    return hrsl_df
+
+
+def parse_population_scales(feature_names):
+    """Returns the bbox sizes (in km) of the multi-scale population features among the feature names."""
+    scales = set()
+    for feature in feature_names:
+        match = MULTISCALE_FEATURE_PATTERN.fullmatch(feature)
+        if match:
+            scales.add(float(match.group(1)))
+    return sorted(scales)
+
+
+def build_summed_area_table(hrsl_tif, sat_path=None, block_rows=256):
+    """Precomputes the summed-area table (integral image) of a raster, block by block.
+
+    Two memory-mapped .npy arrays of shape (height + 1, width + 1) are written:
+    - <sat_path>.sum.npy: S[i, j] = sum of the valid pixels in rows < i and columns < j
+    - <sat_path>.count.npy: the same, but counting the valid (non-nodata) pixels
+    The raster transform and source file info are saved to <sat_path>.json.
+
+    Only block_rows rows of the raster are held in memory at a time.
+
+    Returns the sat_path prefix (defaults to <hrsl_tif>.sat).
+    """
+    sat_path = Path(sat_path or f"{hrsl_tif}.sat")
+    os.makedirs(sat_path.parent, exist_ok=True)
+
+    with rasterio.open(hrsl_tif) as src:
+        height, width = src.height, src.width
+        count_dtype = np.uint32 if height * width < 2**32 else np.uint64
+        logger.info(
+            f"Building summed-area table for {hrsl_tif} ({height:,} x {width:,} pixels)..."
+        )
+
+        sums = np.lib.format.open_memmap(
+            f"{sat_path}.sum.npy",
+            mode="w+",
+            dtype=np.float64,
+            shape=(height + 1, width + 1),
+        )
+        counts = np.lib.format.open_memmap(
+            f"{sat_path}.count.npy",
+            mode="w+",
+            dtype=count_dtype,
+            shape=(height + 1, width + 1),
+        )
+        sums[0, :] = 0
+        counts[0, :] = 0
+
+        for row_start in range(0, height, block_rows):
+            n_rows = min(block_rows, height - row_start)
+            block = src.read(1, window=Window(0, row_start, width, n_rows), masked=True)
+            valid = ~np.ma.getmaskarray(block) & np.isfinite(block.filled(0))
+            values = np.where(valid, block.filled(0), 0).astype(np.float64)
+
+            # Cumulative sums within the block, plus the running totals of all the rows above it
+            row_end = row_start + n_rows
+            sums[row_start + 1 : row_end + 1, 0] = 0
+            sums[row_start + 1 : row_end + 1, 1:] = (
+                values.cumsum(axis=1).cumsum(axis=0) + sums[row_start, 1:]
+            )
+            counts[row_start + 1 : row_end + 1, 0] = 0
+            counts[row_start + 1 : row_end + 1, 1:] = (
+                valid.astype(count_dtype).cumsum(axis=1).cumsum(axis=0)
+                + counts[row_start, 1:]
+            )
+
+        sums.flush()
+        counts.flush()
+
+        metadata = {
+            "hrsl_tif": str(hrsl_tif),
+            "tif_size": os.path.getsize(hrsl_tif),
+            "tif_mtime": os.path.getmtime(hrsl_tif),
+            "transform": list(src.transform)[:6],
+            "height": height,
+            "width": width,
+        }
+
+    with open(f"{sat_path}.json", "w") as f:
+        json.dump(metadata, f, indent=4)
+
+    return sat_path
+
+
+def load_summed_area_table(hrsl_tif, sat_path=None):
+    """Loads the (memory-mapped) summed-area table of a raster, building it first if it doesn't exist or is out of date."""
+    sat_path = Path(sat_path or f"{hrsl_tif}.sat")
+
+    metadata = None
+    if Path(f"{sat_path}.json").exists():
+        with open(f"{sat_path}.json") as f:
+            metadata = json.load(f)
+
+    is_stale = (
+        metadata is None
+        or metadata["tif_size"] != os.path.getsize(hrsl_tif)
+        or metadata["tif_mtime"] != os.path.getmtime(hrsl_tif)
+    )
+    if is_stale:
+        build_summed_area_table(hrsl_tif, sat_path=sat_path)
+        with open(f"{sat_path}.json") as f:
+            metadata = json.load(f)
+
+    return {
+        "sums": np.load(f"{sat_path}.sum.npy", mmap_mode="r"),
+        "counts": np.load(f"{sat_path}.count.npy", mmap_mode="r"),
+        "transform": Affine(*metadata["transform"]),
+        "height": metadata["height"],
+        "width": metadata["width"],
+    }
+
+
+def query_bbox_sums(sat, bounds):
+    """Sums the raster within each bbox with four lookups into the summed-area table (vectorized across all bboxes).
+
+    Like zonal_stats (all_touched=False), a pixel is counted if its center is inside the bbox.
+    Bboxes that don't cover any valid pixel get NaN.
+
+    Args:
+        sat (dict): Summed-area table, from load_summed_area_table
+        bounds (array): (n, 4) array of minx, miny, maxx, maxy (in the raster CRS)
+    Returns:
+        array: The sum for each bbox
+    """
+    bounds = np.asarray(bounds, dtype=np.float64)
+    minx, miny, maxx, maxy = bounds.T
+    transform = sat["transform"]
+    x0, pixel_width = transform.c, transform.a
+    y0, pixel_height = transform.f, -transform.e
+
+    # Pixel c is counted if its center x0 + (c + 0.5) * pixel_width is in [minx, maxx), likewise for the rows (from the top).
+    col_start = np.ceil((minx - x0) / pixel_width - 0.5)
+    col_end = np.ceil((maxx - x0) / pixel_width - 0.5)
+    row_start = np.ceil((y0 - maxy) / pixel_height - 0.5)
+    row_end = np.ceil((y0 - miny) / pixel_height - 0.5)
+
+    col_start, col_end = [
+        np.clip(col, 0, sat["width"]).astype(np.int64) for col in (col_start, col_end)
+    ]
+    row_start, row_end = [
+        np.clip(row, 0, sat["height"]).astype(np.int64) for row in (row_start, row_end)
+    ]
+    col_end = np.maximum(col_start, col_end)
+    row_end = np.maximum(row_start, row_end)
+
+    def lookup(table):
+        return (
+            table[row_end, col_end].astype(np.float64)
+            - table[row_start, col_end]
+            - table[row_end, col_start]
+            + table[row_start, col_start]
+        )
+
+    sums = lookup(sat["sums"])
+    counts = lookup(sat["counts"])
+
+    return np.where(counts > 0, sums, np.nan)
@@ -0,0 +1,441 @@
+"""Durable job manifest for multi-process feature generation.
+
+Feature collection is split into (location shard, dataset, time window) tasks, recorded in a local SQLite manifest.
+Worker processes claim pending tasks, save each task's output to a Parquet file, and mark the task as done.
+Re-running on the same job folder resumes from the manifest.
+
+Job folder layout:
+- manifest.sqlite: the params and task table
+- locations.parquet: the locations to collect features for
+- outputs/<dataset>/shard-00000_<window start>.parquet: one output file per task
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from src.data_processing import feature_collection_pipeline, hrsl
+from src.data_processing.gee import gee_utils
+
+MANIFEST_FILENAME = "manifest.sqlite"
+LOCATIONS_FILENAME = "locations.parquet"
+OUTPUTS_DIRNAME = "outputs"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Seconds to wait on the SQLite lock held by another worker
+SQLITE_TIMEOUT = 60
+
+
+def create_manifest(
+    job_dir,
+    locations_df,
+    start_date,
+    end_date,
+    id_col,
+    hrsl_tif,
+    bbox_size_km=1,
+    hrsl_engine="zonal_stats",
+    population_scales_km=None,
+    shard_size=100,
+    window_freq="MS",
+    gee_datasets=[
+        feature_collection_pipeline.S5P_AAI_CONFIG,
+        feature_collection_pipeline.CAMS_AOD_CONFIG,
+        feature_collection_pipeline.NDVI_CONFIG,
+        feature_collection_pipeline.ERA5_CONFIG,
+    ],
+):
+    """Creates the job folder and its task manifest, or resumes an existing one.
+
+    HRSL gets one task per location shard, and each GEE dataset gets one task per location shard and time window
+    (window_freq is a pandas frequency string, monthly by default to match the GEE request limits).
+
+    When resuming, the params and locations must match the ones the manifest was created with. Tasks left running (e.g.
+    by a crashed run) and failed tasks are reset to pending.
+    """
+    job_dir = Path(job_dir)
+    os.makedirs(job_dir / OUTPUTS_DIRNAME, exist_ok=True)
+
+    # Build the summed-area table up front, so the workers don't all try to build it at once
+    if hrsl_engine == "sat" or population_scales_km:
+        hrsl.load_summed_area_table(hrsl_tif)
+
+    params = {
+        "start_date": str(start_date),
+        "end_date": str(end_date),
+        "id_col": id_col,
+        "hrsl_tif": str(hrsl_tif),
+        "bbox_size_km": bbox_size_km,
+        "hrsl_engine": hrsl_engine,
+        "population_scales_km": population_scales_km,
+        "shard_size": shard_size,
+        "window_freq": window_freq,
+        "gee_datasets": [gee_dataset["collection_id"] for gee_dataset in gee_datasets],
+        # So resuming with other locations fails, instead of collecting the stored ones
+        "n_locations": len(locations_df),
+        "locations_hash": get_locations_hash(locations_df),
+    }
+
+    with _connect(job_dir) as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS params (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id INTEGER PRIMARY KEY,
+                shard INTEGER NOT NULL,
+                dataset TEXT NOT NULL,
+                window_start TEXT NOT NULL,
+                window_end TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                output_path TEXT,
+                error TEXT,
+                updated_at TEXT,
+                UNIQUE (shard, dataset, window_start)
+            )
+            """
+        )
+
+        existing_params = read_params(job_dir, conn=conn)
+        if existing_params:
+            if existing_params != params:
+                raise ValueError(
+                    f"Job folder {job_dir} was created with different params: {existing_params}"
+                )
+            n_reset = reset_unfinished_tasks(job_dir, conn=conn)
+            logger.info(f"Resuming job in {job_dir} ({n_reset} unfinished tasks reset)")
+            return job_dir
+
+        locations_df.reset_index(drop=True).to_parquet(
+            job_dir / LOCATIONS_FILENAME, index=False
+        )
+
+        n_shards = len(
+            feature_collection_pipeline.split_into_shards(locations_df, shard_size)
+        )
+        windows = generate_time_windows(start_date, end_date, freq=window_freq)
+
+        conn.execute("BEGIN IMMEDIATE")
+        tasks = []
+        for shard in range(n_shards):
+            tasks.append((shard, feature_collection_pipeline.HRSL_KEY, *windows[0]))
+            for collection_id in params["gee_datasets"]:
+                for window_start, window_end in windows:
+                    tasks.append((shard, collection_id, window_start, window_end))
+
+        conn.executemany(
+            "INSERT INTO tasks (shard, dataset, window_start, window_end) VALUES (?, ?, ?, ?)",
+            tasks,
+        )
+        conn.executemany(
+            "INSERT INTO params (key, value) VALUES (?, ?)",
+            [(key, json.dumps(value)) for key, value in params.items()],
+        )
+        conn.execute("COMMIT")
+
+    logger.info(
+        f"Created job in {job_dir} with {len(tasks):,} tasks ({n_shards} shards x {len(windows)} windows)"
+    )
+    return job_dir
+
+
+def generate_time_windows(start_date, end_date, freq="MS"):
+    # E.g. 2021-12-15 to 2022-02-10 (monthly) -> [(2021-12-15, 2021-12-31), (2022-01-01, 2022-01-31), (2022-02-01, 2022-02-10)]
+    start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    window_starts = [start_date] + [
+        date
+        for date in pd.date_range(start_date, end_date, freq=freq)
+        if date > start_date
+    ]
+    window_ends = [date - pd.Timedelta(days=1) for date in window_starts[1:]] + [
+        end_date
+    ]
+    return [
+        (window_start.strftime("%Y-%m-%d"), window_end.strftime("%Y-%m-%d"))
+        for window_start, window_end in zip(window_starts, window_ends)
+    ]
+
+
+def get_locations_hash(locations_df):
+    """Returns a hash of the locations (their values and order, which the shards depend on)."""
+    row_hashes = pd.util.hash_pandas_object(locations_df, index=False)
+    return hashlib.md5(row_hashes.values.tobytes()).hexdigest()
+
+
+def read_params(job_dir, conn=None):
+    if conn is None:
+        with _connect(job_dir) as conn:
+            return read_params(job_dir, conn=conn)
+    rows = conn.execute("SELECT key, value FROM params").fetchall()
+    return {key: json.loads(value) for key, value in rows}
+
+
+def reset_unfinished_tasks(job_dir, conn=None):
+    """Resets running and failed tasks to pending. Only call this when no workers are active on the job."""
+    if conn is None:
+        with _connect(job_dir) as conn:
+            return reset_unfinished_tasks(job_dir, conn=conn)
+    cursor = conn.execute(
+        "UPDATE tasks SET status = ?, worker = NULL WHERE status IN (?, ?)",
+        (PENDING, RUNNING, FAILED),
+    )
+    return cursor.rowcount
+
+
+def claim_task(job_dir, worker):
+    """Atomically claims the next pending task for the worker. Returns the task as a dict, or None if there are no pending tasks left."""
+    with _connect(job_dir) as conn:
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't claim the same task.
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT task_id, shard, dataset, window_start, window_end FROM tasks WHERE status = ? ORDER BY task_id LIMIT 1",
+            (PENDING,),
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE tasks SET status = ?, worker = ?, attempts = attempts + 1, updated_at = ? WHERE task_id = ?",
+            (RUNNING, worker, _now(), row[0]),
+        )
+        conn.execute("COMMIT")
+
+    return dict(zip(["task_id", "shard", "dataset", "window_start", "window_end"], row))
+
+
+def complete_task(job_dir, task_id, output_path):
+    with _connect(job_dir) as conn:
+        conn.execute(
+            "UPDATE tasks SET status = ?, output_path = ?, error = NULL, updated_at = ? WHERE task_id = ?",
+            (DONE, str(output_path) if output_path else None, _now(), task_id),
+        )
+
+
+def fail_task(job_dir, task_id, error):
+    with _connect(job_dir) as conn:
+        conn.execute(
+            "UPDATE tasks SET status = ?, error = ?, updated_at = ? WHERE task_id = ?",
+            (FAILED, error, _now(), task_id),
+        )
+
+
+def get_status_counts(job_dir):
+    with _connect(job_dir) as conn:
+        rows = conn.execute(
+            "SELECT status, COUNT(*) FROM tasks GROUP BY status"
+        ).fetchall()
+    return dict(rows)
+
+
+def run_task(job_dir, task, locations_df, params):
+    """Runs a single task and saves its output. Returns the output path (or None if no data was collected)."""
+    job_dir = Path(job_dir)
+    id_col = params["id_col"]
+    shard_df = feature_collection_pipeline.split_into_shards(
+        locations_df, params["shard_size"]
+    )[task["shard"]]
+
+    if task["dataset"] == feature_collection_pipeline.HRSL_KEY:
+        out_df = hrsl.collect_hrsl(
+            shard_df,
+            params["hrsl_tif"],
+            id_col=id_col,
+            bbox_size_km=params["bbox_size_km"],
+            engine=params["hrsl_engine"],
+        )
+        if params.get("population_scales_km"):
+            multiscale_df = hrsl.collect_hrsl_multiscale(
+                shard_df,
+                params["hrsl_tif"],
+                id_col=id_col,
+                bbox_sizes_km=params["population_scales_km"],
+            )
+            out_df = out_df.merge(multiscale_df, on=[id_col], how="left")
+    else:
+        gee_dataset = feature_collection_pipeline.GEE_DATASET_CONFIGS[task["dataset"]]
+        gee_dfs = feature_collection_pipeline.collect_gee_datasets(
+            [gee_dataset],
+            task["window_start"],
+            task["window_end"],
+            shard_df,
+            id_col=id_col,
+        )
+        out_df = gee_dfs.get(task["dataset"])
+
+    if out_df is None:
+        return None
+
+    out_path = _task_output_path(job_dir, task)
+    os.makedirs(out_path.parent, exist_ok=True)
+    # Write to a temp file first, so a crash never leaves a partial output behind
+    tmp_path = out_path.with_suffix(".tmp")
+    out_df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, out_path)
+
+    return out_path
+
+
+def run_worker(job_dir, worker=None):
+    """Claims and runs tasks from the manifest until there are none left."""
+    worker = worker or f"worker-{os.getpid()}"
+    params = read_params(job_dir)
+    locations_df = pd.read_parquet(Path(job_dir) / LOCATIONS_FILENAME)
+
+    if params["gee_datasets"]:
+        gee_utils.gee_auth()
+
+    n_done = 0
+    while True:
+        task = claim_task(job_dir, worker)
+        if task is None:
+            break
+
+        logger.info(f"[{worker}] Running task {task}")
+        try:
+            output_path = run_task(job_dir, task, locations_df, params)
+        except Exception as e:
+            logger.exception(f"[{worker}] Task {task['task_id']} failed")
+            fail_task(job_dir, task["task_id"], repr(e))
+            continue
+
+        complete_task(job_dir, task["task_id"], output_path)
+        n_done += 1
+
+    logger.info(f"[{worker}] No pending tasks left. Finished {n_done} tasks.")
+    return n_done
+
+
+def run_workers(job_dir, n_workers):
+    """Runs n_workers worker processes on the job, and waits for them to finish."""
+    if n_workers <= 1:
+        run_worker(job_dir)
+    else:
+        # Spawn (instead of fork) so that each worker starts with a clean GEE client
+        context = multiprocessing.get_context("spawn")
+        processes = [
+            context.Process(
+                target=run_worker, args=(str(job_dir), f"worker-{worker_index}")
+            )
+            for worker_index in range(n_workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    status_counts = get_status_counts(job_dir)
+    logger.info(f"Job status: {status_counts}")
+    return status_counts
+
+
+def merge_outputs(job_dir, expand_native=True, date_col="date", temporal_config=None):
+    """Builds the base table from the outputs of the finished tasks (see feature_collection_pipeline.merge_features).
+
+    If temporal_config is given, the lag and rolling-window features are added across the task months
+    (with shorter windows on the first days of the job's date range).
+
+    Raises a RuntimeError if some tasks are not done yet.
+    """
+    job_dir = Path(job_dir)
+    status_counts = get_status_counts(job_dir)
+    n_unfinished = sum(
+        count for status, count in status_counts.items() if status != DONE
+    )
+    if n_unfinished:
+        raise RuntimeError(
+            f"{n_unfinished} tasks are not done yet ({status_counts}). Re-run the job to resume."
+        )
+
+    params = read_params(job_dir)
+    id_col = params["id_col"]
+    locations_df = pd.read_parquet(job_dir / LOCATIONS_FILENAME)
+
+    base_df = feature_collection_pipeline.generate_locations_with_dates_df(
+        locations_df,
+        params["start_date"],
+        params["end_date"],
+        id_col=id_col,
+        date_col=date_col,
+    )
+
+    with _connect(job_dir) as conn:
+        rows = conn.execute(
+            "SELECT dataset, output_path FROM tasks WHERE output_path IS NOT NULL ORDER BY task_id"
+        ).fetchall()
+    output_paths = {}
+    for dataset, output_path in rows:
+        output_paths.setdefault(dataset, []).append(output_path)
+
+    hrsl_df = pd.concat(
+        [
+            pd.read_parquet(path)
+            for path in output_paths.get(feature_collection_pipeline.HRSL_KEY, [])
+        ],
+        ignore_index=True,
+    )
+    gee_datasets = [
+        feature_collection_pipeline.GEE_DATASET_CONFIGS[collection_id]
+        for collection_id in params["gee_datasets"]
+    ]
+    # (Native-cadence datasets look back before each window, so consecutive windows can share rows)
+    gee_dfs = {
+        collection_id: pd.concat(
+            [pd.read_parquet(path) for path in output_paths[collection_id]],
+            ignore_index=True,
+        ).drop_duplicates([id_col, date_col])
+        for collection_id in params["gee_datasets"]
+        if collection_id in output_paths
+    }
+
+    return feature_collection_pipeline.merge_features(
+        base_df,
+        hrsl_df,
+        gee_dfs,
+        gee_datasets,
+        id_col,
+        date_col=date_col,
+        expand_native=expand_native,
+        temporal_config=temporal_config,
+    )
+
+
+def _task_output_path(job_dir, task):
+    dataset_sanitized = task["dataset"].replace("/", "_")
+    return (
+        Path(job_dir)
+        / OUTPUTS_DIRNAME
+        / dataset_sanitized
+        / f"shard-{task['shard']:05d}_{task['window_start']}.parquet"
+    )
+
+
+@contextmanager
+def _connect(job_dir):
+    # Autocommit mode: transactions are opened explicitly where statements need to be atomic.
+    conn = sqlite3.connect(
+        Path(job_dir) / MANIFEST_FILENAME,
+        timeout=SQLITE_TIMEOUT,
+        isolation_level=None,
+    )
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
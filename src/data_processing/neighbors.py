@@ -0,0 +1,210 @@
+import re
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from src.data_processing import geom_utils
+
+# Number of tiles whose (date x tile x neighbor) values are held in memory at once
+TILE_CHUNK_SIZE = 10000
+
+# Neighbor features, e.g. pm25_knn5_mean and stations_within_50km (see collect_neighbor_features)
+KNN_FEATURE_PATTERN = re.compile(r"(.+)_knn(\d+)_(mean|idw)")
+RADIUS_FEATURE_PATTERN = re.compile(r"stations_within_(.+)km")
+DISTANCE_FEATURE = "nearest_station_distance_km"
+
+
+def build_station_tree(stations_df, lat_col="latitude", lon_col="longitude"):
+    """Builds a ball tree over the station coordinates, for haversine (great-circle) queries."""
+    # sklearn is only imported when neighbor features are used (it's slow to import for predict and serve)
+    from sklearn.neighbors import BallTree
+
+    return BallTree(_get_coords(stations_df, lat_col, lon_col), metric="haversine")
+
+
+def query_knn(tree, locations_df, k, lat_col="latitude", lon_col="longitude"):
+    """Finds the k nearest stations of every location in one call.
+
+    Returns:
+        (array, array): (n, k) distances (in km) and station indices, nearest first
+    """
+    distances, indices = tree.query(_get_coords(locations_df, lat_col, lon_col), k=k)
+    return distances * geom_utils.AVG_EARTH_RADIUS_KM, indices
+
+
+def query_radius(
+    tree, locations_df, radius_km, lat_col="latitude", lon_col="longitude"
+):
+    """Finds the stations within radius_km of every location in one call.
+
+    Returns:
+        (array, array): object arrays with the station indices and distances (in km) of each location, nearest first
+    """
+    indices, distances = tree.query_radius(
+        _get_coords(locations_df, lat_col, lon_col),
+        r=radius_km / geom_utils.AVG_EARTH_RADIUS_KM,
+        return_distance=True,
+        sort_results=True,
+    )
+    return indices, distances * geom_utils.AVG_EARTH_RADIUS_KM
+
+
+def collect_neighbor_features(
+    locations_df,
+    station_values_df,
+    id_col,
+    value_cols,
+    start_date,
+    end_date,
+    k=5,
+    radius_km=None,
+    exclude_self=True,
+    date_col="date",
+):
+    """Computes features from the k nearest stations of every location, for every date in the range.
+
+    For each value column (e.g. the daily PM2.5 of the stations), this adds:
+    - {value_col}_knn{k}_mean: mean of the k nearest stations' values that day (ignoring stations without a value)
+    - {value_col}_knn{k}_idw: inverse-distance weighted mean of the same
+    The distance to the nearest station (nearest_station_distance_km) is added as well,
+    and the number of stations within radius_km (stations_within_{radius_km}km) if given.
+
+    Args:
+        locations_df (dataframe): Locations with id_col, latitude, and longitude columns
+        station_values_df (dataframe): Daily station values, with id_col, latitude, longitude, date_col, and the value columns
+        exclude_self (bool): If True, a station is never its own neighbor (i.e. when the locations are the stations themselves,
+            so their own ground truth doesn't leak into the features). A location is a station if it has the same id and coordinates.
+    Returns:
+        dataframe: id_col, date_col, and the neighbor feature columns
+    """
+    stations_df = station_values_df.drop_duplicates(id_col)[
+        [id_col, "latitude", "longitude"]
+    ].reset_index(drop=True)
+    logger.info(
+        f"Computing features from the {k} nearest of {len(stations_df):,} stations..."
+    )
+
+    # Query one extra neighbor, in case a location is one of the stations
+    tree = build_station_tree(stations_df)
+    n_neighbors = min(k + 1 if exclude_self else k, len(stations_df))
+    distances, indices = query_knn(tree, locations_df, n_neighbors)
+    if exclude_self:
+        # (Matched on the coordinates as well, since other locations may reuse the station IDs)
+        is_self = (
+            (
+                stations_df[id_col].values[indices]
+                == locations_df[id_col].values[:, np.newaxis]
+            )
+            & np.isclose(
+                stations_df["latitude"].values[indices],
+                locations_df["latitude"].values[:, np.newaxis],
+            )
+            & np.isclose(
+                stations_df["longitude"].values[indices],
+                locations_df["longitude"].values[:, np.newaxis],
+            )
+        )
+        # Push the location's own station to the end, then drop the extra neighbor
+        order = np.argsort(is_self, axis=1, kind="stable")
+        distances = np.take_along_axis(np.where(is_self, np.inf, distances), order, 1)
+        indices = np.take_along_axis(indices, order, 1)
+        distances, indices = distances[:, :k], indices[:, :k]
+
+    if radius_km:
+        n_within_radius = tree.query_radius(
+            _get_coords(locations_df),
+            r=radius_km / geom_utils.AVG_EARTH_RADIUS_KM,
+            count_only=True,
+        )
+        if exclude_self:
+            n_within_radius -= _is_station(locations_df, stations_df, id_col)
+
+    # (date x station) matrix of each value column, so the neighbors' values are gathered with array indexing
+    dates = pd.date_range(start=start_date, end=end_date, freq="D")
+    station_values_df = station_values_df.assign(
+        **{date_col: pd.to_datetime(station_values_df[date_col])}
+    )
+    value_matrices = {
+        value_col: station_values_df.pivot_table(
+            index=date_col, columns=id_col, values=value_col, aggfunc="mean"
+        )
+        .reindex(index=dates, columns=stations_df[id_col])
+        .to_numpy(dtype=np.float64)
+        for value_col in value_cols
+    }
+
+    # Stations at distance 0 get the largest finite weight instead of an infinite one
+    weights = 1 / np.maximum(distances, 1e-3)
+    weights[~np.isfinite(distances)] = 0
+
+    features_dfs = []
+    for chunk_start in range(0, len(locations_df), TILE_CHUNK_SIZE):
+        chunk = slice(chunk_start, chunk_start + TILE_CHUNK_SIZE)
+        chunk_ids = locations_df[id_col].values[chunk]
+        features_df = pd.DataFrame(
+            {
+                id_col: np.repeat(chunk_ids, len(dates)),
+                date_col: np.tile(dates.values, len(chunk_ids)),
+                DISTANCE_FEATURE: np.repeat(distances[chunk, 0], len(dates)),
+            }
+        )
+        if radius_km:
+            features_df[f"stations_within_{radius_km:g}km"] = np.repeat(
+                n_within_radius[chunk], len(dates)
+            )
+        for value_col, value_matrix in value_matrices.items():
+            # (date x location x neighbor) values, skipping the stations without a value that day (and excluded ones)
+            neighbor_values = value_matrix[:, indices[chunk]]
+            is_valid = ~np.isnan(neighbor_values) & (weights[chunk] > 0)
+            neighbor_values = np.where(is_valid, neighbor_values, 0)
+            neighbor_weights = np.where(is_valid, weights[chunk], 0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                knn_mean = neighbor_values.sum(axis=2) / is_valid.sum(axis=2)
+                knn_idw = (neighbor_values * neighbor_weights).sum(
+                    axis=2
+                ) / neighbor_weights.sum(axis=2)
+            # Transpose to (location x date), the row order of features_df
+            features_df[f"{value_col}_knn{k}_mean"] = knn_mean.T.ravel()
+            features_df[f"{value_col}_knn{k}_idw"] = knn_idw.T.ravel()
+        features_dfs.append(features_df)
+
+    return pd.concat(features_dfs, ignore_index=True)
+
+
+def parse_neighbor_features(feature_names):
+    """Returns the value_cols, k, and radius_km that produce the neighbor features among the feature names.
+
+    Returns None if there are no neighbor features.
+    """
+    value_cols, k, radius_km = [], None, None
+    for feature in feature_names:
+        knn_match = KNN_FEATURE_PATTERN.fullmatch(feature)
+        if knn_match:
+            k = int(knn_match.group(2))
+            if knn_match.group(1) not in value_cols:
+                value_cols.append(knn_match.group(1))
+        radius_match = RADIUS_FEATURE_PATTERN.fullmatch(feature)
+        if radius_match:
+            radius_km = float(radius_match.group(1))
+
+    if not value_cols and radius_km is None and DISTANCE_FEATURE not in feature_names:
+        return None
+    return {"value_cols": value_cols, "k": k or 1, "radius_km": radius_km}
+
+
+def _is_station(locations_df, stations_df, id_col):
+    # Whether each location is one of the stations (same id and coordinates)
+    station_coords_df = locations_df[[id_col]].merge(stations_df, on=id_col, how="left")
+    is_same_lat = np.isclose(
+        station_coords_df["latitude"].values, locations_df["latitude"].values
+    )
+    is_same_lon = np.isclose(
+        station_coords_df["longitude"].values, locations_df["longitude"].values
+    )
+    return is_same_lat & is_same_lon
+
+
+def _get_coords(df, lat_col="latitude", lon_col="longitude"):
+    # (n, 2) array of latitude, longitude in radians, as expected by the haversine metric
+    return np.radians(df[[lat_col, lon_col]].to_numpy(dtype=np.float64))
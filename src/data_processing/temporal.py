@@ -0,0 +1,198 @@
+"""Lag and rolling-window features over the daily base table (e.g. 3-day mean precipitation, previous-day AOD).
+
+The base table from feature_collection_pipeline is sorted by location, then date, with one row per day. So every
+location is a contiguous run of rows, and the features are computed on the flat column arrays at once:
+- rolling windows are differences of cumulative sums (cut off at the first row of each location)
+- lags are shifted row indices (cut off the same way)
+This avoids a groupby().rolling() per location, which is slow for tens of thousands of locations.
+
+Temporal configs map each operation to the windows (or lags) in days, per source column:
+
+    {"lag": {"CAMS_AOD_055_mean": [1]}, "mean": {"total_precipitation_daily": [3, 7]}, "sum": {"wind_run_km": [3]}}
+
+which produces CAMS_AOD_055_mean_lag1d, total_precipitation_daily_roll3d_mean, ..., wind_run_km_roll3d_sum.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+TEMPORAL_OPERATIONS = ["lag", "mean", "sum"]
+TEMPORAL_FEATURE_PATTERN = re.compile(r"(.+)_(?:lag(\d+)d|roll(\d+)d_(mean|sum))")
+
+# Daily wind run (distance travelled by the air in a day), from the daily mean ERA5 wind components
+WIND_RUN_COL = "wind_run_km"
+WIND_COMPONENT_COLS = ["u_component_of_wind_10m_mean", "v_component_of_wind_10m_mean"]
+SECONDS_PER_DAY = 86400
+
+DEFAULT_TEMPORAL_CONFIG = {
+    "lag": {
+        "CAMS_AOD_055_mean": [1],
+        "AAI_mean": [1],
+    },
+    "mean": {
+        "total_precipitation_daily": [3, 7],
+        "temperature_2m_mean": [3],
+    },
+    "sum": {
+        WIND_RUN_COL: [3],
+    },
+}
+
+
+def get_feature_name(col, operation, days):
+    if operation == "lag":
+        return f"{col}_lag{days}d"
+    return f"{col}_roll{days}d_{operation}"
+
+
+def parse_temporal_features(feature_names):
+    """Returns the temporal config that produces the temporal features among the feature names (None if there are none)."""
+    temporal_config = {}
+    for feature in feature_names:
+        match = TEMPORAL_FEATURE_PATTERN.fullmatch(feature)
+        if not match:
+            continue
+        col, lag_days, window_days, operation = match.groups()
+        operation = operation or "lag"
+        days = int(lag_days or window_days)
+        col_days = temporal_config.setdefault(operation, {}).setdefault(col, [])
+        if days not in col_days:
+            col_days.append(days)
+
+    return temporal_config or None
+
+
+def get_source_columns(temporal_config):
+    """Returns the base table columns the temporal features are computed from (the wind components, for the wind run)."""
+    source_cols = set()
+    for col_days in temporal_config.values():
+        source_cols |= set(col_days)
+    if WIND_RUN_COL in source_cols:
+        source_cols = (source_cols - {WIND_RUN_COL}) | set(WIND_COMPONENT_COLS)
+    return sorted(source_cols)
+
+
+def get_lookback_days(temporal_config):
+    """Returns how many days before a date its temporal features look back (the longest lag, or window minus one)."""
+    lookback_days = 0
+    for operation, col_days in temporal_config.items():
+        for days in col_days.values():
+            lookback_days = max(
+                lookback_days, max(days) if operation == "lag" else max(days) - 1
+            )
+    return lookback_days
+
+
+def add_temporal_features(base_df, id_col, temporal_config, date_col="date"):
+    """Adds the lag and rolling-window features of the temporal config to the base table.
+
+    base_df has to be sorted by id_col, then date_col, with one row per day (as built by
+    feature_collection_pipeline.generate_locations_with_dates_df). Windows are counted in rows, and
+    are shorter at the start of each location's rows. Missing values are skipped in the windows,
+    and windows without any value are NaN. Source columns not in base_df are skipped with a warning.
+    """
+    if any(WIND_RUN_COL in col_days for col_days in temporal_config.values()):
+        base_df = add_wind_run(base_df)
+
+    # Row index of the first row of each row's location
+    ids = base_df[id_col].values
+    positions = np.arange(len(base_df))
+    is_first_row = np.ones(len(base_df), dtype=bool)
+    is_first_row[1:] = ids[1:] != ids[:-1]
+    group_starts = np.maximum.accumulate(np.where(is_first_row, positions, 0))
+
+    features = {}
+    for operation in TEMPORAL_OPERATIONS:
+        for col, col_days in temporal_config.get(operation, {}).items():
+            if col not in base_df.columns:
+                logger.warning(
+                    f"Column {col} not in the base table, skipping its temporal features"
+                )
+                continue
+            values = base_df[col].to_numpy(dtype=np.float64)
+            for days in col_days:
+                feature_name = get_feature_name(col, operation, days)
+                if operation == "lag":
+                    features[feature_name] = lag_by_location(values, group_starts, days)
+                else:
+                    features[feature_name] = rolling_by_location(
+                        values, group_starts, days, operation
+                    )
+
+    return base_df.assign(**features)
+
+
+def append_temporal_features(
+    history_df, new_df, id_col, temporal_config, date_col="date"
+):
+    """Computes the temporal features of newly appended days, without recomputing the history.
+
+    Only the last lookback days of history_df (see get_lookback_days) are needed to fill the windows
+    and lags of the new days, so the work is proportional to the number of new days.
+
+    Args:
+        history_df (dataframe): Base table of the previous days (with or without temporal features)
+        new_df (dataframe): Base table of the new days, with the same source columns
+    Returns:
+        dataframe: new_df with the temporal features, sorted by id_col, then date_col
+    """
+    lookback_days = get_lookback_days(temporal_config)
+    first_new_date = pd.to_datetime(new_df[date_col]).min()
+    history_dates = pd.to_datetime(history_df[date_col])
+    is_lookback = (
+        history_dates >= first_new_date - pd.Timedelta(days=lookback_days)
+    ) & (history_dates < first_new_date)
+
+    new_cols = new_df.columns.tolist()
+    lookback_df = history_df.loc[is_lookback, history_df.columns.intersection(new_cols)]
+    combined_df = pd.concat(
+        [lookback_df.assign(_is_new=False), new_df.assign(_is_new=True)],
+        ignore_index=True,
+    ).sort_values(by=[id_col, date_col], kind="stable")
+
+    combined_df = add_temporal_features(
+        combined_df, id_col, temporal_config, date_col=date_col
+    )
+
+    return (
+        combined_df[combined_df["_is_new"]]
+        .drop(columns=["_is_new"])
+        .reset_index(drop=True)
+    )
+
+
+def add_wind_run(base_df):
+    """Adds the daily wind run (km), from the speed of the daily mean wind vector."""
+    if not set(WIND_COMPONENT_COLS) <= set(base_df.columns):
+        return base_df
+    u, v = (base_df[col].to_numpy(dtype=np.float64) for col in WIND_COMPONENT_COLS)
+    return base_df.assign(**{WIND_RUN_COL: np.hypot(u, v) * SECONDS_PER_DAY / 1000})
+
+
+def rolling_by_location(values, group_starts, window, operation="mean"):
+    """Trailing rolling mean or sum over the last window rows of each location, from cumulative sums."""
+    is_valid = ~np.isnan(values)
+    cumsums = np.zeros(len(values) + 1)
+    np.cumsum(np.where(is_valid, values, 0), out=cumsums[1:])
+    cumcounts = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(is_valid, out=cumcounts[1:])
+
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - window, group_starts)
+    sums = cumsums[ends] - cumsums[starts]
+    counts = cumcounts[ends] - cumcounts[starts]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rolled = sums / counts if operation == "mean" else sums
+    return np.where(counts > 0, rolled, np.nan)
+
+
+def lag_by_location(values, group_starts, lag):
+    """Value of lag rows earlier in the same location (NaN for the first lag rows of each location)."""
+    source_rows = np.arange(len(values)) - lag
+    is_same_location = source_rows >= group_starts
+    lagged = np.full(len(values), np.nan)
+    lagged[is_same_location] = values[source_rows[is_same_location]]
+    return lagged
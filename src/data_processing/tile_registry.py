@@ -0,0 +1,95 @@
+"""Persistent registry of static per-location (tile) attributes, e.g. population sums.
+
+These only depend on the location and a few parameters (bbox size, source rasters), so they're computed once per tile
+and saved as Parquet. Later runs on the same grid only compute the attributes of tiles not in the registry yet.
+
+Each set of parameters gets its own registry folder (tiles_<params hash>/, with the params in a JSON file next to it).
+New tiles are appended as their own part file (part-<timestamp>-<uuid>.parquet), so concurrent runs (e.g. the workers of
+predict_sharded) never overwrite each other's tiles.
+"""
+import hashlib
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+
+def get_registry_path(registry_dir, params):
+    params_json = json.dumps(params, sort_keys=True, default=str)
+    params_hash = hashlib.md5(params_json.encode()).hexdigest()[:12]
+    return Path(registry_dir) / f"tiles_{params_hash}"
+
+
+def lookup_tiles(locations_df, id_col, registry_dir, params, compute_fn):
+    """Returns the static attributes of each location, computing them with compute_fn for new tiles only.
+
+    Tiles are keyed by id_col, latitude, and longitude.
+
+    Args:
+        locations_df (dataframe): Locations with id_col, latitude, and longitude columns
+        id_col (str): Location ID column
+        registry_dir (str): Folder of the registries
+        params (dict): JSON-serializable parameters the attributes depend on
+        compute_fn (function): Takes a DF of new locations and returns a DF with id_col and the attribute columns, in the same order
+    Returns:
+        dataframe: id_col and the attribute columns, in the same order (and with the same index) as locations_df
+    """
+    key_cols = [id_col, "latitude", "longitude"]
+    registry_path = get_registry_path(registry_dir, params)
+
+    # (A folder without part files, e.g. if a run was killed before writing its first part, is an empty registry)
+    if any(registry_path.glob("part-*.parquet")):
+        # Concurrent runs may have added the same tiles
+        registry_df = pd.read_parquet(registry_path).drop_duplicates(key_cols)
+        registry_df = registry_df.reset_index(drop=True)
+        is_new = (
+            locations_df[key_cols]
+            .merge(registry_df[key_cols], on=key_cols, how="left", indicator=True)[
+                "_merge"
+            ]
+            .eq("left_only")
+            .values
+        )
+    else:
+        registry_df = None
+        is_new = [True] * len(locations_df)
+
+    new_locations_df = locations_df[is_new].drop_duplicates(key_cols)
+    if len(new_locations_df) > 0:
+        logger.info(
+            f"Computing static attributes for {len(new_locations_df):,} new tiles (registry: {registry_path})"
+        )
+        new_tiles_df = compute_fn(new_locations_df).drop(columns=[id_col])
+        new_tiles_df = pd.concat(
+            [
+                new_locations_df[key_cols].reset_index(drop=True),
+                new_tiles_df.reset_index(drop=True),
+            ],
+            axis=1,
+        )
+        save_tiles(new_tiles_df, registry_path, params)
+        registry_df = pd.concat([registry_df, new_tiles_df], ignore_index=True)
+    else:
+        logger.info(f"All {len(locations_df):,} tiles found in {registry_path}")
+
+    tiles_df = locations_df[key_cols].merge(registry_df, on=key_cols, how="left")
+    tiles_df.index = locations_df.index
+
+    return tiles_df.drop(columns=["latitude", "longitude"])
+
+
+def save_tiles(tiles_df, registry_path, params):
+    """Adds the tiles to the registry, as a new part file."""
+    os.makedirs(registry_path, exist_ok=True)
+    with open(registry_path.with_suffix(".json"), "w") as f:
+        json.dump(params, f, indent=4, default=str)
+
+    # Write to a temp file first, so a crash never leaves a partial part behind (.tmp files are ignored when reading)
+    part_name = f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet"
+    tmp_path = registry_path / f".{part_name}.tmp"
+    tiles_df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, registry_path / part_name)
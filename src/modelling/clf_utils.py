@@ -1,50 +1,47 @@
-from lightgbm import LGBMClassifier
-from sklearn.ensemble import (
-    AdaBoostClassifier,
-    GradientBoostingClassifier,
-    RandomForestClassifier,
-)
-from sklearn.feature_selection import (
-    RFE,
-    SelectKBest,
-    VarianceThreshold,
-    chi2,
-    f_classif,
-    mutual_info_classif,
-)
-from sklearn.gaussian_process import GaussianProcessClassifier
-from sklearn.linear_model import LogisticRegression, RidgeClassifier, SGDClassifier
-from sklearn.naive_bayes import MultinomialNB
-from sklearn.neural_network import MLPClassifier
-from sklearn.svm import SVC, LinearSVC, NuSVC
-from xgboost import XGBClassifier
+import importlib
 
 from src.config import settings
 
-SELECTORS = [
-    "SelectKBest",
-    "SelectKBest_chi2",
-    "SelectKBest_f_classif",
-    "SelectKBest_mutual_info_classif",
-    "RFE",
-    "VarianceThreshold",
-]
-MODELS = [
-    "LogisticRegression",
-    "SGDClassifier",
-    "RidgeClassifier",
-    "LinearSVC",
-    "SVC",
-    "NuSVC",
-    "MLPClassifier",
-    "RandomForestClassifier",
-    "GradientBoostingClassifier",
-    "AdaBoostClassifier",
-    "MultinomialNB",
-    "GaussianProcessClassifier",
-    "LGBMClassifier",
-    "XGBClassifier",
-]
+# Selectors and models are registered by (module, name), and their module is only imported when they are
+# instantiated (see reg_utils)
+SELECTORS = {
+    "SelectKBest": ("sklearn.feature_selection", "SelectKBest", None),
+    "SelectKBest_chi2": ("sklearn.feature_selection", "SelectKBest", "chi2"),
+    "SelectKBest_f_classif": ("sklearn.feature_selection", "SelectKBest", "f_classif"),
+    "SelectKBest_mutual_info_classif": (
+        "sklearn.feature_selection",
+        "SelectKBest",
+        "mutual_info_classif",
+    ),
+    "RFE": ("sklearn.feature_selection", "RFE", None),
+    "VarianceThreshold": ("sklearn.feature_selection", "VarianceThreshold", None),
+}
+MODELS = {
+    "LogisticRegression": ("sklearn.linear_model", "LogisticRegression"),
+    "SGDClassifier": ("sklearn.linear_model", "SGDClassifier"),
+    "RidgeClassifier": ("sklearn.linear_model", "RidgeClassifier"),
+    "LinearSVC": ("sklearn.svm", "LinearSVC"),
+    "SVC": ("sklearn.svm", "SVC"),
+    "NuSVC": ("sklearn.svm", "NuSVC"),
+    "MLPClassifier": ("sklearn.neural_network", "MLPClassifier"),
+    "RandomForestClassifier": ("sklearn.ensemble", "RandomForestClassifier"),
+    "GradientBoostingClassifier": ("sklearn.ensemble", "GradientBoostingClassifier"),
+    "AdaBoostClassifier": ("sklearn.ensemble", "AdaBoostClassifier"),
+    "MultinomialNB": ("sklearn.naive_bayes", "MultinomialNB"),
+    "GaussianProcessClassifier": (
+        "sklearn.gaussian_process",
+        "GaussianProcessClassifier",
+    ),
+    "LGBMClassifier": ("lightgbm", "LGBMClassifier"),
+    "XGBClassifier": ("xgboost", "XGBClassifier"),
+}
+# Models without a random_state parameter
+UNSEEDED_MODELS = ["MultinomialNB"]
+# Extra parameters of some models
+MODEL_PARAMS = {
+    "LogisticRegression": {"max_iter": 1e8},
+    "LinearSVC": {"max_iter": 1e8},
+}
 
 
 def get_selector(selector):
@@ -59,18 +56,11 @@ def get_selector(selector):
 
     assert selector in SELECTORS
 
-    if selector == "SelectKBest":
-        return SelectKBest()
-    elif selector == "SelectKBest_chi2":
-        return SelectKBest(chi2)
-    elif selector == "SelectKBest_f_classif":
-        return SelectKBest(f_classif)
-    elif selector == "SelectKBest_mutual_info_classif":
-        return SelectKBest(mutual_info_classif)
-    elif selector == "VarianceThreshold":
-        return VarianceThreshold()
-    elif selector == "RFE":
-        return RFE()
+    module_name, class_name, score_func_name = SELECTORS[selector]
+    module = importlib.import_module(module_name)
+    if score_func_name is None:
+        return getattr(module, class_name)()
+    return getattr(module, class_name)(getattr(module, score_func_name))
 
 
 def get_model(model, seed=settings.SEED):
@@ -85,31 +75,9 @@ def get_model(model, seed=settings.SEED):
 
     assert model in MODELS
 
-    if model == "LogisticRegression":
-        return LogisticRegression(max_iter=1e8, random_state=seed)
-    elif model == "SGDClassifier":
-        return SGDClassifier(random_state=seed)
-    elif model == "RidgeClassifier":
-        return RidgeClassifier(random_state=seed)
-    elif model == "LinearSVC":
-        return LinearSVC(max_iter=1e8, random_state=seed)
-    elif model == "SVC":
-        return SVC(random_state=seed)
-    elif model == "NuSVC":
-        return NuSVC(random_state=seed)
-    elif model == "RandomForestClassifier":
-        return RandomForestClassifier(random_state=seed)
-    elif model == "GradientBoostingClassifier":
-        return GradientBoostingClassifier(random_state=seed)
-    elif model == "AdaBoostClassifier":
-        return AdaBoostClassifier(random_state=seed)
-    elif model == "MultinomialNB":
-        return MultinomialNB()
-    elif model == "GaussianProcessClassifier":
-        return GaussianProcessClassifier(random_state=seed)
-    elif model == "MLPClassifier":
-        return MLPClassifier(random_state=seed)
-    elif model == "LGBMClassifier":
-        return LGBMClassifier(random_state=seed)
-    elif model == "XGBClassifier":
-        return XGBClassifier(random_state=seed)
+    module_name, class_name = MODELS[model]
+    model_class = getattr(importlib.import_module(module_name), class_name)
+    params = MODEL_PARAMS.get(model, {})
+    if model in UNSEEDED_MODELS:
+        return model_class(**params)
+    return model_class(random_state=seed, **params)
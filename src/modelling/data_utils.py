@@ -1,7 +1,6 @@
 from collections import Counter
 
 import numpy as np
-from imblearn.over_sampling import SMOTE
 from loguru import logger
 from sklearn.impute import SimpleImputer
 from sklearn.preprocessing import LabelEncoder
@@ -70,7 +69,9 @@ def balance_data(df, label, seed=settings.SEED):
     encoder = LabelEncoder()
     y = encoder.fit_transform(y)
 
-    # Oversampling
+    # Oversampling (imblearn is only imported when balancing)
+    from imblearn.over_sampling import SMOTE
+
     oversample = SMOTE(random_state=seed)
     X_os, y_os = oversample.fit_resample(X, y)
 
@@ -1,4 +1,3 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from scipy import stats
@@ -66,6 +65,9 @@ def get_scoring():
 
 
 def plot_actual_vs_predicted(y_true, y_pred):
+    # matplotlib is only imported when plotting
+    import matplotlib.pyplot as plt
+
     plt.clf()
     plt.scatter(y_true, y_pred)
     plt.xlabel("Actual")
@@ -87,6 +89,8 @@ def generate_simplified_shap(
     color=["#4682B4", "#CD5C5C"],
     barwidth=0.8,
 ):
+    import matplotlib.pyplot as plt
+
     try:
         shap_v = pd.DataFrame(df_shap)
     except ValueError:
@@ -4,7 +4,6 @@ import os
 import numpy as np
 import pandas as pd
 from loguru import logger
-from matplotlib import pyplot as plt
 from sklearn.model_selection import GridSearchCV, GroupKFold, KFold, RandomizedSearchCV
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import (
@@ -13,7 +12,6 @@ from sklearn.preprocessing import (
     RobustScaler,
     StandardScaler,
 )
-from tune_sklearn import TuneGridSearchCV, TuneSearchCV
 
 from src.config import settings
 from src.config.models import ExperimentConfig
@@ -136,8 +134,13 @@ def get_cv(c, seed=settings.SEED):
 
     scoring = eval_utils.get_scoring()
     if cv == "TuneGridSearchCV":
+        # tune_sklearn imports Ray, so it's only imported when used
+        from tune_sklearn import TuneGridSearchCV
+
         return TuneGridSearchCV(pipe, params, scoring=scoring, **cv_params)
     elif cv == "TuneSearchCV":
+        from tune_sklearn import TuneSearchCV
+
         return TuneSearchCV(
             pipe,
             params,
@@ -199,7 +202,7 @@ def nested_cv(c: ExperimentConfig, df, X, y, seed=settings.SEED, k=5, out_dir=No
         if out_dir:
             fig = eval_utils.plot_actual_vs_predicted(y_test, y_pred)
             fig.savefig(os.path.join(out_dir, f"scatterplot_nestedcv_{index}.png"))
-            plt.clf()
+            fig.clf()
 
     mean_results = {}
     for metric, values in outer_cv_result.items():
@@ -208,7 +211,7 @@ def nested_cv(c: ExperimentConfig, df, X, y, seed=settings.SEED, k=5, out_dir=No
     if out_dir:
         fig = eval_utils.plot_actual_vs_predicted(all_y_test, all_y_pred)
         fig.savefig(os.path.join(out_dir, "scatterplot_nestedcv_combined.png"))
-        plt.clf()
+        fig.clf()
 
         df_wpreds.to_csv(os.path.join(out_dir, "nestedcv_fold_combined.csv"))
 
@@ -280,7 +283,7 @@ def spatial_cv(c, df, X, y, k=5, out_dir=None):
         if out_dir:
             fig = eval_utils.plot_actual_vs_predicted(y_test, y_pred)
             fig.savefig(os.path.join(out_dir, f"scatterplot_nestedspatialcv_{idx}.png"))
-            plt.clf()
+            fig.clf()
 
     mean_results = {}
     for metric, values in outer_cv_result.items():
@@ -289,7 +292,7 @@ def spatial_cv(c, df, X, y, k=5, out_dir=None):
     if out_dir:
         fig = eval_utils.plot_actual_vs_predicted(all_y_test, all_y_pred)
         fig.savefig(os.path.join(out_dir, "scatterplot_nestedspatialcv_combined.png"))
-        plt.clf()
+        fig.clf()
 
         df_wpreds.to_csv(os.path.join(out_dir, "spatial_fold_combined.csv"))
 
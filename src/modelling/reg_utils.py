@@ -1,54 +1,46 @@
-from lightgbm import LGBMRegressor
-from sklearn.ensemble import (
-    AdaBoostRegressor,
-    GradientBoostingRegressor,
-    RandomForestRegressor,
-)
-from sklearn.feature_selection import (
-    RFE,
-    SelectKBest,
-    VarianceThreshold,
-    f_regression,
-    mutual_info_regression,
-)
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.linear_model import (
-    ElasticNet,
-    Lasso,
-    LinearRegression,
-    Ridge,
-    SGDRegressor,
-)
-from sklearn.neural_network import MLPRegressor
-from sklearn.svm import SVR, LinearSVR, NuSVR
-from xgboost import XGBRegressor
+import importlib
 
 from src.config import settings
 
 SEED = 42
-SELECTORS = [
-    "SelectKBest_f_regression",
-    "SelectKBest_mutual_info_regression",
-    "VarianceThreshold",
-    "RFE",
-]
-MODELS = [
-    "LinearRegression",
-    "Lasso",
-    "Ridge,",
-    "ElasticNet",
-    "SGDRegressor",
-    "LinearSVR",
-    "SVR",
-    "NuSVR",
-    "GaussianProcessRegressor",
-    "RandomForestRegressor",
-    "AdaBoostRegressor",
-    "GradientBoostingRegressor",
-    "MLPRegressor",
-    "LGBMRegressor",
-    "XGBRegressor",
-]
+# Selectors and models are registered by (module, name), and their module is only imported when they are
+# instantiated. Importing every sklearn estimator, LightGBM, and XGBoost up front takes seconds.
+SELECTORS = {
+    "SelectKBest_f_regression": (
+        "sklearn.feature_selection",
+        "SelectKBest",
+        "f_regression",
+    ),
+    "SelectKBest_mutual_info_regression": (
+        "sklearn.feature_selection",
+        "SelectKBest",
+        "mutual_info_regression",
+    ),
+    "VarianceThreshold": ("sklearn.feature_selection", "VarianceThreshold", None),
+    "RFE": ("sklearn.feature_selection", "RFE", None),
+}
+MODELS = {
+    "LinearRegression": ("sklearn.linear_model", "LinearRegression"),
+    "Lasso": ("sklearn.linear_model", "Lasso"),
+    "Ridge": ("sklearn.linear_model", "Ridge"),
+    "ElasticNet": ("sklearn.linear_model", "ElasticNet"),
+    "SGDRegressor": ("sklearn.linear_model", "SGDRegressor"),
+    "LinearSVR": ("sklearn.svm", "LinearSVR"),
+    "SVR": ("sklearn.svm", "SVR"),
+    "NuSVR": ("sklearn.svm", "NuSVR"),
+    "GaussianProcessRegressor": (
+        "sklearn.gaussian_process",
+        "GaussianProcessRegressor",
+    ),
+    "RandomForestRegressor": ("sklearn.ensemble", "RandomForestRegressor"),
+    "AdaBoostRegressor": ("sklearn.ensemble", "AdaBoostRegressor"),
+    "GradientBoostingRegressor": ("sklearn.ensemble", "GradientBoostingRegressor"),
+    "MLPRegressor": ("sklearn.neural_network", "MLPRegressor"),
+    "LGBMRegressor": ("lightgbm", "LGBMRegressor"),
+    "XGBRegressor": ("xgboost", "XGBRegressor"),
+}
+# Models without a random_state parameter
+UNSEEDED_MODELS = ["LinearRegression", "SVR", "NuSVR"]
 
 
 def get_selector(selector):
@@ -61,14 +53,11 @@ def get_selector(selector):
 
     assert selector in SELECTORS
 
-    if selector == "SelectKBest_f_regression":
-        return SelectKBest(f_regression)
-    elif selector == "SelectKBest_mutual_info_regression":
-        return SelectKBest(mutual_info_regression)
-    elif selector == "VarianceThreshold":
-        return VarianceThreshold()
-    elif selector == "RFE":
-        return RFE()
+    module_name, class_name, score_func_name = SELECTORS[selector]
+    module = importlib.import_module(module_name)
+    if score_func_name is None:
+        return getattr(module, class_name)()
+    return getattr(module, class_name)(getattr(module, score_func_name))
 
 
 def get_model(model, seed=settings.SEED):
@@ -81,33 +70,8 @@ def get_model(model, seed=settings.SEED):
 
     assert model in MODELS
 
-    if model == "LinearRegression":
-        return LinearRegression()
-    elif model == "Lasso":
-        return Lasso(random_state=seed)
-    elif model == "Ridge":
-        return Ridge(random_state=seed)
-    elif model == "ElasticNet":
-        return ElasticNet(random_state=seed)
-    elif model == "SGDRegressor":
-        return SGDRegressor(random_state=seed)
-    elif model == "LinearSVR":
-        return LinearSVR(random_state=seed)
-    elif model == "SVR":
-        return SVR()
-    elif model == "NuSVR":
-        return NuSVR()
-    elif model == "GaussianProcessRegressor":
-        return GaussianProcessRegressor(random_state=seed)
-    elif model == "RandomForestRegressor":
-        return RandomForestRegressor(random_state=seed)
-    elif model == "AdaBoostRegressor":
-        return AdaBoostRegressor(random_state=seed)
-    elif model == "GradientBoostingRegressor":
-        return GradientBoostingRegressor(random_state=seed)
-    elif model == "MLPRegressor":
-        return MLPRegressor(random_state=seed)
-    elif model == "LGBMRegressor":
-        return LGBMRegressor(random_state=seed)
-    elif model == "XGBRegressor":
-        return XGBRegressor(random_state=seed)
+    module_name, class_name = MODELS[model]
+    model_class = getattr(importlib.import_module(module_name), class_name)
+    if model in UNSEEDED_MODELS:
+        return model_class()
+    return model_class(random_state=seed)
@@ -0,0 +1,290 @@
+"""AQI banding and streaming summary statistics of predictions.
+
+Values are banded against the US EPA PM2.5 breakpoints with np.digitize (instead of a per-row apply).
+
+Summaries (mean, percentiles, and days above each AQI breakpoint, per tile and/or period) are computed chunk by chunk,
+so partitioned prediction outputs (e.g. the part files of predict.py --shard-size) can be summarized without loading
+them all at once:
+- Per tile (ShardedSummary): the part files are split by location shard, so only the rows of the current shard are
+  kept, and the summaries of its tiles are computed exactly once the next shard starts.
+- Per period over all tiles (StreamingSummary): only mergeable partial aggregates are kept between chunks: sums and
+  counts, and a histogram of the values in bin_width bins for the percentiles (which are then exact to bin_width).
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+# Lower bounds of the US EPA PM2.5 (24-hour, ug/m3) AQI categories
+AQI_BREAKPOINTS = [0.0, 12.1, 35.5, 55.5, 150.5, 250.5]
+AQI_CATEGORIES = [
+    "good",
+    "moderate",
+    "unhealthy_for_sensitive_groups",
+    "unhealthy",
+    "very_unhealthy",
+    "hazardous",
+]
+DEFAULT_PERCENTILES = [50, 90, 99]
+CHUNK_SIZE = 1000000
+# Column added by iter_prediction_chunks to the chunks of part files (e.g. "part-00000" for part-00000_<window>.parquet)
+SHARD_COL = "shard"
+
+
+def get_aqi_band(values):
+    """Returns the index of the AQI category of each value (negative values are "good", NaN is -1)."""
+    values = np.asarray(values, dtype=np.float64)
+    bands = np.digitize(values, AQI_BREAKPOINTS[1:])
+    return np.where(np.isnan(values), -1, bands)
+
+
+def categorize_values(values):
+    """Returns the AQI categories of the values, as an ordered pandas Categorical (NaN for missing values)."""
+    return pd.Categorical.from_codes(
+        get_aqi_band(values), categories=AQI_CATEGORIES, ordered=True
+    )
+
+
+class StreamingSummary:
+    """Statistics of value_col per group (e.g. per tile and month), accumulated over chunks of rows.
+
+    Call update(chunk_df) for every chunk, then result() for a DF with group_cols, n_days, mean, min, max,
+    p<percentile> for each percentile, and days_above_<breakpoint> for each AQI breakpoint above 0.
+    Groups can span several chunks (e.g. a month split into time windows). The kept state grows with the number of
+    groups times the number of histogram bins, so this is meant for few groups (e.g. periods).
+    """
+
+    def __init__(
+        self,
+        group_cols,
+        value_col,
+        percentiles=DEFAULT_PERCENTILES,
+        bin_width=0.1,
+    ):
+        self.group_cols = list(group_cols)
+        self.value_col = value_col
+        self.percentiles = percentiles
+        self.bin_width = bin_width
+        self.totals = None
+        self.histogram = None
+
+    def update(self, chunk_df):
+        values = chunk_df[self.value_col].to_numpy(dtype=np.float64)
+        is_valid = ~np.isnan(values)
+        keys_df = chunk_df.loc[is_valid, self.group_cols].reset_index(drop=True)
+        values = values[is_valid]
+
+        bands = get_aqi_band(values)
+        totals_df = keys_df.assign(
+            n_days=1,
+            sum=values,
+            min=values,
+            max=values,
+            **{
+                f"days_above_{breakpoint:g}": bands >= band
+                for band, breakpoint in enumerate(AQI_BREAKPOINTS)
+                if band > 0
+            },
+        )
+        totals = totals_df.groupby(self.group_cols, sort=False).agg(
+            {
+                col: _get_merge_func(col)
+                for col in totals_df.columns[len(self.group_cols) :]
+            }
+        )
+        histogram = (
+            keys_df.assign(bin=np.floor(values / self.bin_width).astype(np.int64))
+            .groupby(self.group_cols + ["bin"], sort=False)
+            .size()
+        )
+
+        self.totals = _merge(self.totals, totals)
+        self.histogram = (
+            histogram
+            if self.histogram is None
+            else self.histogram.add(histogram, fill_value=0)
+        )
+
+    def result(self):
+        if self.totals is None:
+            return None
+
+        summary_df = self.totals.assign(mean=self.totals["sum"] / self.totals["n_days"])
+        for percentile in self.percentiles:
+            summary_df[f"p{percentile:g}"] = self.get_percentile(percentile)
+
+        return _format_summary(summary_df, self.percentiles)
+
+    def get_percentile(self, percentile):
+        # Nearest-rank percentile of each group: the center of the first bin whose cumulative count reaches the rank
+        histogram = self.histogram.sort_index()
+        groups = histogram.index.droplevel("bin")
+        cumulative = histogram.groupby(groups).cumsum()
+        total = histogram.groupby(groups).transform("sum")
+        rank = np.maximum(np.ceil(percentile / 100 * total), 1)
+
+        reached = histogram[(cumulative >= rank).values]
+        first_bins = (
+            reached.index.to_frame(index=False).groupby(self.group_cols)["bin"].first()
+        )
+        # (Rounded, to drop the float noise of the bin centers)
+        percentiles = ((first_bins + 0.5) * self.bin_width).round(6)
+        return percentiles.reindex(self.totals.index).values
+
+
+class ShardedSummary:
+    """Exact statistics of value_col per group (e.g. per tile and month), over chunks of rows split by location shard.
+
+    Same interface and result columns as StreamingSummary. The rows of a group must all be in the same shard (the
+    SHARD_COL of the chunks, e.g. from iter_prediction_chunks). Only the rows of the current shard are kept, and its
+    groups are summarized once a chunk of another shard comes. Chunks without SHARD_COL are all one shard.
+    """
+
+    def __init__(self, group_cols, value_col, percentiles=DEFAULT_PERCENTILES):
+        self.group_cols = list(group_cols)
+        self.value_col = value_col
+        self.percentiles = percentiles
+        self.shard = None
+        self.shard_chunks = []
+        self.summaries = []
+
+    def update(self, chunk_df):
+        shard = chunk_df[SHARD_COL].iloc[0] if SHARD_COL in chunk_df else None
+        if shard != self.shard:
+            self._summarize_shard()
+            self.shard = shard
+        self.shard_chunks.append(chunk_df[self.group_cols + [self.value_col]])
+
+    def result(self):
+        self._summarize_shard()
+        if not self.summaries:
+            return None
+
+        summary_df = pd.concat(self.summaries)
+        if summary_df.index.duplicated().any():
+            raise ValueError(
+                f"Some {self.group_cols} groups span several shards, so they can't be summarized shard by shard"
+            )
+        return _format_summary(summary_df, self.percentiles)
+
+    def _summarize_shard(self):
+        if not self.shard_chunks:
+            return
+        shard_df = pd.concat(self.shard_chunks, ignore_index=True)
+        self.shard_chunks = []
+        self.summaries.append(
+            _summarize_groups(
+                shard_df, self.group_cols, self.value_col, self.percentiles
+            )
+        )
+
+
+def add_period(df, freq, date_col="date"):
+    """Adds the period (start date of the pandas period frequency freq, e.g. "M") of each row."""
+    return df.assign(
+        period=pd.to_datetime(df[date_col]).dt.to_period(freq).dt.start_time
+    )
+
+
+def summarize_predictions(chunks, id_col, pred_col, freq="M", date_col="date"):
+    """Summarizes predictions per tile and period (see ShardedSummary), and per period over all tiles (see
+    StreamingSummary).
+
+    chunks is an iterable of prediction DFs (e.g. from iter_prediction_chunks), or a single DF.
+
+    Returns:
+        dict: "tiles" and "periods" summary DFs
+    """
+    if isinstance(chunks, pd.DataFrame):
+        chunks = [chunks]
+
+    tile_summary = ShardedSummary([id_col, "period"], pred_col)
+    period_summary = StreamingSummary(["period"], pred_col)
+    for chunk_df in chunks:
+        chunk_df = add_period(chunk_df, freq, date_col=date_col)
+        tile_summary.update(chunk_df)
+        period_summary.update(chunk_df)
+
+    return {
+        "tiles": tile_summary.result().sort_values(by=[id_col, "period"]),
+        "periods": period_summary.result().sort_values(by="period"),
+    }
+
+
+def iter_prediction_chunks(path, columns, chunk_size=CHUNK_SIZE):
+    """Reads a predictions CSV, Parquet file, or folder of Parquet part files in chunks of chunk_size rows.
+
+    Only the given columns are read. The chunks of a folder's part files also get the SHARD_COL of their file (the part
+    files of predict.py --shard-size are read shard after shard).
+    """
+    path = Path(path)
+    if path.suffix == ".csv":
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_size)
+        return
+    if not path.is_dir():
+        for batch in ds.dataset(str(path), format="parquet").to_batches(
+            columns=columns, batch_size=chunk_size
+        ):
+            yield batch.to_pandas()
+        return
+
+    # Folders are read from their top-level part files (sub-folders hold the native-cadence tables)
+    for part_path in sorted(path.glob("part-*.parquet")):
+        shard = part_path.stem.split("_")[0]
+        dataset = ds.dataset(str(part_path), format="parquet")
+        for batch in dataset.to_batches(columns=columns, batch_size=chunk_size):
+            yield batch.to_pandas().assign(**{SHARD_COL: shard})
+
+
+def _summarize_groups(df, group_cols, value_col, percentiles):
+    df = df[df[value_col].notna()]
+    values = df[value_col].to_numpy(dtype=np.float64)
+    bands = get_aqi_band(values)
+    days_above = {
+        f"days_above_{breakpoint:g}": bands >= band
+        for band, breakpoint in enumerate(AQI_BREAKPOINTS)
+        if band > 0
+    }
+    grouped = df.assign(**days_above).groupby(group_cols, sort=False)
+    summary_df = grouped[value_col].agg(
+        n_days="size", mean="mean", min="min", max="max"
+    )
+    summary_df = summary_df.join(grouped[list(days_above)].sum())
+
+    # Nearest-rank percentiles, from the values sorted within each group (numbered in the order of summary_df)
+    codes = grouped.ngroup().to_numpy()
+    sorted_values = values[np.lexsort((values, codes))]
+    counts = summary_df["n_days"].to_numpy()
+    starts = np.cumsum(counts) - counts
+    for percentile in percentiles:
+        rank = np.maximum(np.ceil(percentile / 100 * counts), 1).astype(np.int64)
+        summary_df[f"p{percentile:g}"] = sorted_values[starts + rank - 1]
+    return summary_df
+
+
+def _format_summary(summary_df, percentiles):
+    first_cols = ["n_days", "mean", "min", "max"] + [
+        f"p{percentile:g}" for percentile in percentiles
+    ]
+    days_cols = [col for col in summary_df.columns if col.startswith("days_above_")]
+    return (
+        summary_df[first_cols + days_cols]
+        .astype({col: np.int64 for col in ["n_days"] + days_cols})
+        .reset_index()
+    )
+
+
+def _get_merge_func(col):
+    if col in ["min", "max"]:
+        return col
+    return "sum"
+
+
+def _merge(totals, new_totals):
+    if totals is None:
+        return new_totals
+    combined = pd.concat([totals, new_totals])
+    return combined.groupby(level=list(range(combined.index.nlevels)), sort=False).agg(
+        {col: _get_merge_func(col) for col in combined.columns}
+    )
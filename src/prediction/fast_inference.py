@@ -0,0 +1,277 @@
+"""Fused inference path for the trained [scaler, selector, model] pipelines (see model_utils._get_pipeline).
+
+Pipeline.predict on a pandas slice validates and copies the data at every step. Instead, the fitted steps are
+extracted once into plain arrays:
+- the selector becomes the indices of the kept columns (so only those are read and scaled)
+- the scaler becomes per-column subtract/divide (or multiply/add) arrays, applied in sklearn's order
+- XGBoost and LightGBM models are called through their native booster (XGBoost's multithreaded inplace_predict)
+
+The scaling is done in float64 like sklearn, and the result is handed to the booster as a contiguous matrix in the
+dtype it predicts in (float32 for XGBoost, float64 for LightGBM), so the predictions match Pipeline.predict.
+
+Fused XGBoost/LightGBM pipelines can also be saved as a compact artifact folder, which loads without pickle
+(and without sklearn):
+- model.json: the feature list, booster type, scaling ops, model hash, and metadata (e.g. library versions)
+- arrays.npz: the selected column indices and the scaling arrays
+- booster.json (XGBoost) or booster.txt (LightGBM): the booster in its native format
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+ARTIFACT_FORMAT_VERSION = 1
+METADATA_FILENAME = "model.json"
+ARRAYS_FILENAME = "arrays.npz"
+BOOSTER_FILENAMES = {"xgboost": "booster.json", "lightgbm": "booster.txt"}
+# Names of the scaling ops in model.json
+SCALE_OPS = {
+    "subtract": np.subtract,
+    "divide": np.divide,
+    "multiply": np.multiply,
+    "add": np.add,
+}
+
+
+class FusedPipeline:
+    """Drop-in replacement for a fitted pipeline's predict, with the same feature_names attribute.
+
+    Args:
+        feature_names (list): Input feature columns, in order
+        columns (array): Indices of the columns kept by the selector (None to keep all)
+        scale_ops (list): (numpy ufunc, per-column values) pairs, applied in order to the kept columns
+        booster_type (str): "xgboost", "lightgbm", or "sklearn" (any other fitted model)
+        booster: The native booster (or the sklearn model)
+    """
+
+    def __init__(
+        self,
+        feature_names,
+        columns,
+        scale_ops,
+        booster_type,
+        booster,
+        iteration_range=(0, 0),
+        missing=np.nan,
+        model_hash=None,
+        metadata=None,
+    ):
+        self.feature_names = feature_names
+        self.columns = columns
+        self.scale_ops = scale_ops
+        self.booster_type = booster_type
+        self.booster = booster
+        self.iteration_range = iteration_range
+        self.missing = missing
+        self.model_hash = model_hash
+        self.metadata = metadata or {}
+        self.dtype = np.float32 if booster_type == "xgboost" else np.float64
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        steps = [step for _, step in pipeline.steps]
+        *transformers, model = steps
+        if len(transformers) != 2:
+            raise ValueError(f"Expected [scaler, selector, model] steps, got {steps}")
+        scaler, selector = transformers
+        columns = _get_selected_columns(selector)
+        scale_ops = _get_scale_ops(scaler, columns)
+        feature_names = getattr(pipeline, "feature_names", None)
+
+        model_class = type(model).__name__
+        if model_class == "XGBRegressor":
+            booster = model.get_booster()
+            best_iteration = booster.attr("best_iteration")
+            iteration_range = (0, int(best_iteration) + 1 if best_iteration else 0)
+            return cls(
+                feature_names,
+                columns,
+                scale_ops,
+                "xgboost",
+                booster,
+                iteration_range=iteration_range,
+                missing=model.missing,
+            )
+        if model_class == "LGBMRegressor":
+            return cls(feature_names, columns, scale_ops, "lightgbm", model.booster_)
+        # Other models get the fused transform, then their own predict
+        return cls(feature_names, columns, scale_ops, "sklearn", model)
+
+    def transform(self, X):
+        # Only the selected columns are copied out (into a new contiguous array) and scaled
+        if hasattr(X, "iloc"):
+            X = X.iloc[:, self.columns] if self.columns is not None else X
+            X = X.to_numpy(dtype=np.float64, copy=True)
+        else:
+            X = np.asarray(X, dtype=np.float64)
+            X = X[:, self.columns] if self.columns is not None else X.copy()
+        for op, values in self.scale_ops:
+            op(X, values, out=X)
+        return np.ascontiguousarray(X, dtype=self.dtype)
+
+    def predict(self, X):
+        X = self.transform(X)
+        if self.booster_type == "xgboost":
+            return self.booster.inplace_predict(
+                X, iteration_range=self.iteration_range, missing=self.missing
+            )
+        return self.booster.predict(X)
+
+
+def fuse_pipeline(pipeline):
+    """Returns the FusedPipeline of a fitted pipeline, or the pipeline itself if some step isn't supported."""
+    if not hasattr(pipeline, "steps"):
+        return pipeline
+    try:
+        return FusedPipeline.from_pipeline(pipeline)
+    except ValueError as e:
+        logger.warning(f"Using the sklearn pipeline for inference: {e}")
+        return pipeline
+
+
+def save_artifact(fused, artifact_dir, metadata=None):
+    """Saves a fused XGBoost or LightGBM pipeline as an artifact folder (see the module docstring).
+
+    Returns the model hash: a hash of the booster, arrays, and feature list, which identifies the model's predictions.
+    """
+    if fused.booster_type not in BOOSTER_FILENAMES:
+        raise ValueError(f"Can't export a {fused.booster_type} model as an artifact")
+
+    artifact_dir = Path(artifact_dir)
+    os.makedirs(artifact_dir, exist_ok=True)
+
+    booster_path = artifact_dir / BOOSTER_FILENAMES[fused.booster_type]
+    fused.booster.save_model(str(booster_path))
+
+    arrays = {"columns": fused.columns if fused.columns is not None else np.array([])}
+    for op_index, (_, values) in enumerate(fused.scale_ops):
+        arrays[f"scale_op_{op_index}"] = values
+    np.savez(artifact_dir / ARRAYS_FILENAME, **arrays)
+
+    # (The npz file itself isn't hashed, since its zip headers hold the write time)
+    model_hash = hashlib.sha256(booster_path.read_bytes())
+    for name, values in arrays.items():
+        model_hash.update(name.encode() + np.ascontiguousarray(values).tobytes())
+    model_hash.update(json.dumps(list(fused.feature_names)).encode())
+
+    scale_op_names = {op: op_name for op_name, op in SCALE_OPS.items()}
+    model_json = {
+        "format_version": ARTIFACT_FORMAT_VERSION,
+        "model_hash": model_hash.hexdigest()[:16],
+        "feature_names": list(fused.feature_names),
+        "booster_type": fused.booster_type,
+        "has_selector": fused.columns is not None,
+        "scale_ops": [scale_op_names[op] for op, _ in fused.scale_ops],
+        "iteration_range": list(fused.iteration_range),
+        "missing": None if np.isnan(fused.missing) else float(fused.missing),
+        "metadata": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "library_version": _get_library_version(fused.booster_type),
+            **(metadata or {}),
+        },
+    }
+    with open(artifact_dir / METADATA_FILENAME, "w") as f:
+        json.dump(model_json, f, indent=4, default=str)
+
+    return model_json["model_hash"]
+
+
+def load_artifact(artifact_dir):
+    """Loads an artifact folder saved by save_artifact into a FusedPipeline. Only imports the booster's library."""
+    artifact_dir = Path(artifact_dir)
+    with open(artifact_dir / METADATA_FILENAME) as f:
+        model_json = json.load(f)
+    if model_json["format_version"] != ARTIFACT_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported artifact format version {model_json['format_version']}"
+        )
+
+    with np.load(artifact_dir / ARRAYS_FILENAME, allow_pickle=False) as arrays:
+        columns = arrays["columns"] if model_json["has_selector"] else None
+        scale_ops = [
+            (SCALE_OPS[op_name], arrays[f"scale_op_{op_index}"])
+            for op_index, op_name in enumerate(model_json["scale_ops"])
+        ]
+
+    booster_type = model_json["booster_type"]
+    booster_path = str(artifact_dir / BOOSTER_FILENAMES[booster_type])
+    if booster_type == "xgboost":
+        import xgboost
+
+        booster = xgboost.Booster(model_file=booster_path)
+    else:
+        import lightgbm
+
+        booster = lightgbm.Booster(model_file=booster_path)
+
+    missing = model_json["missing"]
+    return FusedPipeline(
+        model_json["feature_names"],
+        columns,
+        scale_ops,
+        booster_type,
+        booster,
+        iteration_range=tuple(model_json["iteration_range"]),
+        missing=np.nan if missing is None else missing,
+        model_hash=model_json["model_hash"],
+        metadata=model_json["metadata"],
+    )
+
+
+def is_artifact(model_path):
+    return (Path(model_path) / METADATA_FILENAME).exists()
+
+
+def _get_library_version(booster_type):
+    if booster_type == "xgboost":
+        import xgboost
+
+        return f"xgboost=={xgboost.__version__}"
+    import lightgbm
+
+    return f"lightgbm=={lightgbm.__version__}"
+
+
+def _get_selected_columns(selector):
+    if selector in (None, "passthrough"):
+        return None
+    if not hasattr(selector, "get_support"):
+        raise ValueError(f"Unsupported selector {selector}")
+    return selector.get_support(indices=True)
+
+
+def _get_scale_ops(scaler, columns):
+    # The same in-place operations (and order) as the scaler's transform, on the selected columns
+    # (Scalers are matched by class name, so that loading artifacts doesn't need sklearn)
+    if scaler in (None, "passthrough"):
+        return []
+
+    def select(values):
+        return values if columns is None else values[columns]
+
+    scaler_class = type(scaler).__name__
+    if scaler_class == "StandardScaler":
+        ops = []
+        if scaler.with_mean:
+            ops.append((np.subtract, select(scaler.mean_)))
+        if scaler.with_std:
+            ops.append((np.divide, select(scaler.scale_)))
+        return ops
+    if scaler_class == "MinMaxScaler":
+        if scaler.clip:
+            raise ValueError("Unsupported MinMaxScaler with clip=True")
+        return [(np.multiply, select(scaler.scale_)), (np.add, select(scaler.min_))]
+    if scaler_class == "RobustScaler":
+        ops = []
+        if scaler.with_centering:
+            ops.append((np.subtract, select(scaler.center_)))
+        if scaler.with_scaling:
+            ops.append((np.divide, select(scaler.scale_)))
+        return ops
+    if scaler_class == "MaxAbsScaler":
+        return [(np.divide, select(scaler.scale_))]
+    raise ValueError(f"Unsupported scaler {scaler}")
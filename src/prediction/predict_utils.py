@@ -1,8 +1,33 @@
+import hashlib
+import multiprocessing
+import os
+from pathlib import Path
+
 import joblib
 import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
 from loguru import logger
 
-from src.data_processing import feature_collection_pipeline
+from src.data_processing import (
+    feature_collection_pipeline,
+    feature_store,
+    hrsl,
+    job_manifest,
+    neighbors,
+    temporal,
+)
+from src.data_processing.gee import gee_utils
+from src.prediction import fast_inference, prediction_cache
+
+# Customized the list of GEE datasets because the latest model doesn't use MAIAC
+PREDICTION_GEE_DATASETS = [
+    feature_collection_pipeline.S5P_AAI_CONFIG,
+    feature_collection_pipeline.CAMS_AOD_CONFIG,
+    feature_collection_pipeline.NDVI_CONFIG,
+    feature_collection_pipeline.ERA5_CONFIG,
+]
 
 
 def predict(
@@ -14,35 +39,442 @@ def predict(
     model_path,
     bbox_size_km=1,
     pred_col="predicted_pm2.5",
+    hrsl_engine="zonal_stats",
+    tile_registry_dir=None,
+    feature_store_dir=None,
+    neighbor_config=None,
+    prediction_cache_dir=None,
 ):
+    """Collects the features of every location and date in the range, and runs the model on them.
 
+    If prediction_cache_dir is given, predictions are cached there, keyed by the model hash, the feature version,
+    the location, and the date. Cached predictions are returned directly, and only the missing ones are computed
+    (see prediction_cache.predict_cached).
+    """
     logger.info(
         f"Running prediction on {len(locations_df):,} locations from {start_date} to {end_date}..."
     )
 
-    # Create base DF from the locations (collect the necessary features)
-    logger.info("Collecting features...")
-    base_df = feature_collection_pipeline.collect_features_for_locations(
-        locations_df=locations_df,
+    model = load_model(model_path)
+    sources = get_required_sources(model, hrsl_tif, neighbor_config=neighbor_config)
+
+    def predict_locations(locations_df, start_date, end_date):
+        # Create base DF from the locations (collect only the features the model needs)
+        logger.info("Collecting features...")
+        base_df = feature_collection_pipeline.collect_features_for_locations(
+            locations_df=locations_df,
+            start_date=start_date,
+            end_date=end_date,
+            id_col=id_col,
+            bbox_size_km=bbox_size_km,
+            hrsl_engine=hrsl_engine,
+            tile_registry_dir=tile_registry_dir,
+            feature_store_dir=feature_store_dir,
+            **sources,
+        )
+
+        logger.info("Running the model...")
+
+        return run_model(model, base_df, pred_col=pred_col)
+
+    if not prediction_cache_dir:
+        return predict_locations(locations_df, start_date, end_date)
+
+    feature_version = prediction_cache.get_feature_version(
+        get_feature_config(
+            sources,
+            bbox_size_km=bbox_size_km,
+            hrsl_engine=hrsl_engine,
+            pred_col=pred_col,
+        )
+    )
+    return prediction_cache.predict_cached(
+        prediction_cache_dir,
+        model.model_hash,
+        feature_version,
+        locations_df,
+        start_date,
+        end_date,
+        id_col,
+        predict_fn=predict_locations,
+    )
+
+
+def predict_from_features(
+    features_path,
+    model_paths,
+    id_col,
+    start_date=None,
+    end_date=None,
+    locations_df=None,
+    native_paths=None,
+    pred_col="predicted_pm2.5",
+    date_col="date",
+):
+    """Scores a precomputed feature table (e.g. from generate_features.py) with one or more models, without calling GEE.
+
+    features_path is a CSV or Parquet file, or a folder of Parquet part files (e.g. from generate_features.py --shard-size),
+    whose sub-folders are read as native-cadence tables. Native-cadence tables saved separately (native_paths, CSV or
+    Parquet) are expanded onto the daily rows as well (see feature_collection_pipeline.expand_native_features).
+
+    Only the columns the models use are read, and the table is filtered to the date range (and the locations of
+    locations_df, if given). All the models then score the same loaded features. With one model, the predictions are
+    in pred_col. With several, they're in <pred_col>_<model name> columns (see get_model_names).
+    """
+    model_names = get_model_names(model_paths)
+    models = {name: load_model(path) for name, path in zip(model_names, model_paths)}
+    feature_names = list(
+        dict.fromkeys(
+            feature_name
+            for model in models.values()
+            for feature_name in model.feature_names
+        )
+    )
+    ids = None if locations_df is None else locations_df[id_col].unique()
+
+    features_path = Path(features_path)
+    native_paths = list(native_paths or [])
+    if features_path.is_dir():
+        native_paths += [path for path in features_path.iterdir() if path.is_dir()]
+
+    logger.info(f"Reading features from {features_path}...")
+    key_cols = [id_col, "latitude", "longitude", date_col]
+    base_df = read_feature_table(
+        features_path,
+        key_cols + feature_names,
+        id_col,
         start_date=start_date,
         end_date=end_date,
-        id_col=id_col,
-        hrsl_tif=hrsl_tif,
-        bbox_size_km=bbox_size_km,
-        # Customized the list of GEE datasets because the latest model doesn't use MAIAC
-        gee_datasets=[
-            feature_collection_pipeline.S5P_AAI_CONFIG,
-            feature_collection_pipeline.CAMS_AOD_CONFIG,
-            feature_collection_pipeline.NDVI_CONFIG,
-            feature_collection_pipeline.ERA5_CONFIG,
-        ],
+        ids=ids,
+        date_col=date_col,
+    )
+    if native_paths:
+        native_dfs = {
+            str(path): read_feature_table(
+                path,
+                [id_col, date_col] + feature_names,
+                id_col,
+                ids=ids,
+                date_col=date_col,
+            )
+            for path in native_paths
+        }
+        base_df = feature_collection_pipeline.expand_native_features(
+            base_df, native_dfs, id_col=id_col, date_col=date_col
+        )
+
+    missing_features = [name for name in feature_names if name not in base_df]
+    if missing_features:
+        raise ValueError(
+            f"Features used by the models are missing from {features_path}: {missing_features}"
+        )
+
+    logger.info(
+        f"Running {len(models)} models on {len(base_df):,} rows ({len(feature_names)} features)..."
+    )
+    for name, model in models.items():
+        model_pred_col = pred_col if len(models) == 1 else f"{pred_col}_{name}"
+        base_df = run_model(model, base_df, pred_col=model_pred_col)
+
+    return base_df
+
+
+def read_feature_table(
+    path, columns, id_col, start_date=None, end_date=None, ids=None, date_col="date"
+):
+    """Reads a CSV file, Parquet file, or folder of Parquet part files, keeping only the given columns (if they exist).
+
+    Dates are parsed, and rows are filtered to the date range and IDs, if given. For Parquet, the column pruning and
+    the filters are pushed down to the reads.
+    """
+    path = Path(path)
+    if path.suffix == ".csv":
+        header = pd.read_csv(path, nrows=0).columns
+        usecols = None if columns is None else [col for col in columns if col in header]
+        df = pd.read_csv(path, usecols=usecols)
+    else:
+        # Folders are read from their top-level part files (sub-folders hold the native-cadence tables)
+        sources = sorted(path.glob("part-*.parquet")) if path.is_dir() else str(path)
+        dataset = ds.dataset(sources, format="parquet")
+        if columns is not None:
+            columns = [col for col in columns if col in dataset.schema.names]
+
+        filters = []
+        if ids is not None:
+            filters.append(ds.field(id_col).isin(list(ids)))
+        if date_col in dataset.schema.names:
+            date_type = dataset.schema.field(date_col).type
+            # (Dates saved as strings are only filtered after reading)
+            if pa.types.is_timestamp(date_type) and start_date is not None:
+                start_scalar = pa.scalar(pd.Timestamp(start_date), type=date_type)
+                filters.append(ds.field(date_col) >= start_scalar)
+            if pa.types.is_timestamp(date_type) and end_date is not None:
+                end_scalar = pa.scalar(pd.Timestamp(end_date), type=date_type)
+                filters.append(ds.field(date_col) <= end_scalar)
+
+        table_filter = None
+        for dataset_filter in filters:
+            table_filter = (
+                dataset_filter
+                if table_filter is None
+                else table_filter & dataset_filter
+            )
+        df = dataset.to_table(columns=columns, filter=table_filter).to_pandas()
+
+    if ids is not None:
+        df = df[df[id_col].isin(ids)]
+    if date_col in df:
+        df[date_col] = pd.to_datetime(df[date_col])
+        if start_date is not None:
+            df = df[df[date_col] >= pd.Timestamp(start_date)]
+        if end_date is not None:
+            df = df[df[date_col] <= pd.Timestamp(end_date)]
+
+    return df.reset_index(drop=True)
+
+
+def get_model_names(model_paths):
+    """Names the models by their file name, or by folder and file name when file names repeat (e.g. best_model.pkl)."""
+    names = [Path(path).stem for path in model_paths]
+    if len(set(names)) < len(names):
+        names = [f"{Path(path).parent.name}_{Path(path).stem}" for path in model_paths]
+    return names
+
+
+def predict_sharded(
+    locations_df,
+    start_date,
+    end_date,
+    id_col,
+    hrsl_tif,
+    model_path,
+    out_dir,
+    shard_size=1000,
+    window_freq=None,
+    n_workers=1,
+    bbox_size_km=1,
+    pred_col="predicted_pm2.5",
+    shard_postprocessor=None,
+    hrsl_engine="zonal_stats",
+    tile_registry_dir=None,
+    feature_store_dir=None,
+    neighbor_config=None,
+):
+    """Streaming version of predict, for grids too large to hold in memory at once.
+
+    The work is split into chunks of shard_size locations, and if window_freq is given (a pandas frequency string,
+    e.g. "MS" for months), into time windows as well. For each chunk, the features are collected, the model is run,
+    and the predictions are written to their own Parquet part file in out_dir as soon as they're ready
+    (part-00000.parquet, or part-00000_<window start>.parquet with window_freq).
+    If given, shard_postprocessor(shard_df) is applied to the predictions before they are written
+    (with n_workers > 1, it has to be picklable, e.g. a module-level function).
+
+    Chunks are run by n_workers processes, each holding one chunk at a time, so peak memory is bounded by
+    n_workers x the chunk size. With time windows, pass a tile_registry_dir so the static features of a
+    shard are only computed for its first window.
+
+    Part files that already exist are skipped, so a failed or interrupted run can be resumed by re-running
+    with the same out_dir, shard_size, and window_freq.
+
+    Returns the list of part paths.
+    """
+    out_dir = Path(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+
+    model = load_model(model_path)
+    collect_kwargs = {
+        "id_col": id_col,
+        "bbox_size_km": bbox_size_km,
+        "hrsl_engine": hrsl_engine,
+        "tile_registry_dir": tile_registry_dir,
+        "feature_store_dir": feature_store_dir,
+        **get_required_sources(model, hrsl_tif, neighbor_config=neighbor_config),
+    }
+
+    if window_freq:
+        windows = job_manifest.generate_time_windows(
+            start_date, end_date, freq=window_freq
+        )
+    else:
+        windows = [(start_date, end_date)]
+
+    part_paths = []
+    chunks = []
+    shards = feature_collection_pipeline.split_into_shards(locations_df, shard_size)
+    for shard_index, shard_df in enumerate(shards):
+        for window_start, window_end in windows:
+            part_name = (
+                f"part-{shard_index:05d}_{window_start}.parquet"
+                if window_freq
+                else f"part-{shard_index:05d}.parquet"
+            )
+            part_path = out_dir / part_name
+            part_paths.append(part_path)
+            if not part_path.exists():
+                chunks.append((shard_df, window_start, window_end, part_path))
+
+    logger.info(
+        f"Running streaming prediction on {len(locations_df):,} locations from {start_date} to {end_date}: "
+        f"{len(chunks):,} of {len(part_paths):,} chunks ({shard_size:,} locations x {len(windows)} windows) left, "
+        f"{n_workers} workers"
+    )
+
+    # Build the summed-area table up front, so the workers don't all try to build it at once
+    if chunks and collect_kwargs["hrsl_tif"]:
+        if hrsl_engine == "sat" or collect_kwargs["population_scales_km"]:
+            hrsl.load_summed_area_table(collect_kwargs["hrsl_tif"])
+
+    worker_args = (model, collect_kwargs, pred_col, shard_postprocessor)
+    if n_workers <= 1:
+        _init_chunk_worker(*worker_args)
+        chunk_results = map(_predict_chunk, chunks)
+        _log_chunk_results(chunk_results, len(chunks))
+    else:
+        # Spawn (instead of fork) so that each worker starts with a clean GEE client
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(
+            n_workers, initializer=_init_chunk_worker, initargs=worker_args
+        ) as pool:
+            chunk_results = pool.imap_unordered(_predict_chunk, chunks)
+            _log_chunk_results(chunk_results, len(chunks))
+
+    return part_paths
+
+
+# Per-process state of the prediction workers (see _init_chunk_worker)
+_chunk_worker = {}
+
+
+def _init_chunk_worker(model, collect_kwargs, pred_col, shard_postprocessor):
+    gee_utils.gee_auth()
+    _chunk_worker.update(
+        model=model,
+        collect_kwargs=collect_kwargs,
+        pred_col=pred_col,
+        shard_postprocessor=shard_postprocessor,
+    )
+
+
+def _predict_chunk(chunk):
+    shard_df, window_start, window_end, part_path = chunk
+    shard_df = feature_collection_pipeline.collect_features_for_locations(
+        shard_df,
+        window_start,
+        window_end,
+        authenticate=False,
+        **_chunk_worker["collect_kwargs"],
+    )
+    shard_df = run_model(
+        _chunk_worker["model"], shard_df, pred_col=_chunk_worker["pred_col"]
+    )
+    if _chunk_worker["shard_postprocessor"]:
+        shard_df = _chunk_worker["shard_postprocessor"](shard_df)
+
+    # Write to a temp file first, so a crash never leaves a partial part behind (its existence marks the chunk as done)
+    tmp_path = part_path.with_suffix(".tmp")
+    shard_df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, part_path)
+
+    return part_path, len(shard_df)
+
+
+def _log_chunk_results(chunk_results, n_chunks):
+    for chunk_index, (part_path, n_rows) in enumerate(chunk_results):
+        logger.info(
+            f"Chunk {chunk_index+1} / {n_chunks}: saved {n_rows:,} predictions to {part_path}"
+        )
+
+
+def load_model(model_path):
+    """Loads a trained model, with its scaler, selector, and booster fused for fast inference (see fast_inference).
+
+    model_path is either a model artifact folder (loaded without pickle) or a joblib pickle of the pipeline.
+    The model's model_hash identifies it (e.g. for caching its predictions).
+    """
+    if fast_inference.is_artifact(model_path):
+        return fast_inference.load_artifact(model_path)
+
+    model = fast_inference.fuse_pipeline(joblib.load(model_path))
+    with open(model_path, "rb") as f:
+        model.model_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+    return model
+
+
+def get_required_sources(
+    model, hrsl_tif, gee_datasets=PREDICTION_GEE_DATASETS, neighbor_config=None
+):
+    """Works out, from the model's feature list, which feature sources need to be collected.
+
+    Returns the keyword args for collect_features_for_locations: the HRSL tif (None if population isn't used),
+    the multi-scale population bbox sizes, the temporal features config, the GEE dataset configs pruned
+    down to the datasets, bands, and aggregations the model uses (including the sources of the temporal features),
+    and the neighbor config (None if the model has no neighbor features).
+
+    neighbor_config holds the station_values_df of the neighbor features (see neighbors.collect_neighbor_features).
+    Their value_cols, k, and radius_km are filled in from the model's features.
+    Raises:
+        ValueError: If the model uses neighbor features and no neighbor_config is given
+    """
+    feature_names = model.feature_names  # This was saved from the train script
+    if not feature_collection_pipeline.uses_hrsl(feature_names):
+        hrsl_tif = None
+    population_scales_km = hrsl.parse_population_scales(feature_names)
+    temporal_config = temporal.parse_temporal_features(feature_names)
+    neighbor_params = neighbors.parse_neighbor_features(feature_names)
+    if neighbor_params and not neighbor_config:
+        raise ValueError(
+            "The model uses features from the nearest ground truth stations, "
+            "so the station values are needed (e.g. --stations-csv and --ground-truth-csv of predict.py)"
+        )
+    source_names = list(feature_names)
+    if temporal_config:
+        source_names += temporal.get_source_columns(temporal_config)
+    gee_datasets = feature_collection_pipeline.prune_gee_datasets(
+        gee_datasets, source_names
     )
+    logger.info(
+        f"Model uses {len(feature_names)} features. Collecting from {len(gee_datasets)} GEE datasets"
+        + (" and HRSL." if hrsl_tif else ".")
+    )
+    return {
+        "hrsl_tif": hrsl_tif,
+        "population_scales_km": population_scales_km,
+        "temporal_config": temporal_config,
+        "gee_datasets": gee_datasets,
+        "neighbor_config": {**neighbor_config, **neighbor_params}
+        if neighbor_params
+        else None,
+    }
+
 
-    logger.info("Running the model...")
+def get_feature_config(sources, bbox_size_km, hrsl_engine, pred_col):
+    """Returns what the predictions depend on besides the model, location, and date (for the prediction cache).
+
+    sources are the ones returned by get_required_sources. GEE datasets are identified by their feature store version.
+    """
+    return {
+        "gee_datasets": [
+            feature_store.get_feature_version(gee_dataset)
+            for gee_dataset in sources["gee_datasets"]
+        ],
+        # (The tif is identified by its name, size, and modification time, so replacing it starts a new cache)
+        "hrsl_tif": [
+            Path(sources["hrsl_tif"]).name,
+            os.path.getsize(sources["hrsl_tif"]),
+            os.path.getmtime(sources["hrsl_tif"]),
+        ]
+        if sources["hrsl_tif"]
+        else None,
+        "population_scales_km": sources["population_scales_km"],
+        "temporal_config": sources["temporal_config"],
+        "bbox_size_km": bbox_size_km,
+        "hrsl_engine": hrsl_engine,
+        "neighbor_config": sources["neighbor_config"],
+        "pred_col": pred_col,
+    }
 
-    # Load Model
-    model = joblib.load(model_path)
 
+def run_model(model, base_df, pred_col="predicted_pm2.5"):
     # Filter to only the relevant columns
     keep_cols = model.feature_names  # This was saved from the train script
     ml_df = base_df[keep_cols]
@@ -0,0 +1,141 @@
+"""Persistent cache of predictions, keyed by (model hash, feature version, location, date).
+
+Layout (Parquet, partitioned by month, see feature_store.write_month_parts):
+
+    <cache_dir>/<model hash>/<feature version>/month=<YYYY-MM>/part-<timestamp>-<uuid>.parquet
+
+The model hash identifies the trained model (see predict_utils.load_model), and the feature version is a hash of
+everything else the predictions depend on (see get_feature_version). Switching to a new model (or changing how the
+features are collected) reads from and writes to a new folder, so stale predictions are never served.
+
+The cached rows are the full output of predict (features and prediction), so cached and newly computed rows are
+interchangeable. Locations are matched on id_col, latitude, and longitude, so grids that reuse the same IDs don't mix.
+"""
+import hashlib
+import json
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from src.data_processing import feature_collection_pipeline, feature_store
+
+
+def get_feature_version(feature_config):
+    """Returns a hash of the feature config: a JSON-serializable dict of the feature sources and parameters.
+
+    DataFrames in it (e.g. the station values of a neighbor_config) are identified by a hash of their contents.
+    """
+    config_json = json.dumps(feature_config, sort_keys=True, default=_to_json)
+    return hashlib.md5(config_json.encode()).hexdigest()[:8]
+
+
+def get_cache_dir(cache_dir, model_hash, feature_version):
+    return Path(cache_dir) / model_hash / feature_version
+
+
+def predict_cached(
+    cache_dir,
+    model_hash,
+    feature_version,
+    locations_df,
+    start_date,
+    end_date,
+    id_col,
+    predict_fn,
+    date_col="date",
+):
+    """Returns the predictions for every location and date in the range, only computing the ones not in the cache.
+
+    predict_fn(locations_df, start_date, end_date) computes the predictions of the given locations and date range
+    (as predict_utils.predict does). Locations missing the same span of dates are computed together, and the new
+    predictions are added to the cache.
+
+    Returns:
+        dataframe: the predictions, sorted by id_col and date_col
+    """
+    version_dir = get_cache_dir(cache_dir, model_hash, feature_version)
+    key_cols = [id_col, "latitude", "longitude"]
+    locations_df = locations_df.drop_duplicates(key_cols)
+
+    cached_df = feature_store.read_month_parts(
+        version_dir,
+        id_col,
+        start_date=start_date,
+        end_date=end_date,
+        ids=locations_df[id_col].unique(),
+        date_col=date_col,
+        key_cols=key_cols,
+    )
+    if cached_df is not None:
+        cached_df = cached_df.merge(locations_df[key_cols], on=key_cols)
+
+    missing_df = find_missing_ranges(
+        cached_df, locations_df, start_date, end_date, id_col, date_col=date_col
+    )
+    n_cached = 0 if cached_df is None else len(cached_df)
+    logger.info(
+        f"Prediction cache {version_dir}: {n_cached:,} rows cached, "
+        f"{len(missing_df):,} / {len(locations_df):,} locations have dates to predict"
+    )
+
+    new_dfs = []
+    for (missing_start, missing_end), range_df in missing_df.groupby(
+        ["start_date", "end_date"]
+    ):
+        new_df = predict_fn(
+            locations_df.merge(range_df[key_cols], on=key_cols),
+            missing_start.strftime("%Y-%m-%d"),
+            missing_end.strftime("%Y-%m-%d"),
+        )
+        feature_store.write_month_parts(version_dir, new_df, date_col=date_col)
+        new_dfs.append(new_df)
+
+    # Newly computed rows take precedence over cached ones (their span may overlap some cached dates)
+    return (
+        pd.concat([cached_df, *new_dfs], ignore_index=True)
+        .drop_duplicates(subset=key_cols + [date_col], keep="last")
+        .sort_values(by=[id_col, date_col])
+        .reset_index(drop=True)
+    )
+
+
+def find_missing_ranges(
+    cached_df, locations_df, start_date, end_date, id_col, date_col="date"
+):
+    """Finds the locations with dates in [start_date, end_date] that aren't in cached_df (matched on id_col, latitude,
+    and longitude).
+
+    Returns:
+        dataframe: id_col, latitude, longitude, start_date, end_date columns: the span of missing dates of each such
+            location
+    """
+    key_cols = [id_col, "latitude", "longitude"]
+    cells_df = feature_collection_pipeline.generate_locations_with_dates_df(
+        locations_df[key_cols], start_date, end_date, id_col, date_col
+    )
+    if cached_df is not None and len(cached_df) > 0:
+        is_cached = (
+            cells_df.merge(
+                cached_df[key_cols + [date_col]],
+                on=key_cols + [date_col],
+                how="left",
+                indicator=True,
+            )["_merge"]
+            .eq("both")
+            .values
+        )
+        cells_df = cells_df[~is_cached]
+
+    return (
+        cells_df.groupby(key_cols, sort=False)[date_col]
+        .agg(start_date="min", end_date="max")
+        .reset_index()
+    )
+
+
+def _to_json(value):
+    if isinstance(value, pd.DataFrame):
+        values_hash = pd.util.hash_pandas_object(value, index=False).values
+        return hashlib.md5(values_hash.tobytes()).hexdigest()
+    return str(value)
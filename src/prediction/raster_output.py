@@ -0,0 +1,172 @@
+"""Gridded (raster) output of predictions on regular tile grids, as a time stack with one band per day.
+
+Instead of one CSV row per tile per day, the predictions of a regular lat/lon grid (e.g. a 1km grid of tile centroids)
+are written as a compressed, tiled raster, which GIS tools can read by spatial window and date without parsing text:
+- GeoTIFF (.tif): one band per day, with the date as the band description
+- NetCDF (.nc): a NetCDF-4 cube with a time dimension (written through GDAL's netCDF driver, so no extra dependency)
+
+Cells without a location (or a prediction) are NaN.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import rasterio
+from loguru import logger
+from rasterio import shutil as rio_shutil
+from rasterio.transform import Affine
+
+RASTER_DRIVERS = {".tif": "GTiff", ".tiff": "GTiff", ".nc": "netCDF"}
+# Compressed and tiled, so that spatial windows can be read without decompressing whole bands.
+# Band-interleaved, so that reading (or writing) one day doesn't decompress the blocks of all the other days.
+GTIFF_OPTIONS = {
+    "interleave": "band",
+    "compress": "deflate",
+    "predictor": 3,
+    "tiled": True,
+    "blockxsize": 256,
+    "blockysize": 256,
+    "bigtiff": "if_safer",
+}
+NETCDF_OPTIONS = {"format": "NC4", "compress": "deflate", "zlevel": 4}
+# Coordinates are snapped to this many decimals (~1cm) when looking for the grid spacing
+COORD_DECIMALS = 7
+# Max distance of a location from its grid cell center, as a fraction of the cell size
+GRID_TOLERANCE = 0.01
+
+
+def is_raster_path(out_path):
+    return out_path is not None and Path(out_path).suffix.lower() in RASTER_DRIVERS
+
+
+def detect_grid(lats, lons):
+    """Finds the regular grid that the (tile center) coordinates lie on.
+
+    Returns:
+        dict: transform (rasterio Affine of the grid cells), height, width, and the row and col of each location
+    Raises:
+        ValueError: If the locations aren't on a regular grid
+    """
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    # (A grid with a single row or column gets square cells)
+    res_y = _get_spacing(lats) or _get_spacing(lons) or 1.0
+    res_x = _get_spacing(lons) or res_y
+    lat_max, lon_min = lats.max(), lons.min()
+
+    rows = (lat_max - lats) / res_y
+    cols = (lons - lon_min) / res_x
+    off_grid = (np.abs(rows - np.round(rows)) > GRID_TOLERANCE) | (
+        np.abs(cols - np.round(cols)) > GRID_TOLERANCE
+    )
+    if off_grid.any():
+        raise ValueError(
+            f"{off_grid.sum():,} locations aren't on a regular grid "
+            f"(spacing {res_y:g} x {res_x:g} degrees). Use CSV output instead."
+        )
+
+    rows, cols = np.round(rows).astype(np.int64), np.round(cols).astype(np.int64)
+    return {
+        "transform": Affine(
+            res_x, 0, lon_min - res_x / 2, 0, -res_y, lat_max + res_y / 2
+        ),
+        "height": int(rows.max()) + 1,
+        "width": int(cols.max()) + 1,
+        "rows": rows,
+        "cols": cols,
+    }
+
+
+def write_raster(
+    results_df,
+    out_path,
+    value_col,
+    lat_col="latitude",
+    lon_col="longitude",
+    date_col="date",
+):
+    """Writes the value_col of results_df (one row per location and date) as a time stack raster, one band per day.
+
+    The format is picked from the out_path extension (see RASTER_DRIVERS). Bands are written one at a time,
+    so only one day of the grid is held in memory.
+    """
+    out_path = Path(out_path)
+    driver = RASTER_DRIVERS[out_path.suffix.lower()]
+
+    grid = detect_grid(results_df[lat_col], results_df[lon_col])
+    dates = pd.to_datetime(results_df[date_col])
+    band_dates = np.sort(dates.unique())
+    date_index = np.searchsorted(band_dates, dates.values)
+    values = results_df[value_col].to_numpy(dtype=np.float32)
+
+    # Rows of each band, in band order
+    order = np.argsort(date_index, kind="stable")
+    band_bounds = np.searchsorted(date_index[order], np.arange(len(band_dates) + 1))
+
+    logger.info(
+        f"Writing {value_col} to a {grid['height']:,} x {grid['width']:,} grid with {len(band_dates)} daily bands..."
+    )
+    os.makedirs(out_path.parent, exist_ok=True)
+    # NetCDF is converted from a GeoTIFF, since GDAL only writes the time dimension when copying a dataset
+    tif_path = out_path if driver == "GTiff" else out_path.with_suffix(".tmp.tif")
+    profile = {
+        "driver": "GTiff",
+        "height": grid["height"],
+        "width": grid["width"],
+        "count": len(band_dates),
+        "dtype": "float32",
+        "crs": "EPSG:4326",
+        "transform": grid["transform"],
+        "nodata": np.nan,
+        **GTIFF_OPTIONS,
+    }
+    band = np.empty((grid["height"], grid["width"]), dtype=np.float32)
+    try:
+        with rasterio.open(tif_path, "w", **profile) as dst:
+            for band_index, band_date in enumerate(band_dates):
+                band_rows = order[band_bounds[band_index] : band_bounds[band_index + 1]]
+                band.fill(np.nan)
+                band[grid["rows"][band_rows], grid["cols"][band_rows]] = values[
+                    band_rows
+                ]
+                dst.write(band, band_index + 1)
+                dst.set_band_description(
+                    band_index + 1, pd.Timestamp(band_date).strftime("%Y-%m-%d")
+                )
+                if driver == "netCDF":
+                    dst.update_tags(
+                        band_index + 1,
+                        NETCDF_VARNAME=value_col,
+                        NETCDF_DIM_time=str(_to_days(band_date)),
+                    )
+            if driver == "netCDF":
+                days = ",".join(str(_to_days(band_date)) for band_date in band_dates)
+                dst.update_tags(
+                    NETCDF_DIM_EXTRA="{time}",
+                    NETCDF_DIM_time_DEF=f"{{{len(band_dates)},6}}",
+                    NETCDF_DIM_time_VALUES=f"{{{days}}}",
+                    **{
+                        "time#units": "days since 1970-01-01",
+                        "time#calendar": "standard",
+                        "time#standard_name": "time",
+                    },
+                )
+
+        if driver == "netCDF":
+            rio_shutil.copy(tif_path, out_path, driver="netCDF", **NETCDF_OPTIONS)
+    finally:
+        # The temp GeoTIFF is removed even if the writing or the copy failed
+        if driver == "netCDF" and tif_path.exists():
+            os.remove(tif_path)
+
+    return out_path
+
+
+def _get_spacing(coords):
+    # Smallest gap between the distinct coordinates (None if they're all the same)
+    gaps = np.diff(np.unique(np.round(coords, COORD_DECIMALS)))
+    return float(gaps.min()) if len(gaps) > 0 else None
+
+
+def _to_days(date):
+    return int((pd.Timestamp(date) - pd.Timestamp("1970-01-01")).days)
@@ -0,0 +1,304 @@
+"""Precomputed multi-resolution rollups of predictions, for maps of large grids.
+
+The period means of each tile are computed with one groupby. They're then aggregated into coarser levels by grouping
+the tiles into the web mercator (quadkey) cells that contain them, like a map tile pyramid: zoom level z has
+2^z x 2^z cells, and the parent of cell (x, y) at zoom z - 1 is (x // 2, y // 2). Each level is the mean of the tile
+means in its cells, so every level gives each tile the same weight.
+
+Layout (Parquet, one folder per level):
+
+    <rollup_dir>/rollup.json  (id_col, value_cols, freq, zooms, bbox_size_km)
+    <rollup_dir>/level=tiles/part-0.parquet  (id_col, latitude, longitude, [period], value_cols, n_days)
+    <rollup_dir>/level=<zoom>/part-0.parquet  (tile_x, tile_y, quadkey, [period], value_cols, n_tiles)
+
+Rows are sorted by latitude (tile_y), so the extent filters of read_rollup skip most row groups. A map then only reads
+the level that matches its extent (see choose_level) and the cells in view, instead of dissolving every tile.
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from loguru import logger
+
+from src.data_processing import geom_utils
+
+METADATA_FILENAME = "rollup.json"
+TILES_LEVEL = "tiles"
+# Cells of ~2.3km (zoom 14) up to ~150km (zoom 8) at Thailand's latitudes
+DEFAULT_ZOOMS = [14, 13, 12, 11, 10, 9, 8]
+ROW_GROUP_SIZE = 50000
+# Latitude limit of the web mercator projection
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def compute_period_means(results_df, id_col, value_cols, freq=None, date_col="date"):
+    """Returns the mean of value_cols per tile, and per period if freq is given (a pandas period frequency, e.g. "M").
+
+    Periods are identified by their start date (period column). n_days is the number of days averaged.
+    """
+    keys = [id_col]
+    if freq:
+        periods = pd.to_datetime(results_df[date_col]).dt.to_period(freq).dt.start_time
+        results_df = results_df.assign(period=periods)
+        keys.append("period")
+
+    aggregations = {col: (col, "mean") for col in value_cols}
+    return (
+        results_df.groupby(keys, sort=True)
+        .agg(
+            latitude=("latitude", "first"),
+            longitude=("longitude", "first"),
+            **aggregations,
+            n_days=(date_col, "size"),
+        )
+        .reset_index()
+    )
+
+
+def get_tile_xy(lats, lons, zoom):
+    """Returns the (x, y) web mercator cells at the zoom level that contain the coordinates."""
+    lats = np.clip(
+        np.asarray(lats, dtype=np.float64), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT
+    )
+    lons = np.asarray(lons, dtype=np.float64)
+    n_cells = 2**zoom
+    lat_radians = np.radians(lats)
+    x = np.floor((lons + 180) / 360 * n_cells)
+    y = np.floor(
+        (1 - np.log(np.tan(lat_radians) + 1 / np.cos(lat_radians)) / np.pi)
+        / 2
+        * n_cells
+    )
+    return (
+        np.clip(x, 0, n_cells - 1).astype(np.int64),
+        np.clip(y, 0, n_cells - 1).astype(np.int64),
+    )
+
+
+def get_tile_bounds(x, y, zoom):
+    """Returns the (n, 4) array of minx, miny, maxx, maxy of the web mercator cells at the zoom level."""
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    n_cells = 2**zoom
+
+    def to_lat(y):
+        return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n_cells))))
+
+    return np.column_stack(
+        [
+            x / n_cells * 360 - 180,
+            to_lat(y + 1),
+            (x + 1) / n_cells * 360 - 180,
+            to_lat(y),
+        ]
+    )
+
+
+def to_quadkey(x, y, zoom):
+    """Returns the quadkey strings of the cells (one base-4 digit per zoom level, see Bing Maps' tile system)."""
+    x, y = np.asarray(x, dtype=np.int64), np.asarray(y, dtype=np.int64)
+    quadkeys = np.full(len(x), "", dtype=f"<U{max(zoom, 1)}")
+    for shift in range(zoom - 1, -1, -1):
+        digits = ((x >> shift) & 1) + 2 * ((y >> shift) & 1)
+        quadkeys = np.char.add(quadkeys, digits.astype(str))
+    return quadkeys
+
+
+def build_levels(tile_means_df, value_cols, zooms=DEFAULT_ZOOMS):
+    """Aggregates the tile means into the web mercator cells of each zoom level (finest first).
+
+    Each level is computed from the previous (finer) one, by summing the value sums and tile counts of the child cells.
+
+    Returns:
+        dict: zoom -> dataframe of tile_x, tile_y, quadkey, [period], value_cols (means), n_tiles
+    """
+    zooms = sorted(zooms, reverse=True)
+    period_cols = ["period"] if "period" in tile_means_df else []
+
+    x, y = get_tile_xy(tile_means_df["latitude"], tile_means_df["longitude"], zooms[0])
+    cells_df = tile_means_df[period_cols].assign(tile_x=x, tile_y=y, n_tiles=1)
+    for col in value_cols:
+        values = tile_means_df[col].to_numpy(dtype=np.float64)
+        cells_df[f"{col}_sum"] = np.nan_to_num(values)
+        cells_df[f"{col}_count"] = (~np.isnan(values)).astype(np.int64)
+
+    levels = {}
+    prev_zoom = zooms[0]
+    for zoom in zooms:
+        # Parent cells of the previous level's cells
+        shift = prev_zoom - zoom
+        cells_df = (
+            cells_df.assign(
+                tile_x=cells_df["tile_x"].values >> shift,
+                tile_y=cells_df["tile_y"].values >> shift,
+            )
+            .groupby(period_cols + ["tile_x", "tile_y"], sort=False)
+            .sum()
+            .reset_index()
+        )
+        prev_zoom = zoom
+
+        level_df = cells_df[period_cols + ["tile_x", "tile_y"]].assign(
+            quadkey=to_quadkey(cells_df["tile_x"], cells_df["tile_y"], zoom)
+        )
+        for col in value_cols:
+            counts = cells_df[f"{col}_count"].to_numpy()
+            level_df[col] = np.where(
+                counts > 0, cells_df[f"{col}_sum"] / np.maximum(counts, 1), np.nan
+            )
+        level_df["n_tiles"] = cells_df["n_tiles"].values
+        levels[zoom] = level_df
+
+    return levels
+
+
+def write_rollups(
+    results_df,
+    rollup_dir,
+    id_col,
+    value_cols,
+    freq=None,
+    zooms=DEFAULT_ZOOMS,
+    bbox_size_km=1,
+    date_col="date",
+):
+    """Computes the tile means and the levels of the predictions in results_df, and saves them to rollup_dir.
+
+    An existing rollup in rollup_dir is replaced.
+    """
+    rollup_dir = Path(rollup_dir)
+    tile_means_df = compute_period_means(
+        results_df, id_col, value_cols, freq=freq, date_col=date_col
+    )
+    levels = build_levels(tile_means_df, value_cols, zooms=zooms)
+    logger.info(
+        f"Built rollups of {len(tile_means_df):,} tile means: "
+        + ", ".join(f"zoom {zoom}: {len(df):,} cells" for zoom, df in levels.items())
+    )
+
+    if rollup_dir.exists():
+        shutil.rmtree(rollup_dir)
+    _write_level(
+        rollup_dir, TILES_LEVEL, tile_means_df, sort_cols=["latitude", "longitude"]
+    )
+    for zoom, level_df in levels.items():
+        _write_level(rollup_dir, zoom, level_df, sort_cols=["tile_y", "tile_x"])
+
+    metadata = {
+        "id_col": id_col,
+        "value_cols": list(value_cols),
+        "freq": freq,
+        "zooms": sorted(levels, reverse=True),
+        "bbox_size_km": bbox_size_km,
+    }
+    with open(rollup_dir / METADATA_FILENAME, "w") as f:
+        json.dump(metadata, f, indent=4)
+
+    return rollup_dir
+
+
+def read_metadata(rollup_dir):
+    with open(Path(rollup_dir) / METADATA_FILENAME) as f:
+        return json.load(f)
+
+
+def choose_level(rollup_dir, bounds, max_cells=5000):
+    """Returns the finest level to show for an extent (minx, miny, maxx, maxy) with at most about max_cells cells.
+
+    That's the tiles themselves if even the finest zoom level has under a quarter of max_cells cells in the extent
+    (so the tiles, which are smaller, likely fit as well).
+    """
+    zooms = read_metadata(rollup_dir)["zooms"]
+    for zoom in zooms:
+        n_cells = _count_cells(bounds, zoom)
+        if n_cells <= max_cells:
+            return (
+                TILES_LEVEL if zoom == zooms[0] and n_cells * 4 <= max_cells else zoom
+            )
+    return zooms[-1]
+
+
+def read_rollup(rollup_dir, level, bounds=None, period=None):
+    """Reads the cells of a level (a zoom level or "tiles") in the extent (minx, miny, maxx, maxy) and period, if given.
+
+    The filters are pushed down to the Parquet reads.
+
+    Raises:
+        ValueError: If a period is given, and the rollup was built without a freq
+
+    Returns:
+        geodataframe: the cells with their polygon geometries (EPSG:4326)
+    """
+    metadata = read_metadata(rollup_dir)
+    dataset = ds.dataset(
+        Path(rollup_dir) / f"level={level}", format="parquet", partitioning=None
+    )
+
+    filters = []
+    if bounds is not None:
+        minx, miny, maxx, maxy = bounds
+        if level == TILES_LEVEL:
+            filters += [
+                ds.field("longitude") >= minx,
+                ds.field("longitude") <= maxx,
+                ds.field("latitude") >= miny,
+                ds.field("latitude") <= maxy,
+            ]
+        else:
+            # (y grows southwards)
+            min_x, min_y = get_tile_xy([maxy], [minx], level)
+            max_x, max_y = get_tile_xy([miny], [maxx], level)
+            filters += [
+                ds.field("tile_x") >= int(min_x[0]),
+                ds.field("tile_x") <= int(max_x[0]),
+                ds.field("tile_y") >= int(min_y[0]),
+                ds.field("tile_y") <= int(max_y[0]),
+            ]
+    if period is not None:
+        if not metadata["freq"]:
+            raise ValueError(
+                f"Rollup {rollup_dir} has no periods (it was built without a freq), so it can't be read for period {period}"
+            )
+        period_type = dataset.schema.field("period").type
+        filters.append(
+            ds.field("period") == pa.scalar(pd.Timestamp(period), type=period_type)
+        )
+
+    table_filter = None
+    for dataset_filter in filters:
+        table_filter = (
+            dataset_filter if table_filter is None else table_filter & dataset_filter
+        )
+    level_df = dataset.to_table(filter=table_filter).to_pandas()
+
+    if level == TILES_LEVEL:
+        cell_bounds = geom_utils.generate_bbox_bounds(
+            level_df["latitude"], level_df["longitude"], metadata["bbox_size_km"]
+        )
+    else:
+        cell_bounds = get_tile_bounds(level_df["tile_x"], level_df["tile_y"], level)
+    return gpd.GeoDataFrame(
+        level_df,
+        geometry=geom_utils.generate_bbox_geometries(cell_bounds),
+        crs="EPSG:4326",
+    )
+
+
+def _count_cells(bounds, zoom):
+    minx, miny, maxx, maxy = bounds
+    min_x, min_y = get_tile_xy([maxy], [minx], zoom)
+    max_x, max_y = get_tile_xy([miny], [maxx], zoom)
+    return int((max_x[0] - min_x[0] + 1) * (max_y[0] - min_y[0] + 1))
+
+
+def _write_level(rollup_dir, level, level_df, sort_cols):
+    out_dir = Path(rollup_dir) / f"level={level}"
+    os.makedirs(out_dir, exist_ok=True)
+    level_df.sort_values(by=sort_cols).to_parquet(
+        out_dir / "part-0.parquet", index=False, row_group_size=ROW_GROUP_SIZE
+    )
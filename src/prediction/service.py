@@ -0,0 +1,404 @@
+"""Long-running local prediction service, so the model and features stay warm between requests.
+
+The service keeps the model, the static per-location features, and an LRU cache of the features of recently
+requested (location, date) cells in memory. Only the cells missing from the cache are collected, through a
+feature backend:
+- GEEFeatureBackend collects them with feature_collection_pipeline (as predict does)
+- ReplayFeatureBackend reads them from a saved features table (e.g. from generate_features.py), for tests and offline runs
+
+Cells the backend has no features for (e.g. not in the replayed table) get a null prediction, and aren't cached.
+
+HTTP endpoints (JSON):
+- POST /predict with {"rows": [{<id_col>: ..., "latitude": ..., "longitude": ..., "date": "YYYY-MM-DD"}, ...]}
+  (400 for invalid rows, 500 with the error if the features or the model fail)
+- GET /stats for the request counts, cache hit rate, and latency percentiles
+- GET /health
+"""
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from src.data_processing import feature_collection_pipeline
+from src.data_processing.gee import gee_utils
+from src.prediction import predict_utils
+
+REQUEST_COLS = ["latitude", "longitude", "date"]
+# Number of most recent requests the latency percentiles are computed over
+LATENCY_WINDOW = 10000
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+class GEEFeatureBackend:
+    """Collects features the same way as predict_utils.predict, keeping the static features of seen locations in memory.
+
+    For models with neighbor features, neighbor_config holds the station values (see predict_utils.get_required_sources).
+    """
+
+    def __init__(
+        self,
+        model,
+        hrsl_tif,
+        id_col,
+        bbox_size_km=1,
+        hrsl_engine="sat",
+        tile_registry_dir=None,
+        feature_store_dir=None,
+        neighbor_config=None,
+    ):
+        self.id_col = id_col
+        self.bbox_size_km = bbox_size_km
+        self.hrsl_engine = hrsl_engine
+        self.tile_registry_dir = tile_registry_dir
+        self.feature_store_dir = feature_store_dir
+        self.sources = predict_utils.get_required_sources(
+            model, hrsl_tif, neighbor_config=neighbor_config
+        )
+        self.static_df = None
+
+        gee_utils.gee_auth()
+
+    def get_features(self, cells_df):
+        """Returns the features of the (id_col, latitude, longitude, date) cells.
+
+        Each location's dates are split into runs of consecutive days, and the locations with the same run are collected
+        together, so only the requested cells are collected (and not every location over the whole span of dates).
+        """
+        location_cols = [self.id_col, "latitude", "longitude"]
+        cells_df = cells_df.drop_duplicates().sort_values(by=location_cols + ["date"])
+        is_new_run = (~cells_df.duplicated(location_cols).values) | (
+            cells_df["date"].diff() != pd.Timedelta(days=1)
+        ).values
+        runs_df = cells_df.assign(run=np.cumsum(is_new_run))
+        runs_df = runs_df.groupby("run").agg(
+            **{col: (col, "first") for col in location_cols},
+            start_date=("date", "min"),
+            end_date=("date", "max"),
+        )
+
+        base_dfs = []
+        for (start_date, end_date), locations_df in runs_df.groupby(
+            ["start_date", "end_date"]
+        ):
+            base_dfs.append(
+                feature_collection_pipeline.collect_features_for_locations(
+                    locations_df[location_cols],
+                    start_date.strftime("%Y-%m-%d"),
+                    end_date.strftime("%Y-%m-%d"),
+                    self.id_col,
+                    hrsl_tif=None,
+                    bbox_size_km=self.bbox_size_km,
+                    feature_store_dir=self.feature_store_dir,
+                    gee_datasets=self.sources["gee_datasets"],
+                    temporal_config=self.sources["temporal_config"],
+                    neighbor_config=self.sources["neighbor_config"],
+                    authenticate=False,
+                )
+            )
+        base_df = pd.concat(base_dfs, ignore_index=True)
+        if self.sources["hrsl_tif"] is None:
+            return base_df
+
+        return base_df.merge(
+            self.get_static_features(cells_df[location_cols].drop_duplicates()),
+            on=location_cols,
+            how="left",
+        )
+
+    def get_static_features(self, locations_df):
+        # Keyed by id, latitude, and longitude (as in tile_registry.lookup_tiles)
+        key_cols = [self.id_col, "latitude", "longitude"]
+        if self.static_df is None:
+            new_locations_df = locations_df
+        else:
+            is_new = (
+                locations_df.merge(
+                    self.static_df[key_cols], on=key_cols, how="left", indicator=True
+                )["_merge"]
+                .eq("left_only")
+                .values
+            )
+            new_locations_df = locations_df[is_new]
+
+        # The static features are merged by id, so an id with several coordinates is collected once per coordinates
+        for _, batch_df in new_locations_df.groupby(
+            new_locations_df.groupby(self.id_col).cumcount()
+        ):
+            batch_static_df = feature_collection_pipeline.collect_static_features(
+                batch_df,
+                self.sources["hrsl_tif"],
+                self.id_col,
+                self.bbox_size_km,
+                hrsl_engine=self.hrsl_engine,
+                population_scales_km=self.sources["population_scales_km"],
+                tile_registry_dir=self.tile_registry_dir,
+            ).drop(columns=[self.id_col])
+            # (The static features are in the same order as the locations)
+            batch_static_df = pd.concat(
+                [
+                    batch_df[key_cols].reset_index(drop=True),
+                    batch_static_df.reset_index(drop=True),
+                ],
+                axis=1,
+            )
+            self.static_df = pd.concat(
+                [self.static_df, batch_static_df], ignore_index=True
+            )
+
+        return locations_df[key_cols].merge(self.static_df, on=key_cols, how="left")
+
+
+class ReplayFeatureBackend:
+    """Serves features from a saved features table (CSV or Parquet) with id_col and date columns, without calling GEE."""
+
+    def __init__(self, features_path, id_col, date_col="date"):
+        features_path = Path(features_path)
+        if features_path.suffix == ".csv":
+            features_df = pd.read_csv(features_path)
+        else:
+            features_df = pd.read_parquet(features_path)
+        features_df[date_col] = pd.to_datetime(features_df[date_col])
+
+        self.id_col = id_col
+        self.date_col = date_col
+        self.features_df = features_df.drop(
+            columns=["latitude", "longitude"], errors="ignore"
+        ).drop_duplicates([id_col, date_col])
+        self.n_calls = 0
+
+    def get_features(self, cells_df):
+        """Returns the features of the (id_col, latitude, longitude, date) cells that are in the table."""
+        self.n_calls += 1
+        return cells_df.rename(columns={"date": self.date_col}).merge(
+            self.features_df, on=[self.id_col, self.date_col], how="inner"
+        )
+
+
+class PredictionService:
+    """Predicts batches of (id, latitude, longitude, date) rows with a warm model and feature cache.
+
+    Args:
+        model: Trained model with a feature_names attribute (as saved by the train script)
+        feature_backend: GEEFeatureBackend or ReplayFeatureBackend
+        cache_size (int): Max number of (location, date) feature rows kept in memory
+    """
+
+    def __init__(
+        self,
+        model,
+        feature_backend,
+        id_col,
+        cache_size=1000000,
+        pred_col="predicted_pm2.5",
+    ):
+        self.model = model
+        self.feature_backend = feature_backend
+        self.id_col = id_col
+        self.cache_size = cache_size
+        self.pred_col = pred_col
+
+        # (id, latitude, longitude, date) -> feature values, in model.feature_names order
+        self.feature_cache = OrderedDict()
+        # Requests are served one at a time (the model and GEE client are shared)
+        self.lock = threading.Lock()
+
+        self.n_requests = 0
+        self.n_rows = 0
+        self.n_cache_hits = 0
+        self.latencies_ms = {
+            stage: deque(maxlen=LATENCY_WINDOW)
+            for stage in ["features", "model", "total"]
+        }
+
+    def parse_requests(self, requests_df):
+        """Returns the requested rows with parsed coordinates and dates (times are dropped).
+
+        Raises:
+            ValueError: If a column is missing, or a coordinate or date can't be parsed
+        """
+        missing_cols = {self.id_col, *REQUEST_COLS} - set(requests_df.columns)
+        if missing_cols:
+            raise ValueError(f"Rows are missing {sorted(missing_cols)}")
+
+        requests_df = requests_df[[self.id_col] + REQUEST_COLS]
+        try:
+            return requests_df.assign(
+                latitude=requests_df["latitude"].astype(np.float64),
+                longitude=requests_df["longitude"].astype(np.float64),
+                date=pd.to_datetime(requests_df["date"]).dt.normalize(),
+            )
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid coordinates or dates: {e}") from e
+
+    def predict(self, requests_df):
+        """Returns the predictions for the requested rows, in the same order, as a DF of id_col, date, and pred_col.
+
+        Rows without features get a NaN prediction.
+        """
+        return self.predict_parsed(self.parse_requests(requests_df))
+
+    def predict_parsed(self, requests_df):
+        """Same as predict, for rows already parsed with parse_requests."""
+        start_time = time.perf_counter()
+        keys = list(
+            zip(
+                requests_df[self.id_col],
+                requests_df["latitude"],
+                requests_df["longitude"],
+                requests_df["date"],
+            )
+        )
+
+        with self.lock:
+            features = self.get_features(requests_df, keys)
+            features_time = time.perf_counter()
+
+            has_features = ~np.isnan(features).all(axis=1)
+            ml_df = pd.DataFrame(
+                features[has_features], columns=self.model.feature_names
+            )
+            preds = np.full(len(keys), np.nan)
+            if has_features.any():
+                preds[has_features] = predict_utils.run_model(
+                    self.model, ml_df, pred_col=self.pred_col
+                )[self.pred_col].values
+            end_time = time.perf_counter()
+
+            self.n_requests += 1
+            self.n_rows += len(requests_df)
+            self.latencies_ms["features"].append((features_time - start_time) * 1000)
+            self.latencies_ms["model"].append((end_time - features_time) * 1000)
+            self.latencies_ms["total"].append((end_time - start_time) * 1000)
+
+        return pd.DataFrame(
+            {
+                self.id_col: requests_df[self.id_col].values,
+                "date": requests_df["date"].values,
+                self.pred_col: preds,
+            }
+        )
+
+    def get_features(self, requests_df, keys):
+        features = np.full((len(keys), len(self.model.feature_names)), np.nan)
+        is_missing = np.ones(len(keys), dtype=bool)
+        for row_index, key in enumerate(keys):
+            cached = self.feature_cache.get(key)
+            if cached is not None:
+                self.feature_cache.move_to_end(key)
+                features[row_index] = cached
+                is_missing[row_index] = False
+        self.n_cache_hits += int((~is_missing).sum())
+
+        if is_missing.any():
+            # Collect only the missing (location, date) cells
+            base_df = self.feature_backend.get_features(requests_df[is_missing])
+            base_keys = zip(
+                base_df[self.id_col],
+                base_df["latitude"],
+                base_df["longitude"],
+                pd.to_datetime(base_df["date"]).dt.normalize(),
+            )
+            base_features = base_df.reindex(columns=self.model.feature_names).to_numpy(
+                dtype=np.float64
+            )
+            # Cells without any feature value weren't found by the backend, so they're neither predicted nor cached
+            has_features = ~np.isnan(base_features).all(axis=1)
+            collected = {
+                key: row_features
+                for key, row_features, is_found in zip(
+                    base_keys, base_features, has_features
+                )
+                if is_found
+            }
+
+            for row_index in np.flatnonzero(is_missing):
+                if keys[row_index] in collected:
+                    features[row_index] = collected[keys[row_index]]
+            self.add_to_cache(collected)
+
+        return features
+
+    def add_to_cache(self, collected):
+        self.feature_cache.update(collected)
+        while len(self.feature_cache) > self.cache_size:
+            self.feature_cache.popitem(last=False)
+
+    def get_stats(self):
+        stats = {
+            "n_requests": self.n_requests,
+            "n_rows": self.n_rows,
+            "cache_hit_rate": self.n_cache_hits / self.n_rows if self.n_rows else None,
+            "cache_rows": len(self.feature_cache),
+        }
+        for stage, latencies_ms in self.latencies_ms.items():
+            if not latencies_ms:
+                continue
+            percentiles = np.percentile(latencies_ms, LATENCY_PERCENTILES)
+            for percentile, latency_ms in zip(LATENCY_PERCENTILES, percentiles):
+                stats[f"{stage}_p{percentile}_ms"] = round(float(latency_ms), 3)
+        return stats
+
+
+def load_service(model_path, feature_backend_fn, id_col, **kwargs):
+    """Loads the model once and builds the service. feature_backend_fn(model) returns the feature backend."""
+    logger.info(f"Loading model from {model_path}...")
+    model = predict_utils.load_model(model_path)
+    return PredictionService(model, feature_backend_fn(model), id_col, **kwargs)
+
+
+def make_server(service, host="127.0.0.1", port=8000):
+    """Returns an HTTP server for the service (call serve_forever() on it)."""
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/health":
+                self.send_json(200, {"status": "ok"})
+            elif self.path == "/stats":
+                self.send_json(200, service.get_stats())
+            else:
+                self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self.send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+
+            try:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                requests_df = service.parse_requests(
+                    pd.DataFrame(json.loads(body)["rows"])
+                )
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_json(400, {"error": str(e)})
+                return
+
+            try:
+                preds_df = service.predict_parsed(requests_df)
+            except Exception as e:
+                logger.exception("Prediction failed")
+                self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+                return
+
+            preds_df["date"] = preds_df["date"].dt.strftime("%Y-%m-%d")
+            # (Rows without features have a null prediction)
+            preds_df = preds_df.astype(object).where(preds_df.notna(), None)
+            self.send_json(200, {"predictions": preds_df.to_dict(orient="records")})
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return ThreadingHTTPServer((host, port), RequestHandler)